@@ -2,16 +2,27 @@ import datetime
 from typing import Annotated, Union
 
 from pydantic import BaseModel
+from sqlalchemy import JSON, Index
 from sqlmodel import Field, Relationship, SQLModel
 
 
 def _now():
-    return datetime.datetime.fromtimestamp(
-        datetime.datetime.now().timestamp(), datetime.UTC
-    )
+    # naive UTC: columns are `timestamp without time zone`, and asyncpg refuses
+    # aware datetimes for them
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
 
 
 class UserFavoriteArtwork(SQLModel, table=True):
+    # for keyset pagination of user's favorites
+    __table_args__ = (
+        Index(
+            "ix_userfavoriteartwork_user_id_favorited_at",
+            "user_id",
+            "favorited_at",
+            "artwork_id",
+        ),
+    )
+
     user_id: Annotated[int, Field(foreign_key="user.id", primary_key=True)]
     user: "User" = Relationship()
     artwork_id: Annotated[int, Field(foreign_key="artwork.id", primary_key=True)]
@@ -25,6 +36,19 @@ class UserFavoriteArtworkPublic(BaseModel):
     favorited_at: datetime.datetime
 
 
+class FavoriteBatch(BaseModel):
+    """(un)favorite many artworks at once"""
+
+    artwork_ids: Annotated[list[int], Field(min_length=1, max_length=100)]
+    favorited: bool
+
+
+class FavoriteStatus(BaseModel):
+    artwork_id: int
+    favorited: bool
+    favorite_count: int
+
+
 class UserBase(SQLModel):
     username: Annotated[str, Field(index=True, unique=True)]
     email: Annotated[str, Field(unique=True)]
@@ -72,15 +96,63 @@ class ArtworkBase(SQLModel):
     width: int
     height: int
 
+    # denormalized counts, updated with the favorite / comment (in same transaction)
+    # and fixed by `jobs.reconcile_counters` if they drift
+    favorite_count: int = 0
+    comment_count: int = 0
+
     created_at: datetime.datetime = Field(default_factory=_now)
     updated_at: datetime.datetime = Field(default_factory=_now)
 
 
+class Blob(SQLModel, table=True):
+    """Uploaded file stored by content (see `libs/blobs.py`), shared by artworks with same bytes"""
+
+    sha256: Annotated[str, Field(primary_key=True)]
+    # path: relative to upload dir
+    path: str
+    size: int
+    ref_count: int = 0
+    created_at: datetime.datetime = Field(default_factory=_now)
+
+
+class TrendingScore(SQLModel, table=True):
+    """Time-decayed activity of artwork, updated with favorites / comments
+    (see `libs/trending.py`). artworks without recent activity have no row
+    """
+
+    # for sorting by trending
+    __table_args__ = (
+        Index("ix_trendingscore_score_artwork_id", "score", "artwork_id"),
+    )
+
+    artwork_id: Annotated[int, Field(foreign_key="artwork.id", primary_key=True)]
+    # log of decayed score, scaled to fixed epoch, so it never has to be rewritten
+    score: float
+    updated_at: datetime.datetime = Field(default_factory=_now)
+
+
 class Artwork(ArtworkBase, table=True):
+    # for keyset pagination of gallery / user's artworks
+    __table_args__ = (
+        Index("ix_artwork_created_at_id", "created_at", "id"),
+        Index("ix_artwork_author_id_created_at_id", "author_id", "created_at", "id"),
+        # for sorting by popularity
+        Index("ix_artwork_favorite_count_id", "favorite_count", "id"),
+    )
+
     id: Annotated[int | None, Field(primary_key=True)] = None
 
     author_id: Annotated[int | None, Field(index=True, foreign_key="user.id")] = None
     author: User | None = Relationship(back_populates="artworks")
+    # None for artworks uploaded before content-addressed storage
+    blob_sha256: Annotated[str | None, Field(index=True, foreign_key="blob.sha256")] = (
+        None
+    )
+    # shown until image loads, see `libs/placeholders.py`. None until computed
+    dominant_color: str | None = None
+    # `data:` URI of tiny blurred image
+    placeholder: str | None = None
     favoriting_users: list["User"] = Relationship(
         back_populates="favorite_artworks",
         link_model=UserFavoriteArtwork,
@@ -88,6 +160,29 @@ class Artwork(ArtworkBase, table=True):
     )
 
     comments: list["Comment"] = Relationship(back_populates="artwork")
+    renditions: list["ArtworkRendition"] = Relationship(
+        back_populates="artwork",
+        sa_relationship_kwargs={"cascade": "all, delete-orphan"},
+    )
+    trending: TrendingScore | None = Relationship(
+        sa_relationship_kwargs={"uselist": False, "cascade": "all, delete-orphan"},
+    )
+
+
+class ArtworkRendition(SQLModel, table=True):
+    """Resized copy of artwork image, generated after upload (see `libs/renditions.py`)"""
+
+    id: Annotated[int | None, Field(primary_key=True)] = None
+    artwork_id: Annotated[int, Field(index=True, foreign_key="artwork.id")]
+    artwork: Artwork = Relationship(back_populates="renditions")
+
+    # format: file extension, e.g. 'webp', 'jpeg'
+    format: str
+    width: int
+    height: int
+    # path: relative to upload dir, like `Artwork.path`
+    path: str
+    file_size: int
 
 
 class ArtworkPublic(ArtworkBase):
@@ -97,12 +192,24 @@ class ArtworkPublic(ArtworkBase):
     author: UserPublic | None
 
 
+class ArtworkListItem(ArtworkPublic):
+    """`ArtworkPublic` in listings, with state of current user (see `libs/favorites.py`)"""
+
+    # None when not logged in
+    favorited_by_me: bool | None = None
+
+
 class ArtworkUpdate(BaseModel):
     name: str
     description: str
 
 
 class Comment(SQLModel, table=True):
+    # for listing comments of artwork, newest first
+    __table_args__ = (
+        Index("ix_comment_artwork_id_created_at_id", "artwork_id", "created_at", "id"),
+    )
+
     id: Annotated[int | None, Field(primary_key=True)] = None
     text: Annotated[str, Field()]
     created_at: datetime.datetime = Field(default_factory=_now)
@@ -132,3 +239,39 @@ class ArtworkDetailed(ArtworkBase):
     id: int
     author: UserPublic | None
     comments: list[CommentPublic]
+
+
+class Job(SQLModel, table=True):
+    """Background job, run by `python -m jobs.worker` (see `libs/jobs.py`)"""
+
+    # for claiming next due job
+    __table_args__ = (Index("ix_job_status_run_at", "status", "run_at"),)
+
+    id: Annotated[int | None, Field(primary_key=True)] = None
+    kind: str
+    # keyword arguments of handler
+    payload: dict = Field(default_factory=dict, sa_type=JSON)
+    # queued, running or failed. finished jobs are deleted
+    status: str = "queued"
+    attempts: int = 0
+    max_attempts: int = 5
+    # not run before this time, set to later time for retry with backoff
+    run_at: datetime.datetime = Field(default_factory=_now)
+    locked_by: str | None = None
+    locked_at: datetime.datetime | None = None
+    last_error: str | None = None
+    created_at: datetime.datetime = Field(default_factory=_now)
+
+
+class BrowserSession(SQLModel, table=True):
+    """Server-side session, cookie has only `id` (see `libs/sessions.py`)"""
+
+    id: Annotated[str, Field(primary_key=True)]
+    # logged in user, for revoking their sessions
+    user_id: Annotated[int | None, Field(index=True)] = None
+    data: dict = Field(default_factory=dict, sa_type=JSON)
+    created_at: datetime.datetime = Field(default_factory=_now)
+    # written in batches, may lag behind by `SESSION_TOUCH_INTERVAL`
+    last_seen_at: datetime.datetime = Field(default_factory=_now, index=True)
+    # when cookie was last sent, it expires `SESSION_MAX_AGE` after that
+    cookie_sent_at: datetime.datetime = Field(default_factory=_now)
@@ -0,0 +1,10 @@
+"""Benchmarks, run against database from `DATABASE_URL` (see `libs/db.py`)
+
+    export DATABASE_URL=sqlite:///benchmark.db  # or a dedicated postgres database
+    python -m benchmarks.dataset --reset        # deterministic synthetic data
+    python -m benchmarks.micro -o micro.json    # rendering, password hashing, file saving
+    python -m benchmarks.load -o load.json      # end-to-end requests through the ASGI app
+
+everything runs in-process, no server or network is needed. compare JSON results of
+two runs with `python -m benchmarks.compare before.json after.json`
+"""
@@ -0,0 +1,49 @@
+import datetime
+import json
+import platform
+import subprocess
+from typing import Any, Sequence
+
+from libs.db import engine
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """`q` (0-100) percentile of sorted values, nearest-rank"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict[str, Any]:
+    """what the results depend on, stored with them so runs can be compared"""
+    return {
+        "time": datetime.datetime.now(datetime.UTC).isoformat(),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": engine.dialect.name,
+    }
+
+
+def write_results(path: str | None, results: dict[str, Any]):
+    """write `results` (with `environment`) to `path` as JSON, or print them"""
+    text = json.dumps({"environment": environment(), **results}, indent=2)
+    if path is None:
+        print(text)
+        return
+    with open(path, "w") as f:
+        f.write(text + "\n")
+    print(f"Results written to {path}")
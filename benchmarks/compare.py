@@ -0,0 +1,43 @@
+"""Compare two results of `benchmarks.micro` / `benchmarks.load`
+
+python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+
+# metric of each kind of result that is compared, lower is better for both
+_METRICS = {"micro": "median_us", "load": "p50_ms"}
+
+
+def compare(before: dict, after: dict) -> list[tuple[str, float, float, float]]:
+    """(name, before, after, change in %) of every benchmark in both results"""
+    rows = []
+    for kind, metric in _METRICS.items():
+        for name, result in after.get(kind, {}).items():
+            previous = before.get(kind, {}).get(name)
+            if previous is None:
+                continue
+            old, new = previous[metric], result[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            rows.append((f"{kind}.{name} ({metric})", old, new, change))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    for name, old, new, change in compare(before, after):
+        print(f"{name:<50} {old:>12.2f} {new:>12.2f} {change:>+8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
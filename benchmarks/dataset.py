@@ -0,0 +1,262 @@
+"""Deterministic synthetic dataset: users, artworks, comments, favorites and images
+
+same arguments (and seed) always generate the same rows, so runs are comparable.
+every user's password is `PASSWORD`, usernames are `bench_user_<n>` (from 0)
+
+    python -m benchmarks.dataset --reset --users 100 --artworks 5000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import time
+from typing import Any, Iterator, Sequence
+
+from PIL import Image
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, SQLModel, col, select
+
+from app.models import (
+    Artwork,
+    ArtworkRendition,
+    Blob,
+    Comment,
+    TrendingScore,
+    User,
+    UserFavoriteArtwork,
+)
+from constants import UPLOAD_DIR
+from jobs.compact_trending import rebuild_trending
+from jobs.reconcile_counters import reconcile_counters
+from libs.db import engine
+from libs.password import hash_password
+
+PASSWORD = "benchmark"
+BATCH_SIZE = 1000
+# relative to upload dir
+IMAGE_DIR = "benchmark"
+# all rows are created within this period, starting from fixed time
+START_TIME = datetime.datetime(2024, 1, 1)
+PERIOD = datetime.timedelta(days=365)
+
+_WORDS = (
+    "cat dog landscape portrait sunset ocean forest city night abstract sketch "
+    "digital painting study color light shadow mountain river flower dragon "
+    "character fanart original commission pixel watercolor ink"
+).split()
+
+
+def _sentence(rng: random.Random, min_words: int, max_words: int) -> str:
+    return " ".join(rng.choices(_WORDS, k=rng.randint(min_words, max_words)))
+
+
+def _timestamp(rng: random.Random) -> datetime.datetime:
+    return START_TIME + PERIOD * rng.random()
+
+
+def generate_images(
+    rng: random.Random, count: int, size: int
+) -> list[tuple[str, int, int, int]]:
+    """write `count` small gradient PNGs to upload dir, return (path, size, width, height)
+
+    artworks share these images, only their rows differ
+    """
+    os.makedirs(os.path.join(UPLOAD_DIR, IMAGE_DIR), exist_ok=True)
+    images = []
+    for i in range(count):
+        width = size
+        height = rng.choice((size * 3 // 4, size, size * 4 // 3))
+        start = tuple(rng.randrange(256) for _ in range(3))
+        end = tuple(rng.randrange(256) for _ in range(3))
+        im = Image.linear_gradient("L").resize((width, height))
+        im = Image.merge(
+            "RGB",
+            [
+                im.point(lambda v, a=a, b=b: a + (b - a) * v // 255)
+                for a, b in zip(start, end)
+            ],
+        )
+        path = os.path.join(IMAGE_DIR, f"{i}.png")
+        im.save(os.path.join(UPLOAD_DIR, path))
+        file_size = os.path.getsize(os.path.join(UPLOAD_DIR, path))
+        images.append((path, file_size, width, height))
+    return images
+
+
+def _batches(rows: Sequence[Any], size: int = BATCH_SIZE) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(rows), size):
+        yield rows[start : start + size]
+
+
+def _insert(session: Session, model, rows: list[dict[str, Any]]) -> list[int]:
+    """multi-row insert in batches, return IDs in order of `rows` (if model has `id`)"""
+    ids: list[int] = []
+    has_id = "id" in model.__table__.columns
+    for batch in _batches(rows):
+        if has_id:
+            statement = insert(model).returning(
+                col(model.id), sort_by_parameter_order=True
+            )
+            ids.extend(session.scalars(statement, batch))
+        else:
+            session.execute(insert(model), batch)
+    session.commit()
+    return ids
+
+
+def reset(session: Session):
+    """delete all rows of tables filled by `generate`"""
+    for model in (
+        TrendingScore,
+        UserFavoriteArtwork,
+        Comment,
+        ArtworkRendition,
+        Artwork,
+        Blob,
+        User,
+    ):
+        session.exec(delete(model))  # type: ignore
+    session.commit()
+
+
+def generate(
+    session: Session,
+    *,
+    users: int,
+    artworks: int,
+    comments: int,
+    favorites: int,
+    images: int,
+    image_size: int,
+    seed: int,
+) -> dict[str, int]:
+    """insert dataset, return number of rows of each kind"""
+    rng = random.Random(seed)
+    image_files = generate_images(rng, images, image_size)
+    # hashing is slow, all users share the same hash
+    password_hash = hash_password(PASSWORD)
+
+    user_ids = _insert(
+        session,
+        User,
+        [
+            {
+                "username": f"bench_user_{i}",
+                "email": f"bench_user_{i}@example.com",
+                "password": password_hash,
+                "email_confirmed": True,
+                "created_at": START_TIME,
+                "updated_at": START_TIME,
+            }
+            for i in range(users)
+        ],
+    )
+
+    artwork_rows = []
+    for _ in range(artworks):
+        path, file_size, width, height = rng.choice(image_files)
+        created_at = _timestamp(rng)
+        artwork_rows.append(
+            {
+                "name": _sentence(rng, 1, 4),
+                "description": _sentence(rng, 5, 40),
+                "path": path,
+                "file_size": file_size,
+                "width": width,
+                "height": height,
+                "author_id": rng.choice(user_ids),
+                "created_at": created_at,
+                "updated_at": created_at,
+            }
+        )
+    artwork_ids = _insert(session, Artwork, artwork_rows)
+
+    _insert(
+        session,
+        Comment,
+        [
+            {
+                "text": _sentence(rng, 1, 20),
+                "artwork_id": rng.choice(artwork_ids),
+                "author_id": rng.choice(user_ids),
+                "created_at": _timestamp(rng),
+            }
+            for _ in range(comments)
+        ],
+    )
+
+    # (user, artwork) is primary key. half of favorites go to few popular artworks
+    # (low IDs), so popular sort and counters are realistic
+    favorites = min(favorites, len(user_ids) * len(artwork_ids))
+    pairs: set[tuple[int, int]] = set()
+    while len(pairs) < favorites:
+        if rng.random() < 0.5:
+            index = min(int(rng.paretovariate(1.2)) - 1, len(artwork_ids) - 1)
+        else:
+            index = rng.randrange(len(artwork_ids))
+        pairs.add((rng.choice(user_ids), artwork_ids[index]))
+    _insert(
+        session,
+        UserFavoriteArtwork,
+        [
+            {
+                "user_id": user_id,
+                "artwork_id": artwork_id,
+                "favorited_at": _timestamp(rng),
+            }
+            for user_id, artwork_id in sorted(pairs)
+        ],
+    )
+
+    reconcile_counters(session)
+    rebuild_trending(session, keep_decayed=True)
+    return {
+        "users": len(user_ids),
+        "artworks": len(artwork_ids),
+        "comments": comments,
+        "favorites": len(pairs),
+        "images": len(image_files),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--artworks", type=int, default=5000)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--favorites", type=int, default=20000)
+    parser.add_argument("--images", type=int, default=32, help="distinct image files")
+    parser.add_argument("--image-size", type=int, default=256, help="width in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reset", action="store_true", help="delete existing rows first"
+    )
+    args = parser.parse_args()
+
+    if engine.dialect.name == "sqlite":
+        # postgres must be migrated with `alembic upgrade head` (search columns)
+        SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        if args.reset:
+            reset(session)
+        elif session.exec(select(func.count()).select_from(User)).one():
+            parser.error("database is not empty, use --reset to delete existing rows")
+
+        start = time.perf_counter()
+        counts = generate(
+            session,
+            users=args.users,
+            artworks=args.artworks,
+            comments=args.comments,
+            favorites=args.favorites,
+            images=args.images,
+            image_size=args.image_size,
+            seed=args.seed,
+        )
+    print(f"Generated {counts} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""End-to-end load driver: concurrent requests through the ASGI app, in-process
+
+needs dataset from `benchmarks.dataset`. each scenario runs `--requests` requests
+with `--concurrency` clients, each logged in as different benchmark user
+
+    python -m benchmarks.load -o load.json
+    python -m benchmarks.load --scenario gallery --scenario detail --requests 2000
+"""
+
+import argparse
+import asyncio
+import io
+import random
+import time
+from typing import Any, Awaitable, Callable
+
+import httpx
+from PIL import Image
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.models import Artwork, User
+from benchmarks.common import percentile, write_results
+from benchmarks.dataset import PASSWORD
+from libs.db import engine
+from main import app
+
+
+class Context:
+    """data scenarios pick from, and client of one simulated user"""
+
+    def __init__(self, client: httpx.AsyncClient, rng: random.Random, username: str):
+        self.client = client
+        self.rng = rng
+        self.username = username
+        self.artwork_ids: range = range(0)
+        self.image = b""
+
+    def artwork_id(self) -> int:
+        return self.rng.choice(self.artwork_ids)
+
+
+Scenario = Callable[[Context], Awaitable[httpx.Response]]
+
+
+async def gallery(ctx: Context):
+    return await ctx.client.get("/artworks/gallery.html")
+
+
+async def gallery_json(ctx: Context):
+    return await ctx.client.get("/artworks/gallery", params={"sort": "popular"})
+
+
+async def gallery_trending(ctx: Context):
+    return await ctx.client.get("/artworks/gallery", params={"sort": "trending"})
+
+
+async def detail(ctx: Context):
+    return await ctx.client.get(f"/artworks/{ctx.artwork_id()}.html")
+
+
+async def login(ctx: Context):
+    return await ctx.client.post(
+        "/user/login", json={"username": ctx.username, "password": PASSWORD}
+    )
+
+
+async def comment(ctx: Context):
+    return await ctx.client.post(
+        f"/artworks/{ctx.artwork_id()}/comments", json={"text": "benchmark comment"}
+    )
+
+
+async def upload(ctx: Context):
+    return await ctx.client.post(
+        "/artworks/upload",
+        data={"name": "benchmark upload", "description": "uploaded by benchmark"},
+        files={"image": ("image.png", ctx.image, "image/png")},
+    )
+
+
+SCENARIOS: dict[str, Scenario] = {
+    "gallery": gallery,
+    "gallery_json": gallery_json,
+    "gallery_trending": gallery_trending,
+    "detail": detail,
+    "login": login,
+    "comment": comment,
+    "upload": upload,
+}
+
+
+def _png(seed: int) -> bytes:
+    """distinct small image per client, so uploads aren't all deduplicated"""
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), (seed % 256, seed // 256 % 256, 128)).save(
+        out, format="PNG"
+    )
+    return out.getvalue()
+
+
+async def _make_contexts(concurrency: int, seed: int) -> list[Context]:
+    with Session(engine) as session:
+        min_id, max_id = session.exec(
+            select(func.min(Artwork.id), func.max(Artwork.id))
+        ).one()
+        user_count = session.exec(select(func.count()).select_from(User)).one()
+    if not min_id or not user_count:
+        raise SystemExit("Database is empty, run `python -m benchmarks.dataset` first")
+
+    contexts = []
+    for i in range(concurrency):
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),  # type: ignore
+            base_url="http://benchmark",
+        )
+        ctx = Context(client, random.Random(seed + i), f"bench_user_{i % user_count}")
+        ctx.artwork_ids = range(min_id, max_id + 1)
+        ctx.image = _png(seed + i)
+        response = await login(ctx)
+        response.raise_for_status()
+        contexts.append(ctx)
+    return contexts
+
+
+async def run_scenario(
+    scenario: Scenario, contexts: list[Context], requests: int
+) -> dict[str, Any]:
+    """run `requests` requests, spread over clients in `contexts`"""
+    latencies: list[float] = []
+    statuses: dict[str, int] = {}
+    remaining = requests
+
+    async def worker(ctx: Context):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await scenario(ctx)
+            latencies.append(time.perf_counter() - start)
+            status = str(response.status_code)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(ctx) for ctx in contexts))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": len(contexts),
+        "statuses": statuses,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+async def run(
+    scenarios: list[str], *, requests: int, concurrency: int, warmup: int, seed: int
+) -> dict[str, Any]:
+    contexts = await _make_contexts(concurrency, seed)
+    results = {}
+    try:
+        for name in scenarios:
+            # fill caches / connection pools, not measured
+            await run_scenario(SCENARIOS[name], contexts, warmup)
+            results[name] = await run_scenario(SCENARIOS[name], contexts, requests)
+            print(
+                f"{name}: {results[name]['throughput_rps']} req/s,"
+                f" p50 {results[name]['p50_ms']}ms, p99 {results[name]['p99_ms']}ms,"
+                f" statuses {results[name]['statuses']}"
+            )
+    finally:
+        for ctx in contexts:
+            await ctx.client.aclose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="JSON file, print results if omitted")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="scenario to run (repeatable), all by default",
+    )
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+    results = asyncio.run(
+        run(
+            scenarios,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            seed=args.seed,
+        )
+    )
+    write_results(
+        args.output,
+        {
+            "load": results,
+            "options": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "warmup": args.warmup,
+                "seed": args.seed,
+            },
+        },
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Micro-benchmarks of hot functions, on in-memory data (no database needed)
+
+python -m benchmarks.micro -o micro.json
+python -m benchmarks.micro -k render   # only benchmarks with "render" in name
+"""
+
+import argparse
+import datetime
+import io
+import os
+import random
+import statistics
+import tempfile
+import timeit
+from typing import Any, Callable
+
+import htpy as h
+from fastapi import UploadFile
+from markupsafe import Markup
+from PIL import Image
+from starlette.datastructures import Headers
+
+import routes.artworks.view as view
+from app.models import Artwork, User
+from benchmarks.common import write_results
+from libs.fragment_cache import FragmentCache
+from libs.html import page_layout
+from libs.password import hash_password
+from libs.upload import save_file
+from libs.user_cache import UserSnapshot
+
+REPEAT = 5
+
+
+def bench(fn: Callable[[], Any], *, repeat: int = REPEAT) -> dict[str, Any]:
+    """time `fn`, each of `repeat` rounds runs it enough times to take >= 0.2s"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    rounds = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "runs": number * repeat,
+        "min_us": round(min(rounds) * 1e6, 2),
+        "median_us": round(statistics.median(rounds) * 1e6, 2),
+        "max_us": round(max(rounds) * 1e6, 2),
+    }
+
+
+def _make_artworks(count: int, *, seed: int = 0) -> list[Artwork]:
+    """artworks as loaded by gallery (author and renditions), but not in database"""
+    rng = random.Random(seed)
+    authors = [
+        User(id=i, username=f"user_{i}", email="", password="") for i in range(10)
+    ]
+    created_at = datetime.datetime(2024, 1, 1)
+    return [
+        Artwork(
+            id=i,
+            name=f"artwork {i}",
+            description="some description " * rng.randint(1, 10),
+            path=f"benchmark/{i}.png",
+            file_size=10_000,
+            width=800,
+            height=600,
+            favorite_count=rng.randint(0, 100),
+            comment_count=rng.randint(0, 100),
+            author=rng.choice(authors),
+            renditions=[],
+            created_at=created_at,
+            updated_at=created_at,
+        )
+        for i in range(count)
+    ]
+
+
+def _render_artworks_cold(artworks: list[Artwork]):
+    """every card is rendered, not taken from `card_cache`"""
+    view.card_cache = FragmentCache(view.card_cache.max_size)
+    return h.render_node(view._render_artworks(artworks, next_url="/next"))
+
+
+def _save_file(content: bytes, dst_dir: str):
+    # same kind of file FastAPI gives to `UploadFile`
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(content)
+    spooled.seek(0)
+    file = UploadFile(
+        spooled,  # type: ignore
+        filename="image.png",
+        headers=Headers({"content-type": "image/png"}),
+    )
+    path = save_file(file, dst_dir)
+    spooled.close()
+    os.remove(path)
+
+
+def _png(width: int, height: int) -> bytes:
+    out = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(out, format="PNG")
+    return out.getvalue()
+
+
+def benchmarks(tmp_dir: str) -> dict[str, Callable[[], Any]]:
+    artworks = _make_artworks(30)
+    user = UserSnapshot(id=1, username="user_1", email_confirmed=True)
+    grid = Markup(h.render_node(view._render_artworks(artworks, next_url="/next")))
+    image = _png(1024, 768)
+    return {
+        "render_artworks_cold": lambda: _render_artworks_cold(artworks),
+        "render_artworks_cached": lambda: h.render_node(
+            view._render_artworks(artworks, next_url="/next")
+        ),
+        "page_layout_guest": lambda: page_layout(None, body=h.p["hello"]),
+        "page_layout_user_with_grid": lambda: page_layout(user, body=grid),
+        "hash_password": lambda: hash_password("benchmark"),
+        f"save_file_{len(image) // 1024}kb": lambda: _save_file(image, tmp_dir),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="JSON file, print results if omitted")
+    parser.add_argument("-k", "--filter", help="run benchmarks with this in name")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, fn in benchmarks(tmp_dir).items():
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = bench(fn)
+            print(f"{name}: {results[name]['median_us']}us")
+    write_results(args.output, {"micro": results})
+
+
+if __name__ == "__main__":
+    main()
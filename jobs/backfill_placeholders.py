@@ -0,0 +1,107 @@
+"""Compute placeholders (see `libs/placeholders.py`) of artworks that don't have one
+
+new uploads get placeholder with their renditions, this is for artworks uploaded
+before that (or whose renditions failed):
+
+    python -m jobs.backfill_placeholders
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import update
+from sqlmodel import Session, col, select
+
+from app.models import Artwork, _now
+from constants import UPLOAD_DIR
+from libs.db import engine
+from libs.placeholders import Placeholder, placeholder_of_file
+
+BATCH_SIZE = 500
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", os.cpu_count() or 2))
+
+
+def _placeholder(path: str) -> Placeholder | None:
+    """runs in worker process, None if image can't be read"""
+    try:
+        return placeholder_of_file(os.path.join(UPLOAD_DIR, path))
+    except OSError as e:
+        logging.warning(f"Cannot compute placeholder of {path}: {e}")
+        return None
+
+
+def backfill_placeholders(
+    session: Session, executor: ProcessPoolExecutor, *, batch_size: int = BATCH_SIZE
+) -> tuple[int, int]:
+    """fill placeholders in ID batches, each in its own transaction
+
+    return (number of updated artworks, number of unreadable images)
+    """
+    updated = failed = 0
+    last_id = 0
+    while True:
+        rows = session.exec(
+            select(col(Artwork.id), col(Artwork.path))
+            .where(col(Artwork.placeholder).is_(None), col(Artwork.id) > last_id)
+            .order_by(col(Artwork.id))
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return updated, failed
+        last_id = rows[-1][0]
+
+        placeholders = executor.map(_placeholder, [path for _, path in rows])
+        now = _now()
+        # bump `updated_at`, so cached cards are rendered again with placeholder
+        values = [
+            {
+                "id": id,
+                "dominant_color": placeholder.color,
+                "placeholder": placeholder.data_uri,
+                "updated_at": now,
+            }
+            for (id, _), placeholder in zip(rows, placeholders)
+            if placeholder is not None
+        ]
+        failed += len(rows) - len(values)
+        if values:
+            # ORM bulk UPDATE by primary key, executemany of one statement
+            session.exec(update(Artwork), params=values)  # type: ignore
+            session.commit()
+        updated += len(values)
+        logging.info(
+            f"Backfilled placeholders up to artwork {last_id}, {updated} total"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    start = time.perf_counter()
+    # forkserver: don't fork process with open DB connections
+    with (
+        ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as executor,
+        Session(engine) as session,
+    ):
+        updated, failed = backfill_placeholders(
+            session, executor, batch_size=args.batch_size
+        )
+    logging.info(
+        f"Backfilled {updated} placeholders in {time.perf_counter() - start:.1f}s,"
+        f" {failed} images couldn't be read"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Import many images as artworks of one user, much faster than uploading one by one
+
+images are probed (format, dimensions) and copied in a process pool, while rows are
+inserted in large batches and the copies moved into content-addressed storage (see
+`libs/blobs.py`).
+source is a directory (searched recursively, name is taken from file name) or CSV
+manifest with `path,name,description` columns (paths relative to the manifest)
+
+    python -m jobs.bulk_import --author alice ./archive
+    python -m jobs.bulk_import --author alice --manifest archive.csv
+
+progress is saved to checkpoint file after each batch, running the same command
+again resumes after the last saved batch. a batch committed right before crash
+(but not saved in checkpoint) is read again, its artworks that already exist (same
+author, content and name) are skipped. temporary copies left by a crashed import
+are removed when the next one starts.
+
+renditions and placeholders are generated by background jobs, enqueued with each
+batch (run `python -m jobs.worker`)
+"""
+
+import argparse
+import csv
+import json
+import logging
+import mimetypes
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, NamedTuple, Sequence
+
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import insert
+from sqlmodel import Session, col, select
+
+from app.models import Artwork, User, _now
+from libs.blobs import add_blob_references, copy_to_tmp, remove_orphaned_copies
+from libs.db import engine
+from libs.renditions import schedule_renditions
+
+BATCH_SIZE = 1000
+# entries sent to a worker at once
+PROBE_CHUNK_SIZE = 32
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", os.cpu_count() or 2))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+class ImportEntry(NamedTuple):
+    path: str
+    name: str
+    description: str
+
+
+class ProbedImage(NamedTuple):
+    entry: ImportEntry
+    sha256: str
+    # relative to upload dir
+    path: str
+    size: int
+    width: int
+    height: int
+    # copy in temporary upload dir, until it's moved into the store
+    tmp_path: str
+
+
+def entries_from_directory(directory: str) -> list[ImportEntry]:
+    """images in `directory` and subdirectories, sorted so order is stable on resume"""
+    entries = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            stem, ext = os.path.splitext(file)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                name = stem.replace("_", " ").strip() or stem
+                entries.append(ImportEntry(os.path.join(root, file), name, ""))
+    return entries
+
+
+def entries_from_manifest(manifest: str) -> list[ImportEntry]:
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest, newline="") as f:
+        return [
+            ImportEntry(
+                os.path.join(base_dir, row["path"]),
+                row.get("name") or os.path.splitext(os.path.basename(row["path"]))[0],
+                row.get("description") or "",
+            )
+            for row in csv.DictReader(f)
+        ]
+
+
+def probe_and_copy(entry: ImportEntry) -> ProbedImage | str:
+    """read image header and copy it to temporary upload dir, runs in worker process
+
+    return error message instead of raising, so one bad file doesn't stop the import
+    """
+    try:
+        with Image.open(entry.path) as im:
+            width, height = im.size
+            mime_type = Image.MIME.get(im.format or "")
+    except (OSError, UnidentifiedImageError) as e:
+        return f"{entry.path}: {e}"
+    ext = mime_type and mimetypes.guess_extension(mime_type)
+    if not ext:
+        return f"{entry.path}: unsupported image format"
+
+    try:
+        sha256, path, size, tmp_path = copy_to_tmp(entry.path, ext)
+    except OSError as e:
+        return f"{entry.path}: {e}"
+    return ProbedImage(entry, sha256, path, size, width, height, tmp_path)
+
+
+def _probe_chunk(entries: Sequence[ImportEntry]) -> list[ProbedImage | str]:
+    return [probe_and_copy(entry) for entry in entries]
+
+
+def _remove_copies(results: Iterable[ProbedImage | str]):
+    """remove temporary copies not moved into the store"""
+    for result in results:
+        if isinstance(result, ProbedImage) and os.path.exists(result.tmp_path):
+            os.remove(result.tmp_path)
+
+
+def _probe_ahead(
+    executor: Executor, entries: Iterable[ImportEntry], ahead: int
+) -> Iterator[ProbedImage | str]:
+    """results of `probe_and_copy` in order, probing at most `ahead` entries before
+    they are consumed. when closed early (insert failed), pending chunks are
+    cancelled and copies not consumed yet are removed
+    """
+    chunks = _batches(entries, PROBE_CHUNK_SIZE)
+    pending: deque[Future[list[ProbedImage | str]]] = deque(
+        executor.submit(_probe_chunk, chunk)
+        for chunk in islice(chunks, max(1, ahead // PROBE_CHUNK_SIZE))
+    )
+    results: deque[ProbedImage | str] = deque()
+    try:
+        while pending:
+            results.extend(pending.popleft().result())
+            for chunk in islice(chunks, 1):
+                pending.append(executor.submit(_probe_chunk, chunk))
+            while results:
+                yield results.popleft()
+    finally:
+        _remove_copies(results)
+        for future in pending:
+            future.cancel()
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                # was already running, wait for it to remove its copies
+                _remove_copies(future.result())
+
+
+def _existing(
+    session: Session, images: Sequence[ProbedImage], author_id: int
+) -> set[tuple[str, str]]:
+    """(sha256, name) of `images` already imported as artworks of author"""
+    return set(
+        session.exec(
+            select(Artwork.blob_sha256, Artwork.name).where(
+                col(Artwork.author_id) == author_id,
+                col(Artwork.blob_sha256).in_({image.sha256 for image in images}),
+            )
+        ).all()  # type: ignore
+    )
+
+
+def insert_batch(
+    session: Session,
+    images: Sequence[ProbedImage],
+    author_id: int,
+    *,
+    skip_existing: bool = False,
+) -> list[ProbedImage]:
+    """insert artworks, blob references and renditions jobs of `images` in one
+    transaction, return inserted. `skip_existing` leaves out images already imported
+    (batch that may have been committed before crash)
+    """
+    if skip_existing:
+        existing = _existing(session, images, author_id)
+        for image in images:
+            if (image.sha256, image.entry.name) in existing:
+                os.remove(image.tmp_path)
+        images = [
+            image
+            for image in images
+            if (image.sha256, image.entry.name) not in existing
+        ]
+        if not images:
+            return []
+
+    blobs: dict[str, tuple[str, int, list[str]]] = {}
+    for image in images:
+        blobs.setdefault(image.sha256, (image.path, image.size, []))[2].append(
+            image.tmp_path
+        )
+    # files are moved into the store while blob rows are locked
+    add_blob_references(session, blobs)
+
+    now = _now()
+    # executemany of single INSERT, sent as multi-row VALUES by SQLAlchemy
+    artwork_ids = session.exec(  # type: ignore
+        insert(Artwork).returning(col(Artwork.id)),
+        params=[
+            {
+                "name": image.entry.name,
+                "description": image.entry.description,
+                "path": image.path,
+                "blob_sha256": image.sha256,
+                "file_size": image.size,
+                "width": image.width,
+                "height": image.height,
+                "author_id": author_id,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for image in images
+        ],
+    ).scalars()
+    schedule_renditions(session, *artwork_ids)
+    session.commit()
+    return images
+
+
+class Checkpoint:
+    """number of source entries already imported, saved as JSON"""
+
+    def __init__(self, path: str, source: str):
+        self.path = path
+        self.source = source
+        self.done = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            if data["source"] != source:
+                raise SystemExit(
+                    f"Checkpoint {path} is for other source {data['source']}"
+                )
+            self.done = data["done"]
+
+    def save(self, done: int):
+        self.done = done
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"source": self.source, "done": done}, f)
+        os.replace(tmp_path, self.path)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run_import(
+    entries: Sequence[ImportEntry],
+    *,
+    author_id: int,
+    checkpoint: Checkpoint,
+    batch_size: int = BATCH_SIZE,
+    workers: int = IMPORT_WORKERS,
+):
+    remaining = entries[checkpoint.done :]
+    logging.info(
+        f"Importing {len(remaining)} of {len(entries)} images"
+        f" ({checkpoint.done} done before) with {workers} workers"
+    )
+    if orphaned := remove_orphaned_copies():
+        logging.info(f"Removed {orphaned} copies left by interrupted import")
+    start = time.perf_counter()
+    imported = failed = total_bytes = 0
+    done = checkpoint.done
+
+    # forkserver: don't fork process with open DB connections
+    with (
+        ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+        ) as executor,
+        Session(engine) as session,
+    ):
+        # results come in order, workers keep probing next batch while one is inserted
+        results = _probe_ahead(executor, remaining, ahead=2 * batch_size)
+        batch: list[ProbedImage | str] = []
+        try:
+            # first batch after resume may have been committed, but not checkpointed
+            resumed = checkpoint.done > 0
+            for batch in _batches(results, batch_size):
+                images = []
+                for result in batch:
+                    if isinstance(result, str):
+                        logging.warning(f"Skipped {result}")
+                        failed += 1
+                    else:
+                        images.append(result)
+                if images:
+                    images = insert_batch(
+                        session, images, author_id, skip_existing=resumed
+                    )
+                resumed = False
+
+                done += len(batch)
+                checkpoint.save(done)
+                imported += len(images)
+                total_bytes += sum(image.size for image in images)
+                elapsed = time.perf_counter() - start
+                logging.info(
+                    f"{done}/{len(entries)}: {imported / elapsed:.1f} images/s,"
+                    f" {total_bytes / elapsed / 1024 / 1024:.1f} MB/s, {failed} skipped"
+                )
+        except BaseException:
+            # copies of failed batch that weren't moved into the store
+            _remove_copies(batch)
+            raise
+        finally:
+            results.close()
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Imported {imported} images ({total_bytes / 1024 / 1024:.1f} MB) in"
+        f" {elapsed:.1f}s, {failed} skipped"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?", help="directory of images")
+    parser.add_argument("--manifest", help="CSV with path,name,description columns")
+    parser.add_argument("--author", required=True, help="username of owner")
+    parser.add_argument(
+        "--checkpoint",
+        help="progress file, defaults to .import-checkpoint.json next to source",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if bool(args.source) == bool(args.manifest):
+        parser.error("give either source directory or --manifest")
+    source = os.path.abspath(args.source or args.manifest)
+    entries = (
+        entries_from_directory(source) if args.source else entries_from_manifest(source)
+    )
+    checkpoint_path = args.checkpoint or (
+        os.path.join(source, ".import-checkpoint.json")
+        if args.source
+        else f"{source}.import-checkpoint.json"
+    )
+
+    with Session(engine) as session:
+        author_id = session.exec(
+            select(User.id).where(col(User.username) == args.author)
+        ).one_or_none()
+    if author_id is None:
+        parser.error(f"user {args.author} doesn't exist")
+
+    run_import(
+        entries,
+        author_id=author_id,
+        checkpoint=Checkpoint(checkpoint_path, source),
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
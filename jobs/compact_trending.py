@@ -0,0 +1,128 @@
+"""Delete trending scores (see `libs/trending.py`) that decayed to nothing
+
+scores are updated by the routes with each favorite / comment, this only keeps the
+table (and its index) small, run it periodically:
+
+    python -m jobs.compact_trending --interval 3600
+
+`--rebuild` recomputes all scores from favorites and comments instead, to fill the
+table for activity from before it existed, or fix drift (e.g. after manual SQL)
+"""
+
+import argparse
+import datetime
+import logging
+import math
+import time
+
+from sqlalchemy import delete
+from sqlmodel import Session, col, select
+
+from app.models import Comment, TrendingScore, UserFavoriteArtwork, _now
+from libs.db import engine
+from libs.trending import (
+    COMMENT_WEIGHT,
+    FAVORITE_WEIGHT,
+    TRENDING_HALF_LIFE,
+    TRENDING_MIN_SCORE,
+    compact_trending,
+    log_add_exp,
+    min_log_score,
+    sum_events,
+)
+
+# rows inserted per statement by `--rebuild`
+BATCH_SIZE = 1000
+
+
+def rebuild_trending(
+    session: Session, *, keep_decayed: bool = False, batch_size: int = BATCH_SIZE
+) -> int:
+    """replace all scores with ones computed from recent favorites and comments,
+    return number of trending artworks. `keep_decayed` computes score from all
+    events and keeps it even if it decayed (for benchmark dataset with old events)
+
+    NOTE: events during rebuild may be lost, run when there is little traffic
+    """
+    # older events decayed below min score even at the largest weight
+    max_age = TRENDING_HALF_LIFE * math.log2(
+        max(FAVORITE_WEIGHT, COMMENT_WEIGHT) / TRENDING_MIN_SCORE
+    )
+    since = (
+        datetime.datetime.min
+        if keep_decayed
+        else _now() - datetime.timedelta(seconds=max_age)
+    )
+
+    favorites = sum_events(
+        session.exec(
+            select(UserFavoriteArtwork.artwork_id, UserFavoriteArtwork.favorited_at)
+            .where(col(UserFavoriteArtwork.favorited_at) >= since)
+            .execution_options(yield_per=batch_size)
+        ),
+        FAVORITE_WEIGHT,
+    )
+    comments = sum_events(
+        session.exec(
+            select(Comment.artwork_id, Comment.created_at)
+            .where(
+                col(Comment.created_at) >= since,
+                col(Comment.artwork_id).is_not(None),
+            )
+            .execution_options(yield_per=batch_size)
+        ),  # type: ignore
+        COMMENT_WEIGHT,
+    )
+    scores = dict(favorites)
+    for artwork_id, score in comments.items():
+        scores[artwork_id] = log_add_exp(scores.get(artwork_id, -math.inf), score)
+
+    min_score = -math.inf if keep_decayed else min_log_score()
+    rows = [
+        {"artwork_id": artwork_id, "score": score}
+        for artwork_id, score in scores.items()
+        if score >= min_score
+    ]
+    session.exec(delete(TrendingScore))  # type: ignore
+    for start in range(0, len(rows), batch_size):
+        session.add_all(
+            TrendingScore(**row) for row in rows[start : start + batch_size]
+        )
+        session.flush()
+    session.commit()
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="seconds between runs, run once if not given",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="recompute scores from favorites and comments, then exit",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.rebuild:
+        with Session(engine) as session:
+            count = rebuild_trending(session)
+        logging.info(f"Rebuilt trending scores, {count} trending artworks")
+        return
+
+    while True:
+        with Session(engine) as session:
+            deleted = compact_trending(session)
+        logging.info(f"Compacted trending scores, deleted {deleted} decayed")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Fix drift of denormalized `Artwork.favorite_count` / `Artwork.comment_count`
+
+counters are updated by the routes in the same transaction as the favorite / comment,
+but can still drift (manual SQL, deleted users, bugs), run this periodically:
+
+    python -m jobs.reconcile_counters               # once
+    python -m jobs.reconcile_counters --interval 3600
+"""
+
+import argparse
+import logging
+import time
+
+from sqlalchemy import func, or_, update
+from sqlmodel import Session, col, select
+
+from app.models import Artwork, Comment, UserFavoriteArtwork
+from libs.db import engine
+
+# artworks are reconciled in ID ranges of this size, each in its own transaction,
+# so row locks are held briefly
+BATCH_SIZE = 1000
+
+
+def reconcile_counters(session: Session, *, batch_size: int = BATCH_SIZE) -> int:
+    """recount all artworks, return number of artworks that were fixed"""
+    favorite_count = (
+        select(func.count())
+        .where(col(UserFavoriteArtwork.artwork_id) == col(Artwork.id))
+        .scalar_subquery()
+    )
+    comment_count = (
+        select(func.count())
+        .where(col(Comment.artwork_id) == col(Artwork.id))
+        .scalar_subquery()
+    )
+
+    max_id = session.exec(select(func.max(Artwork.id))).one() or 0
+    fixed = 0
+    for start in range(0, max_id, batch_size):
+        result = session.exec(  # type: ignore
+            update(Artwork)
+            .where(
+                col(Artwork.id) > start,
+                col(Artwork.id) <= start + batch_size,
+                or_(
+                    col(Artwork.favorite_count) != favorite_count,
+                    col(Artwork.comment_count) != comment_count,
+                ),
+            )
+            .values(favorite_count=favorite_count, comment_count=comment_count)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        fixed += result.rowcount
+    return fixed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0,
+        help="seconds between runs, run once if not given",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    while True:
+        with Session(engine) as session:
+            fixed = reconcile_counters(session)
+        logging.info(f"Reconciled artwork counters, fixed {fixed} artworks")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
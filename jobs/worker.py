@@ -0,0 +1,109 @@
+"""Run background jobs (see `libs/jobs.py`), e.g. renditions of uploaded artworks
+
+    python -m jobs.worker --concurrency 4
+
+each of `--concurrency` worker processes runs one job at a time, stop with Ctrl+C /
+SIGTERM, running jobs are finished first
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.synchronize import Event
+
+from sqlmodel import Session
+
+import libs.renditions  # noqa: F401 (registers job handlers)
+from libs.db import engine
+from libs.jobs import JOB_LOCK_TIMEOUT, claim_job, requeue_stale_jobs, run_job
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# seconds to wait before checking for jobs again when queue is empty
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+
+
+def work(name: str, stop: Event):
+    """claim and run jobs until `stop` is set, runs in worker process"""
+    # stop is handled by parent, finish running job instead of dying
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+
+    while not stop.is_set():
+        job = None
+        try:
+            with Session(engine) as session:
+                job = claim_job(session, name)
+                if job is not None:
+                    # job is deleted when done, keep what's logged
+                    description = f"job {job.id} ({job.kind})"
+                    logging.info(f"{name}: running {description}")
+                    start = time.perf_counter()
+                    run_job(session, job)
+                    logging.info(
+                        f"{name}: {description} took"
+                        f" {time.perf_counter() - start:.2f}s"
+                    )
+        except Exception:
+            # e.g. database is down. job that was claimed is requeued when its lock
+            # times out, keep the process alive and try again after a while
+            logging.exception(f"{name}: cannot claim or run job")
+            job = None
+        if job is None:
+            stop.wait(POLL_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    context = multiprocessing.get_context("forkserver")
+    stop = context.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    processes = [
+        context.Process(target=work, args=(f"{prefix}-{i}", stop), daemon=True)
+        for i in range(args.concurrency)
+    ]
+    for process in processes:
+        process.start()
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        # only set flag here: setting `stop` while this thread waits on it deadlocks
+        nonlocal stopping
+        logging.info("Stopping workers after their running jobs")
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    requeue_interval = min(JOB_LOCK_TIMEOUT / 2, 60)
+    next_requeue = 0.0
+    while not stopping:
+        if time.monotonic() >= next_requeue:
+            try:
+                with Session(engine) as session:
+                    requeued = requeue_stale_jobs(session)
+            except Exception:
+                # e.g. database is down, workers would die with this process
+                logging.exception("cannot requeue stale jobs")
+            else:
+                if requeued:
+                    logging.warning(f"Requeued {requeued} jobs of workers that died")
+                next_requeue = time.monotonic() + requeue_interval
+        time.sleep(POLL_INTERVAL)
+
+    stop.set()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
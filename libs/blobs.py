@@ -0,0 +1,242 @@
+"""Content-addressed storage for uploaded files
+
+files are stored once per content under `blobs/<aa>/<bb>/<sha256><ext>` in upload dir,
+and shared by all artworks with identical bytes. `Blob.ref_count` counts the artworks
+using it, the file is deleted when the last one is gone (and that is committed).
+
+NOTE: blob file is moved / removed before the transaction commits, while the `blob`
+row is locked by the upsert / update / delete, so concurrent upload of the same
+content waits for it instead of racing with the file operation
+"""
+
+import hashlib
+import os
+from typing import Mapping, Sequence
+
+from pydantic import BaseModel
+from sqlalchemy import delete, func, update
+from sqlmodel import Session, col, select
+
+from app.models import Artwork, Blob
+from constants import UPLOAD_DIR
+from libs.db import dialect_insert
+from libs.upload import StreamedFile
+
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+# streamed uploads land here first, must be on same filesystem as `BLOB_DIR`
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+
+
+def _blob_path(sha256: str, ext: str) -> str:
+    """path relative to upload dir, sharded by hash so no directory gets too large"""
+    return os.path.join("blobs", sha256[:2], sha256[2:4], f"{sha256}{ext}")
+
+
+def store_blob(db: Session, file: StreamedFile) -> tuple[Blob, bool]:
+    """Add reference to blob with content of `file`, file is moved into the store or
+    removed if the same content is already stored. Caller must commit.
+
+    return (blob, is_new)
+    """
+    _, ext = os.path.splitext(file.path)
+    insert = dialect_insert(db, Blob)
+    statement = (
+        insert.values(
+            sha256=file.sha256,
+            path=_blob_path(file.sha256, ext),
+            size=file.size,
+            ref_count=1,
+        )
+        .on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={"ref_count": col(Blob.ref_count) + 1},
+        )
+        .returning(Blob)
+    )
+    blob = db.exec(  # type: ignore
+        statement, execution_options={"populate_existing": True}
+    ).scalar_one()
+
+    is_new = blob.ref_count == 1
+    if is_new:
+        dst_path = os.path.join(UPLOAD_DIR, blob.path)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        os.replace(file.path, dst_path)
+    else:
+        os.remove(file.path)
+    return blob, is_new
+
+
+def copy_to_tmp(src_path: str, ext: str) -> tuple[str, str, int, str]:
+    """Copy file to temporary upload dir and hash it, for bulk import where files are
+    copied in parallel before rows are inserted. Caller must move it into the store
+    with `add_blob_references`.
+
+    return (sha256, blob path relative to upload dir, size, temporary path)
+    """
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(
+        UPLOAD_TMP_DIR, f"import-{os.getpid()}-{os.urandom(6).hex()}"
+    )
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(src_path, "rb") as src, open(tmp_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                sha256.update(chunk)
+                dst.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256.hexdigest(), _blob_path(sha256.hexdigest(), ext), size, tmp_path
+
+
+def remove_orphaned_copies() -> int:
+    """remove copies left by `copy_to_tmp` in processes that no longer exist (import
+    that crashed or was killed), return number removed
+    """
+    removed = 0
+    if not os.path.isdir(UPLOAD_TMP_DIR):
+        return removed
+    for name in os.listdir(UPLOAD_TMP_DIR):
+        prefix, _, rest = name.partition("-")
+        pid, _, _ = rest.partition("-")
+        if prefix != "import" or not pid.isdigit() or _process_exists(int(pid)):
+            continue
+        try:
+            os.remove(os.path.join(UPLOAD_TMP_DIR, name))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def add_blob_references(
+    db: Session, blobs: Mapping[str, tuple[str, int, Sequence[str]]]
+):
+    """Add references to blobs in one statement, `blobs` is sha256 -> (path, size,
+    temporary files from `copy_to_tmp`, one per new reference). Like `store_blob`, a
+    file is moved into the store if the blob is new, the rest are removed. Caller
+    must commit.
+    """
+    if not blobs:
+        return
+    insert = dialect_insert(db, Blob)
+    try:
+        ref_counts = db.exec(  # type: ignore
+            insert.values(
+                [
+                    {
+                        "sha256": sha256,
+                        "path": path,
+                        "size": size,
+                        "ref_count": len(tmp_paths),
+                    }
+                    for sha256, (path, size, tmp_paths) in blobs.items()
+                ]
+            )
+            .on_conflict_do_update(
+                index_elements=[Blob.sha256],
+                set_={"ref_count": col(Blob.ref_count) + insert.excluded.ref_count},
+            )
+            .returning(col(Blob.sha256), col(Blob.ref_count))
+        ).all()
+        for sha256, ref_count in ref_counts:
+            path, _, tmp_paths = blobs[sha256]
+            if ref_count == len(tmp_paths):
+                dst_path = os.path.join(UPLOAD_DIR, path)
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                os.replace(tmp_paths[0], dst_path)
+    finally:
+        for _, _, tmp_paths in blobs.values():
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+def release_blob(db: Session, sha256: str) -> bool:
+    """Remove reference to blob. Caller must commit, and then call
+    `delete_unreferenced_blob` if this returns True (it was the last reference)
+
+    the row is kept with `ref_count` 0 until then, so the file is never deleted while
+    a transaction that may still roll back needs it
+    """
+    ref_count = db.exec(  # type: ignore
+        update(Blob)
+        .where(col(Blob.sha256) == sha256)
+        .values(ref_count=col(Blob.ref_count) - 1)
+        .returning(Blob.ref_count)
+    ).scalar_one_or_none()
+    return ref_count == 0
+
+
+def delete_unreferenced_blob(db: Session, sha256: str):
+    """Delete blob (row and file) if nothing references it, in own transaction
+
+    if the file is removed but commit fails, the row stays with `ref_count` 0 and next
+    `store_blob` of the same content puts the file back (it counts as new)
+    """
+    path = db.exec(  # type: ignore
+        delete(Blob)
+        .where(col(Blob.sha256) == sha256, col(Blob.ref_count) == 0)
+        .returning(Blob.path)
+    ).scalar_one_or_none()
+    if path is not None:
+        try:
+            os.remove(os.path.join(UPLOAD_DIR, path))
+        except FileNotFoundError:
+            pass
+    db.commit()
+
+
+class StorageReport(BaseModel):
+    """How much space deduplication saves"""
+
+    blob_count: int
+    # number of artworks referencing blobs
+    reference_count: int
+    # bytes actually stored
+    stored_bytes: int
+    # bytes that would be stored without deduplication
+    referenced_bytes: int
+    saved_bytes: int
+    # artworks uploaded before content-addressed storage, not deduplicated
+    legacy_artwork_count: int
+    legacy_bytes: int
+
+
+def storage_report(db: Session) -> StorageReport:
+    blob_count, reference_count, stored_bytes, referenced_bytes = db.exec(
+        select(
+            func.count(),
+            func.coalesce(func.sum(Blob.ref_count), 0),
+            func.coalesce(func.sum(Blob.size), 0),
+            func.coalesce(func.sum(col(Blob.size) * col(Blob.ref_count)), 0),
+        )
+    ).one()
+    legacy_artwork_count, legacy_bytes = db.exec(
+        select(func.count(), func.coalesce(func.sum(Artwork.file_size), 0)).where(
+            col(Artwork.blob_sha256).is_(None)
+        )
+    ).one()
+    return StorageReport(
+        blob_count=blob_count,
+        reference_count=reference_count,
+        stored_bytes=stored_bytes,
+        referenced_bytes=referenced_bytes,
+        saved_bytes=referenced_bytes - stored_bytes,
+        legacy_artwork_count=legacy_artwork_count,
+        legacy_bytes=legacy_bytes,
+    )
@@ -0,0 +1,88 @@
+"""Conditional GET: answer `If-None-Match` with 304 before running the actual query
+
+each endpoint gets a cheap version of its data (aggregate over the rows it would
+return, read through the same index as the page), and ETag is hash of that and the
+request parameters. the ETag dependency must come before the dependency that loads
+data, so it's skipped on 304
+"""
+
+import hashlib
+from typing import Any, Sequence
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import BigInteger, Select, cast, func, null
+from sqlmodel import col, select
+
+from app.models import Artwork, Comment
+
+
+def make_etag(*parts: Any) -> str:
+    """weak ETag (same data, not necessarily same bytes) from hashable `parts`"""
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def check_etag(request: Request, response: Response, version: Sequence[Any]):
+    """raise 304 if client already has current version of requested data, otherwise
+    add ETag to response. ETag depends on path and query, so pages / filters differ
+    """
+    etag = make_etag(
+        request.url.path, sorted(request.query_params.multi_items()), *version
+    )
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # weak comparison, see RFC 9110 section 13.1.2
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if "*" in tags or etag.removeprefix("W/") in tags:
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+
+def artwork_version_columns(changed_at: Any = None) -> tuple[Any, ...]:
+    """columns to select in page statement for `artworks_version`. `changed_at` is
+    timestamp bumped when sort key from another table changes (e.g. trending score)
+    """
+    return (
+        col(Artwork.id).label("id"),
+        col(Artwork.updated_at).label("updated_at"),
+        col(Artwork.favorite_count).label("favorite_count"),
+        col(Artwork.comment_count).label("comment_count"),
+        (null() if changed_at is None else changed_at).label("changed_at"),
+    )
+
+
+def artworks_version(page: Select):
+    """version of artworks on a page
+
+    `page` is the keyset statement of the listing (see `apply_keyset`) selecting
+    `artwork_version_columns()`, so the aggregate reads the same index range as the
+    page itself, at any depth. count and sum of IDs catch artworks moving in / out of
+    the page, `updated_at` is bumped on every change of artwork. counters change
+    without bumping `updated_at`, so they're summed weighted by ID: plain sum wouldn't
+    change when one artwork gains a favorite and another loses one
+    """
+    window = page.subquery()
+    return select(
+        func.count(),
+        func.sum(window.c.id),
+        func.max(window.c.updated_at),
+        func.sum(cast(window.c.favorite_count, BigInteger) * window.c.id),
+        func.sum(cast(window.c.comment_count, BigInteger) * window.c.id),
+        func.max(window.c.changed_at),
+    )
+
+
+def artwork_version(artwork_id: int):
+    """version of artwork and its comments, no row if artwork doesn't exist
+
+    comments are never edited, deleting one and adding another keeps count,
+    but raises max `created_at`
+    """
+    of_artwork = col(Comment.artwork_id) == artwork_id
+    return select(
+        Artwork.updated_at,
+        Artwork.favorite_count,
+        Artwork.comment_count,
+        select(func.count()).where(of_artwork).scalar_subquery(),
+        select(func.max(Comment.created_at)).where(of_artwork).scalar_subquery(),
+    ).where(col(Artwork.id) == artwork_id)
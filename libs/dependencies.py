@@ -1,34 +1,47 @@
 from typing import Annotated
 
-import sqlalchemy.exc
 from fastapi import Depends, HTTPException, Request
 from sqlmodel import col, select
 
 from app.models import User
-from libs.db import SessionDep
+from libs.db import AsyncSessionDep
+from libs.server_timing import timed
+from libs.user_cache import UserSnapshot, cache_user, get_cached_user
 
 
-def get_current_user(request: Request, db: SessionDep) -> User:
+async def get_current_user(request: Request, db: AsyncSessionDep) -> UserSnapshot:
+    """Return snapshot of current user, from cache when possible (see `libs.user_cache`)"""
     session = request.session
     if "user_id" not in session:
         raise HTTPException(status_code=401, detail="Not logged in")
 
-    user_id = session["user_id"]
-    try:
-        user = db.exec(select(User).where(col(User.id) == int(user_id))).one()
+    user_id = int(session["user_id"])
+    with timed("auth"):
+        user = get_cached_user(user_id)
+        if user is not None:
+            return user
+
+        db_user = (
+            await db.exec(select(User).where(col(User.id) == user_id))
+        ).one_or_none()
+        if db_user is None:
+            session.clear()
+            raise HTTPException(status_code=401, detail="User is deleted")
+
+        user = UserSnapshot.from_user(db_user)
+        cache_user(user)
         return user
-    except sqlalchemy.exc.NoResultFound:
-        session.clear()
-        raise HTTPException(status_code=401, detail="User is deleted")
 
 
-def get_current_user_or_none(request: Request, db: SessionDep) -> User | None:
+async def get_current_user_or_none(
+    request: Request, db: AsyncSessionDep
+) -> UserSnapshot | None:
     """Return current user, or none if not logged in"""
     try:
-        return get_current_user(request=request, db=db)
+        return await get_current_user(request=request, db=db)
     except HTTPException:
         return None
 
 
-CurrentUser = Annotated[User, Depends(get_current_user)]
-CurrentUserOrNone = Annotated[User | None, Depends(get_current_user_or_none)]
+CurrentUser = Annotated[UserSnapshot, Depends(get_current_user)]
+CurrentUserOrNone = Annotated[UserSnapshot | None, Depends(get_current_user_or_none)]
@@ -0,0 +1,100 @@
+"""Favorites of current user
+
+(un)favoriting is one statement for any number of artworks, that returns artworks
+whose state actually changed (`INSERT ... ON CONFLICT DO NOTHING RETURNING` /
+`DELETE ... RETURNING`). repeating it changes nothing, and only returned artworks
+have their `favorite_count` and trending score updated, so they stay right under
+concurrent requests
+
+`favorited_by_me` of a listing page is looked up with one query for the whole page
+"""
+
+from typing import Collection, Sequence
+
+from sqlalchemy import delete, literal
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import Artwork, ArtworkListItem, UserFavoriteArtwork, _now
+from libs.db import dialect_insert
+
+
+def favorite_statement(db: AsyncSession, user_id: int, artwork_ids: Collection[int]):
+    """favorite existing artworks of `artwork_ids`, return (artwork ID, favorited at)
+    of newly favorited
+    """
+    favorites = select(literal(user_id), col(Artwork.id), literal(_now())).where(
+        col(Artwork.id).in_(artwork_ids)
+    )
+    return (
+        dialect_insert(db.sync_session, UserFavoriteArtwork)
+        .from_select(["user_id", "artwork_id", "favorited_at"], favorites)
+        .on_conflict_do_nothing(index_elements=["user_id", "artwork_id"])
+        .returning(
+            col(UserFavoriteArtwork.artwork_id), col(UserFavoriteArtwork.favorited_at)
+        )
+    )
+
+
+def unfavorite_statement(user_id: int, artwork_ids: Collection[int]):
+    """unfavorite artworks of `artwork_ids`, return (artwork ID, favorited at) of
+    those that were favorited
+    """
+    return (
+        delete(UserFavoriteArtwork)
+        .where(
+            col(UserFavoriteArtwork.user_id) == user_id,
+            col(UserFavoriteArtwork.artwork_id).in_(artwork_ids),
+        )
+        .returning(
+            col(UserFavoriteArtwork.artwork_id), col(UserFavoriteArtwork.favorited_at)
+        )
+    )
+
+
+def favorited_statement(user_id: int, artwork_ids: Collection[int]):
+    """IDs of artworks in `artwork_ids` favorited by user"""
+    return select(UserFavoriteArtwork.artwork_id).where(
+        col(UserFavoriteArtwork.user_id) == user_id,
+        col(UserFavoriteArtwork.artwork_id).in_(artwork_ids),
+    )
+
+
+def with_favorited(
+    artworks: Sequence[Artwork], favorited: Collection[int] | None
+) -> list[ArtworkListItem]:
+    """artworks with `favorited_by_me`, `favorited` is None when not logged in"""
+    return [
+        ArtworkListItem.model_validate(
+            artwork,
+            update={
+                "favorited_by_me": None
+                if favorited is None
+                else artwork.id in favorited
+            },
+        )
+        for artwork in artworks
+    ]
+
+
+async def load_favorited(
+    db: AsyncSession, user_id: int | None, artworks: Sequence[Artwork]
+) -> set[int] | None:
+    """IDs of `artworks` favorited by user, None when not logged in"""
+    if user_id is None:
+        return None
+    return set((await db.exec(_favorited_of(user_id, artworks))).all())
+
+
+def load_favorited_sync(
+    db: Session, user_id: int | None, artworks: Sequence[Artwork]
+) -> set[int] | None:
+    """`load_favorited` for sync session"""
+    if user_id is None:
+        return None
+    return set(db.exec(_favorited_of(user_id, artworks)).all())
+
+
+def _favorited_of(user_id: int, artworks: Sequence[Artwork]):
+    artwork_ids = [artwork.id for artwork in artworks if artwork.id is not None]
+    return favorited_statement(user_id, artwork_ids)
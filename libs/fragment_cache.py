@@ -0,0 +1,68 @@
+"""LRU cache of rendered HTML fragments, evicted by total size
+
+keys must change whenever the fragment would render differently (e.g. include
+`updated_at`), entries are never invalidated explicitly
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from markupsafe import Markup
+from pydantic import BaseModel
+
+
+class FragmentCacheStats(BaseModel):
+    entries: int
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class FragmentCache:
+    def __init__(self, max_size: int):
+        """- max_size: max total length of cached fragments (in characters)"""
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Markup] = OrderedDict()
+        self._size = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> Markup:
+        """return cached fragment of `key`, or call `render` and cache the result"""
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return fragment
+            self._misses += 1
+
+        # render outside of lock, same fragment may be rendered twice but that's harmless
+        fragment = Markup(render())
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = fragment
+            self._size += len(fragment)
+            while self._size > self.max_size and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self._evictions += 1
+        return fragment
+
+    def stats(self) -> FragmentCacheStats:
+        with self._lock:
+            return FragmentCacheStats(
+                entries=len(self._entries),
+                size=self._size,
+                max_size=self.max_size,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+            )
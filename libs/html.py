@@ -1,8 +1,11 @@
+from typing import AsyncIterable, AsyncIterator, Sequence
+
 import htpy as h
 from fastapi.responses import HTMLResponse
-from markupsafe import Markup
+from markupsafe import Markup, escape
 
-from app.models import User
+from libs.server_timing import timed
+from libs.user_cache import UserSnapshot
 
 _css_reset = """
 /* Reset for margins and paddings only, preserving all other styles */
@@ -97,7 +100,8 @@ _css = f"""
 CSS_BASE = h.style[Markup(_css)]
 
 
-def page_layout(user: User | None, *, body=None):
+def _page_layout_tree(username: str | None, body):
+    """Tree of page layout, rendered only once per variant, see `page_layout`"""
     return h.html[
         h.head[
             CSS_BASE,
@@ -117,7 +121,7 @@ def page_layout(user: User | None, *, body=None):
                     h.a(style="color: unset", href="/artworks/gallery.html")[
                         "All Artworks"
                     ],
-                    user
+                    username is not None
                     and h.a(style="color: unset", href="/artworks/mine.html")[
                         "My Artworks"
                     ],
@@ -130,11 +134,11 @@ def page_layout(user: User | None, *, body=None):
                                 h.div[h.a(href="/user/register.html")["Register"],],
                             ],
                         ]
-                        if not user
+                        if username is None
                         else [
                             h.p[
                                 "Hello! ",
-                                h.span(style="font-weight: bold")[user.username],
+                                h.span(style="font-weight: bold")[username],
                             ],
                             h.form(hx_post="/user/logout.html")[
                                 h.button(type="submit")["Logout"]
@@ -149,6 +153,61 @@ def page_layout(user: User | None, *, body=None):
     ]
 
 
+# markers where per-request content goes, can't appear in rendered HTML
+_USERNAME_SLOT = "\x00username\x00"
+_BODY_SLOT = Markup("\x00body\x00")
+
+# layout rendered once, split at the slots: [before body, after body]
+_guest_layout = str(_page_layout_tree(None, _BODY_SLOT)).split(_BODY_SLOT)
+# [before username, between username and body, after body]
+_user_layout = [
+    segment
+    for part in str(_page_layout_tree(_USERNAME_SLOT, _BODY_SLOT)).split(_USERNAME_SLOT)
+    for segment in part.split(_BODY_SLOT)
+]
+assert len(_guest_layout) == 2 and len(_user_layout) == 3
+
+
+@timed("render")
+def page_layout(user: UserSnapshot | None, *, body=None) -> Markup:
+    """Render page with site layout (top bar), `body` is any htpy node"""
+    body_html = h.render_node(body)
+    if user is None:
+        before_body, after_body = _guest_layout
+        return Markup("".join((before_body, body_html, after_body)))
+
+    before_username, before_body, after_body = _user_layout
+    return Markup(
+        "".join(
+            (before_username, escape(user.username), before_body, body_html, after_body)
+        )
+    )
+
+
+# marks where streamed content goes in `body` of `stream_page_layout`
+STREAM_SLOT = Markup("\x00stream\x00")
+
+
+async def stream_page_layout(
+    user: UserSnapshot | None,
+    *,
+    body,
+    streams: Sequence[AsyncIterable[str]],
+) -> AsyncIterator[str]:
+    """Like `page_layout`, but for `StreamingResponse`. each `STREAM_SLOT` in `body`
+    is replaced by chunks of corresponding stream, consumed in order.
+
+    everything before the first slot (`<head>`, top bar) is sent immediately
+    """
+    static_parts = page_layout(user, body=body).split(STREAM_SLOT)
+    assert len(static_parts) == len(streams) + 1
+    yield static_parts[0]
+    for stream, static_part in zip(streams, static_parts[1:]):
+        async for chunk in stream:
+            yield chunk
+        yield static_part
+
+
 def make_redirect_response(url, refresh_duration: int = 2) -> HTMLResponse:
     return HTMLResponse(
         content=str(
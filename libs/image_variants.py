@@ -0,0 +1,306 @@
+"""On-demand resized / re-encoded copies (variants) of artwork images, for `/img/{id}`
+
+unlike renditions (see `libs/renditions.py`) variants aren't stored in the database,
+they're rendered on first request in a process pool and kept in a disk cache that is
+bounded by total size, least recently used files are evicted first. the original
+never changes, so a variant never has to be invalidated
+
+concurrent requests for the same variant wait for one render instead of each
+rendering it. both the render collapsing and the LRU index are per process: with
+several server processes a variant may be rendered once per process, and a file
+evicted by another process is rendered again
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Literal
+
+from PIL import ExifTags, Image, ImageOps, features
+from pydantic import BaseModel
+
+from constants import UPLOAD_DIR
+
+VARIANTS_DIR = os.path.join(UPLOAD_DIR, "variants")
+IMAGE_CACHE_MAX_SIZE = int(os.environ.get("IMAGE_CACHE_MAX_SIZE", 512 * 1024 * 1024))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# largest width / height that can be requested
+MAX_DIMENSION = 4096
+# evicted files are deleted this many seconds later, so a response that got the path
+# just before can still open it (an open file stays readable after it's deleted)
+_EVICTION_DELAY = 60
+
+Fit = Literal["contain", "cover"]
+
+# (PIL format, media type, save options), in order of preference
+_FORMATS = {
+    "avif": ("AVIF", "image/avif", {"quality": 60, "speed": 8}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True}),
+}
+# formats this Pillow build can encode, JPEG is always available
+_ENCODABLE = [ext for ext in ("avif", "webp") if features.check(ext)] + ["jpeg"]
+# EXIF orientations that swap width and height
+_ROTATED = {5, 6, 7, 8}
+
+
+def media_type(ext: str) -> str:
+    return _FORMATS[ext][1]
+
+
+def negotiate_format(accept: str | None) -> str:
+    """best format (file extension) accepted by client, JPEG when nothing else is
+
+    browsers list `image/avif` / `image/webp` in `Accept` of image requests only if
+    they can decode them, wildcards don't count as support
+    """
+    accepted = set()
+    for item in (accept or "").split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        if "q=0" in params or "q=0.0" in params:
+            continue
+        accepted.add(media_type.lower())
+    for ext in _ENCODABLE:
+        if _FORMATS[ext][1] in accepted:
+            return ext
+    return "jpeg"
+
+
+def variant_box(
+    width: int, height: int, w: int | None, h: int | None, fit: Fit
+) -> tuple[int, int, Fit]:
+    """requested `w` x `h` box for (`width`, `height`) image, normalized so that
+    requests with the same result share a cache entry
+
+    `width` / `height` are stored before EXIF rotation, so the box is clamped to the
+    larger of them (same result in either orientation), missing side is unbounded.
+    `cover` needs both sides, without one it's `contain`
+    """
+    if w is None or h is None:
+        fit = "contain"
+    largest = max(width, height)
+    return min(w or largest, largest), min(h or largest, largest), fit
+
+
+def variant_size(width: int, height: int, w: int, h: int, fit: Fit) -> tuple[int, int]:
+    """output size of (`width`, `height`) image resized to `w` x `h`, never upscaled
+
+    `contain` fits whole image in the box, `cover` fills the box and crops what's
+    outside
+    """
+    w = min(w, width)
+    h = min(h, height)
+    if fit == "cover":
+        return w, h
+    scale = min(w / width, h / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def render_variant(
+    src_path: str, dst_path: str, box: tuple[int, int], fit: Fit, ext: str
+) -> tuple[tuple[int, int], int]:
+    """write `src_path` resized to `box` to `dst_path`, runs in worker process.
+    return output size and file size
+    """
+    format, _, options = _FORMATS[ext]
+    with Image.open(src_path) as original:
+        # size is computed from the image as displayed, i.e. after EXIF rotation
+        width, height = original.size
+        rotated = original.getexif().get(ExifTags.Base.Orientation) in _ROTATED
+        if rotated:
+            width, height = height, width
+        size = variant_size(width, height, *box, fit)
+        # let JPEG decoder downscale by power of 2, much faster for big photos
+        draft_size = (size[1], size[0]) if rotated else size
+        original.draft("RGB", (draft_size[0] * 2, draft_size[1] * 2))
+        im = ImageOps.exif_transpose(original)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        if fit == "cover":
+            im = ImageOps.fit(im, size, Image.Resampling.LANCZOS)
+        elif im.size != size:
+            im = im.resize(size, Image.Resampling.LANCZOS)
+        if format == "JPEG" and im.mode == "RGBA":
+            flattened = Image.new("RGB", im.size, (255, 255, 255))
+            flattened.paste(im, mask=im.getchannel("A"))
+            im = flattened
+        im.save(dst_path, format=format, **options)
+    return size, os.path.getsize(dst_path)
+
+
+class ImageCacheStats(BaseModel):
+    entries: int
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    # requests that waited for render of another request
+    collapsed: int
+    evictions: int
+
+
+class VariantCache:
+    """LRU of variant files in `directory`, evicted by total size
+
+    recency is kept in memory and written to file mtime, so it survives restarts
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # file name -> size, least recently used first
+        self._entries: OrderedDict[str, int] | None = None
+        self._size = 0
+        # evicted file name -> time.monotonic() when evicted, not deleted yet
+        self._evicted: dict[str, float] = {}
+        self._in_flight: dict[str, asyncio.Future[str]] = {}
+        self._executor: ProcessPoolExecutor | None = None
+        self._hits = 0
+        self._misses = 0
+        self._collapsed = 0
+        self._evictions = 0
+
+    def _load(self) -> OrderedDict[str, int]:
+        """index files left by previous runs, on first use"""
+        if self._entries is None:
+            os.makedirs(self.directory, exist_ok=True)
+            files = [
+                entry
+                for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.endswith(".tmp")
+            ]
+            files.sort(key=lambda entry: entry.stat().st_mtime)
+            self._entries = OrderedDict(
+                (entry.name, entry.stat().st_size) for entry in files
+            )
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return self._executor
+
+    def _purge_evicted(self):
+        """delete evicted files whose delay passed, on every lookup and add, so the
+        directory shrinks back to `max_size` even when nothing new is rendered
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            # ordered by eviction time
+            for evicted_name, evicted_at in self._evicted.items():
+                if evicted_at + _EVICTION_DELAY >= now:
+                    break
+                expired.append(evicted_name)
+            for evicted_name in expired:
+                del self._evicted[evicted_name]
+        for evicted_name in expired:
+            try:
+                os.remove(os.path.join(self.directory, evicted_name))
+            except FileNotFoundError:
+                pass
+
+    def _lookup(self, name: str) -> str | None:
+        self._purge_evicted()
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            entries = self._load()
+            if name not in entries:
+                return None
+            entries.move_to_end(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process
+            with self._lock:
+                self._size -= entries.pop(name, 0)
+            return None
+        return path
+
+    def _add(self, name: str, file_size: int):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._load()
+            self._size += file_size - entries.pop(name, 0)
+            entries[name] = file_size
+            # rendered again after eviction, the file is the new one
+            self._evicted.pop(name, None)
+            while self._size > self.max_size and len(entries) > 1:
+                evicted_name, evicted_size = entries.popitem(last=False)
+                self._size -= evicted_size
+                self._evictions += 1
+                self._evicted[evicted_name] = now
+        self._purge_evicted()
+
+    async def _render(
+        self, name: str, src_path: str, box: tuple[int, int], fit: Fit, ext: str
+    ) -> str:
+        path = os.path.join(self.directory, name)
+        # unique temporary name, other processes may render the same variant
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            future = self._get_executor().submit(
+                render_variant, src_path, tmp_path, box, fit, ext
+            )
+            _, file_size = await asyncio.wrap_future(future)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._add(name, file_size)
+        return path
+
+    async def get_or_render(
+        self, src_path: str, box: tuple[int, int], fit: Fit, ext: str
+    ) -> str:
+        """path of cached variant of image at `src_path` (relative to upload dir),
+        rendered first if it isn't cached. `box` is from `variant_box`
+        """
+        key = f"{src_path}\0{box[0]}x{box[1]}\0{fit}"
+        name = f"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}.{ext}"
+
+        path = self._lookup(name)
+        if path is not None:
+            self._hits += 1
+            return path
+
+        future = self._in_flight.get(name)
+        if future is not None:
+            self._collapsed += 1
+            # shield: a cancelled (disconnected) waiter must not cancel the render
+            return await asyncio.shield(future)
+
+        self._misses += 1
+        future = asyncio.ensure_future(
+            self._render(name, os.path.join(UPLOAD_DIR, src_path), box, fit, ext)
+        )
+        self._in_flight[name] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(name, None))
+        return await asyncio.shield(future)
+
+    def stats(self) -> ImageCacheStats:
+        with self._lock:
+            self._load()
+            return ImageCacheStats(
+                entries=len(self._entries or ()),
+                size=self._size,
+                max_size=self.max_size,
+                hits=self._hits,
+                misses=self._misses,
+                collapsed=self._collapsed,
+                evictions=self._evictions,
+            )
+
+
+variant_cache = VariantCache(VARIANTS_DIR, IMAGE_CACHE_MAX_SIZE)
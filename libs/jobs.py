@@ -0,0 +1,147 @@
+"""Background jobs stored in `job` table, so work outlives the request and the process
+
+enqueue in the same transaction as the data the job is about, then it's run once
+that is committed (and only then). workers (`python -m jobs.worker`) claim due jobs
+with `SELECT ... FOR UPDATE SKIP LOCKED`, so any number of them can run without
+taking the same job. failed jobs are retried with exponential backoff, up to
+`Job.max_attempts` times, then kept with `failed` status for inspection.
+
+NOTE: SQLite has no `FOR UPDATE`, run only one worker process with it
+"""
+
+import logging
+import os
+import random
+import traceback
+from datetime import timedelta
+from typing import Any, Callable
+
+from pydantic import BaseModel
+from sqlalchemy import delete, func, update
+from sqlmodel import Session, col, select
+
+from app.models import Job, _now
+
+QUEUED = "queued"
+RUNNING = "running"
+FAILED = "failed"
+
+JOB_RETRY_BASE_DELAY = float(os.environ.get("JOB_RETRY_BASE_DELAY", 10))
+JOB_RETRY_MAX_DELAY = 3600
+# running job locked for longer than this is assumed lost (worker died), and requeued
+JOB_LOCK_TIMEOUT = float(os.environ.get("JOB_LOCK_TIMEOUT", 600))
+
+# kind -> handler, called with payload as keyword arguments
+_handlers: dict[str, Callable[..., None]] = {}
+
+
+def job_handler(kind: str):
+    """register decorated function as handler of jobs of `kind`"""
+
+    def register(fn: Callable[..., None]):
+        _handlers[kind] = fn
+        return fn
+
+    return register
+
+
+def enqueue(
+    session: Session, kind: str, payload: dict[str, Any], *, max_attempts: int = 5
+) -> Job:
+    """add job, it's visible to workers when caller commits"""
+    job = Job(kind=kind, payload=payload, max_attempts=max_attempts)
+    session.add(job)
+    return job
+
+
+def claim_job(session: Session, worker: str) -> Job | None:
+    """take next due job and mark it running, None if there is none"""
+    job = session.exec(
+        select(Job)
+        .where(col(Job.status) == QUEUED, col(Job.run_at) <= _now())
+        .order_by(col(Job.run_at))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if job is None:
+        session.rollback()
+        return None
+
+    job.status = RUNNING
+    job.attempts += 1
+    job.locked_by = worker
+    job.locked_at = _now()
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def retry_delay(attempts: int) -> float:
+    """seconds before next attempt, doubles after each one. jitter spreads retries of
+    jobs that failed together (e.g. database was down)
+    """
+    delay = min(JOB_RETRY_BASE_DELAY * 2 ** (attempts - 1), JOB_RETRY_MAX_DELAY)
+    return delay * random.uniform(1, 1.1)
+
+
+def run_job(session: Session, job: Job):
+    """run claimed job, delete it when done, schedule retry or mark failed on error"""
+    try:
+        handler = _handlers.get(job.kind)
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job.kind}")
+        handler(**job.payload)
+    except Exception:
+        logging.exception(f"Job {job.id} ({job.kind}) failed, attempt {job.attempts}")
+        job.last_error = traceback.format_exc()
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts < job.max_attempts:
+            job.status = QUEUED
+            job.run_at = _now() + timedelta(seconds=retry_delay(job.attempts))
+        else:
+            job.status = FAILED
+        session.add(job)
+        session.commit()
+        return
+
+    session.exec(delete(Job).where(col(Job.id) == job.id))  # type: ignore
+    session.commit()
+
+
+def requeue_stale_jobs(session: Session) -> int:
+    """requeue running jobs of workers that died, return number of requeued jobs"""
+    result = session.exec(  # type: ignore
+        update(Job)
+        .where(
+            col(Job.status) == RUNNING,
+            col(Job.locked_at) < _now() - timedelta(seconds=JOB_LOCK_TIMEOUT),
+        )
+        .values(status=QUEUED, locked_by=None, locked_at=None)
+    )
+    session.commit()
+    return result.rowcount
+
+
+class JobStats(BaseModel):
+    queued: int
+    # queued and already due, work waiting for workers
+    due: int
+    running: int
+    failed: int
+
+
+def job_stats(session: Session) -> JobStats:
+    counts = dict(
+        session.exec(select(Job.status, func.count()).group_by(col(Job.status))).all()
+    )
+    due = session.exec(
+        select(func.count()).where(col(Job.status) == QUEUED, col(Job.run_at) <= _now())
+    ).one()
+    return JobStats(
+        queued=counts.get(QUEUED, 0),
+        due=due,
+        running=counts.get(RUNNING, 0),
+        failed=counts.get(FAILED, 0),
+    )
@@ -0,0 +1,81 @@
+import base64
+import binascii
+import datetime
+import json
+from typing import Annotated, Any, Callable, Generic, NamedTuple, Sequence, TypeVar
+
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy import tuple_
+
+T = TypeVar("T")
+
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+PageSize = Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)]
+
+
+class Page(NamedTuple, Generic[T]):
+    """Result of keyset paginated query, `next_cursor` is None on last page
+
+    NOTE: this is intentionally not a pydantic model / dataclass, FastAPI would
+    dump those before validating with `response_model` and lose ORM relationships
+    """
+
+    items: Sequence[T]
+    next_cursor: str | None
+
+
+class CursorPage(BaseModel, Generic[T]):
+    """Paginated response, pass `next_cursor` as `cursor` to get next page"""
+
+    items: list[T]
+    next_cursor: str | None
+
+
+def encode_cursor(*values: Any) -> str:
+    payload = [
+        value.isoformat() if isinstance(value, datetime.datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> list[Any]:
+    """decode cursor into values, converted to `types`"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("Cursor length mismatch")
+        return [
+            datetime.datetime.fromisoformat(value)
+            if type_ is datetime.datetime
+            else type_(value)
+            for type_, value in zip(types, payload)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def apply_keyset(statement, *, keys: Sequence[Any], cursor: str | None, limit: int):
+    """order `statement` by `keys` (descending) and seek past `cursor`
+
+    fetches one extra row, so `make_page` can tell whether there is a next page.
+    `keys` must be unique together (e.g. timestamp + id) and should be covered by an index
+    """
+    if cursor:
+        values = decode_cursor(cursor, [key.type.python_type for key in keys])
+        statement = statement.where(tuple_(*keys) < tuple_(*values))
+    return statement.order_by(*(key.desc() for key in keys)).limit(limit + 1)
+
+
+def make_page(
+    rows: Sequence[T], *, limit: int, key_of: Callable[[T], tuple[Any, ...]]
+) -> Page[T]:
+    """build page from rows fetched by statement from `apply_keyset`"""
+    items = rows[:limit]
+    next_cursor = encode_cursor(*key_of(items[-1])) if len(rows) > limit else None
+    return Page(items=items, next_cursor=next_cursor)
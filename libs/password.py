@@ -1,6 +1,16 @@
+import asyncio
 import base64
 import hashlib
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
 
 
 class PasswordValidationError(Exception):
@@ -34,3 +44,128 @@ def verify_password(password: str, hash: str):
     hashed = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p)
     if hashed != expected_hash:
         raise PasswordValidationError("Password mismatch")
+
+
+# -- process pool
+# scrypt is CPU heavy, run it in separate processes so login / register don't slow
+# down other requests on the same worker
+
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", 2))
+# max hash / verify jobs submitted (running + waiting), more are rejected
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", 32))
+
+
+class PasswordPoolBusy(Exception):
+    """too many password jobs are queued, caller should retry later"""
+
+
+class PasswordPoolStats(BaseModel):
+    """Password pool metrics since process start, durations are in seconds"""
+
+    workers: int
+    queue_limit: int
+    in_flight: int
+    completed: int
+    rejected: int
+    # time spent in scrypt
+    avg_hash_seconds: float
+    max_hash_seconds: float
+    # time between submit and start of job in worker
+    avg_queue_wait_seconds: float
+    max_queue_wait_seconds: float
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_hash = 0.0
+        self.max_hash = 0.0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+_stats = _Stats()
+_executor: ProcessPoolExecutor | None = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _executor
+
+
+def _run_timed(
+    fn: Callable[..., T], *args
+) -> tuple[T | None, Exception | None, float, float]:
+    """run `fn` in worker, return (result, error, started_at, finished_at)
+
+    timestamps are wall clock, so they can be compared with submit time in parent
+    """
+    started_at = time.time()
+    try:
+        result, error = fn(*args), None
+    except Exception as e:
+        result, error = None, e
+    return result, error, started_at, time.time()
+
+
+async def _submit(fn: Callable[..., T], *args) -> T:
+    with _stats.lock:
+        if _stats.in_flight >= PASSWORD_QUEUE_LIMIT:
+            _stats.rejected += 1
+            raise PasswordPoolBusy("Password pool is saturated")
+        _stats.in_flight += 1
+
+    submitted_at = time.time()
+    try:
+        future = _get_executor().submit(_run_timed, fn, *args)
+        result, error, started_at, finished_at = await asyncio.wrap_future(future)
+    finally:
+        with _stats.lock:
+            _stats.in_flight -= 1
+
+    hash_seconds = finished_at - started_at
+    wait_seconds = max(0.0, started_at - submitted_at)
+    with _stats.lock:
+        _stats.completed += 1
+        _stats.total_hash += hash_seconds
+        _stats.max_hash = max(_stats.max_hash, hash_seconds)
+        _stats.total_wait += wait_seconds
+        _stats.max_wait = max(_stats.max_wait, wait_seconds)
+
+    if error is not None:
+        raise error
+    return result  # type: ignore
+
+
+async def hash_password_async(password: str) -> str:
+    """`hash_password` in password pool, raise `PasswordPoolBusy` when saturated"""
+    return await _submit(hash_password, password)
+
+
+async def verify_password_async(password: str, hash: str):
+    """`verify_password` in password pool, raise `PasswordPoolBusy` when saturated"""
+    await _submit(verify_password, password, hash)
+
+
+def password_pool_stats() -> PasswordPoolStats:
+    with _stats.lock:
+        completed = _stats.completed
+        return PasswordPoolStats(
+            workers=PASSWORD_WORKERS,
+            queue_limit=PASSWORD_QUEUE_LIMIT,
+            in_flight=_stats.in_flight,
+            completed=completed,
+            rejected=_stats.rejected,
+            avg_hash_seconds=_stats.total_hash / completed if completed else 0.0,
+            max_hash_seconds=_stats.max_hash,
+            avg_queue_wait_seconds=_stats.total_wait / completed if completed else 0.0,
+            max_queue_wait_seconds=_stats.max_wait,
+        )
@@ -0,0 +1,66 @@
+"""Placeholders painted while artwork image loads: dominant color and tiny blurred
+image (LQIP) as `data:` URI, both inlined in card HTML, so no extra request is needed
+
+computed with renditions (see `libs/renditions.py`), `jobs.backfill_placeholders`
+computes them for older artworks
+"""
+
+import base64
+import io
+from typing import NamedTuple
+
+from PIL import Image, ImageFilter, ImageOps
+
+# longer side of LQIP in pixels, it's scaled up (and smoothed) by browser
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 60
+# size of image that dominant color is picked from
+_COLOR_SAMPLE_SIZE = 64
+_COLOR_COUNT = 5
+
+
+class Placeholder(NamedTuple):
+    # "#rrggbb"
+    color: str
+    # "data:image/jpeg;base64,..."
+    data_uri: str
+
+
+def compute_placeholder(im: Image.Image) -> Placeholder:
+    """placeholder of RGB / RGBA image, `im` should already be small (downscaled)"""
+    if im.mode == "RGBA":
+        background = Image.new("RGB", im.size, (255, 255, 255))
+        background.paste(im, mask=im.getchannel("A"))
+        im = background
+    elif im.mode != "RGB":
+        im = im.convert("RGB")
+
+    sample = im.copy()
+    sample.thumbnail((_COLOR_SAMPLE_SIZE, _COLOR_SAMPLE_SIZE), Image.Resampling.BOX)
+    # most common of few representative colors, average would be muddy
+    quantized = sample.quantize(colors=_COLOR_COUNT)
+    palette = quantized.getpalette() or []
+    _, index = max(quantized.getcolors() or [(0, 0)])
+    red, green, blue = palette[index * 3 : index * 3 + 3] or (128, 128, 128)
+
+    tiny = im.copy()
+    tiny.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BOX)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(0.5))
+    out = io.BytesIO()
+    tiny.save(out, format="JPEG", quality=PLACEHOLDER_QUALITY, optimize=True)
+    return Placeholder(
+        color=f"#{red:02x}{green:02x}{blue:02x}",
+        data_uri=f"data:image/jpeg;base64,{base64.b64encode(out.getvalue()).decode()}",
+    )
+
+
+def placeholder_of_file(path: str) -> Placeholder:
+    """placeholder of image file, decoded at reduced size where format supports it"""
+    with Image.open(path) as im:
+        # JPEG can be decoded at 1/2 - 1/8 scale, much faster than full decode
+        im.draft("RGB", (_COLOR_SAMPLE_SIZE * 2, _COLOR_SAMPLE_SIZE * 2))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((_COLOR_SAMPLE_SIZE * 2, _COLOR_SAMPLE_SIZE * 2))
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        return compute_placeholder(im)
@@ -0,0 +1,127 @@
+"""Per-request SQL statistics, to catch N+1 queries (lazy loads in a loop)
+
+engine events count statements and time of every query made while handling a
+request, grouped by normalized SQL. `QueryStatsMiddleware` exposes them in response
+headers and warns when a request runs the same statement more than
+`QUERY_REPEAT_LIMIT` times, or raises `RepeatedQueryError` when `QUERY_REPEAT_STRICT`
+is set (for tests / CI)
+
+- X-DB-Queries: number of statements
+- X-DB-Time: total time spent in the database, in milliseconds
+- X-DB-Max-Repeats: count of the most repeated statement
+
+NOTE: headers are sent before body, so queries of streamed bodies (see
+`ArtworkCardStream`) aren't in headers, but are still checked for repeats
+"""
+
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import Engine, event
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+QUERY_REPEAT_LIMIT = int(os.environ.get("QUERY_REPEAT_LIMIT", 10))
+QUERY_REPEAT_STRICT = os.environ.get("QUERY_REPEAT_STRICT", "") not in ("", "0")
+
+# `IN` with expanded parameters, e.g. `IN (?, ?, ?)` / `IN ($1::INTEGER, $2::INTEGER)`
+_param_list = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|\$\d+(?:::\w+)?)\s*,?)+\)")
+_whitespace = re.compile(r"\s+")
+
+
+class RepeatedQueryError(Exception):
+    pass
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    # seconds
+    duration: float = 0
+    statements: Counter[str] = field(default_factory=Counter)
+
+    def most_repeated(self) -> tuple[str, int] | None:
+        most_common = self.statements.most_common(1)
+        return most_common[0] if most_common else None
+
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> QueryStats | None:
+    """stats of current request, None outside of request (e.g. background jobs)"""
+    return _current.get()
+
+
+def normalize_sql(statement: str) -> str:
+    """same statement with any number of `IN` parameters normalizes to the same string"""
+    return _whitespace.sub(" ", _param_list.sub("(?)", statement)).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.count += 1
+    stats.duration += time.perf_counter() - start
+    stats.statements[normalize_sql(statement)] += 1
+
+
+def instrument_engine(engine: Engine):
+    """record queries of `engine`, for async engine pass `async_engine.sync_engine`"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        # sync endpoints run in threadpool with copy of context, which still
+        # refers to the same `stats`
+        token = _current.set(stats)
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Queries"] = str(stats.count)
+                headers["X-DB-Time"] = f"{stats.duration * 1000:.1f}"
+                most_repeated = stats.most_repeated()
+                headers["X-DB-Max-Repeats"] = str(
+                    most_repeated[1] if most_repeated else 0
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
+        self._check_repeats(scope, stats)
+
+    def _check_repeats(self, scope: Scope, stats: QueryStats):
+        most_repeated = stats.most_repeated()
+        if most_repeated is None or most_repeated[1] <= QUERY_REPEAT_LIMIT:
+            return
+        statement, count = most_repeated
+        message = (
+            f"{scope['method']} {scope['path']} ran the same statement {count} times"
+            f" (limit {QUERY_REPEAT_LIMIT}), missing eager load? {statement}"
+        )
+        if QUERY_REPEAT_STRICT:
+            raise RepeatedQueryError(message)
+        logging.warning(message)
@@ -0,0 +1,177 @@
+"""Resized copies (renditions) of uploaded artworks, for `srcset` in listing / detail page
+
+renditions are generated by background job (see `libs/jobs.py`), so upload returns
+as soon as the original is stored. until they're ready, pages fall back to the
+original image. placeholder (see `libs/placeholders.py`)
+is computed from the smallest rendition, so the image is decoded only once
+
+file name has hash of its content, so regenerated rendition (or one of artwork with
+reused ID) gets new URL, and they can be cached forever (see `libs/static.py`)
+"""
+
+import hashlib
+import os
+import re
+import shutil
+from typing import NamedTuple, Sequence
+
+from PIL import Image, ImageOps
+from sqlalchemy import delete, update
+from sqlmodel import Session, col
+
+from app.models import Artwork, ArtworkRendition, _now
+from constants import UPLOAD_DIR
+from libs.db import engine
+from libs.jobs import enqueue, job_handler
+from libs.placeholders import Placeholder, compute_placeholder
+
+RENDITION_WIDTHS = (320, 768, 1600)
+# (format, file extension, save options), in order of preference for <picture>
+RENDITION_FORMATS = (
+    ("WEBP", "webp", {"quality": 80, "method": 4}),
+    ("JPEG", "jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+)
+RENDITIONS_DIR = os.path.join(UPLOAD_DIR, "renditions")
+# `<width>w-<hash>.<ext>`, renditions generated before had no hash
+_VERSIONED_NAME = re.compile(r"\d+w-[0-9a-f]{16}\.\w+")
+
+
+class RenditionInfo(NamedTuple):
+    format: str
+    width: int
+    height: int
+    # relative to upload dir
+    path: str
+    file_size: int
+
+
+def _rendition_widths(original_width: int) -> list[int]:
+    """widths to generate, never upscale, but always generate at least one"""
+    widths = [width for width in RENDITION_WIDTHS if width < original_width]
+    return widths or [original_width]
+
+
+def is_versioned(path: str) -> bool:
+    """whether rendition at `path` has hash of its content in file name"""
+    return _VERSIONED_NAME.fullmatch(os.path.basename(path)) is not None
+
+
+def generate_renditions(
+    src_path: str, artwork_id: int
+) -> tuple[list[RenditionInfo], Placeholder]:
+    """Generate renditions and placeholder of image at `src_path`"""
+    dst_dir = os.path.join(RENDITIONS_DIR, str(artwork_id))
+    os.makedirs(dst_dir, exist_ok=True)
+
+    renditions = []
+    with Image.open(src_path) as original:
+        # apply EXIF rotation, as browser does for the original
+        im = ImageOps.exif_transpose(original)
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+
+        for width in sorted(_rendition_widths(im.width), reverse=True):
+            height = max(1, round(im.height * width / im.width))
+            # downscale from previous (larger) size, it's faster and the same quality
+            im = im.resize((width, height), Image.Resampling.LANCZOS)
+            for format, ext, options in RENDITION_FORMATS:
+                out = im
+                if format == "JPEG" and im.mode == "RGBA":
+                    out = Image.new("RGB", im.size, (255, 255, 255))
+                    out.paste(im, mask=im.getchannel("A"))
+
+                tmp_path = os.path.join(dst_dir, f"{width}w.{ext}.tmp")
+                out.save(tmp_path, format=format, **options)
+                with open(tmp_path, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256").hexdigest()[:16]
+                dst_path = os.path.join(dst_dir, f"{width}w-{digest}.{ext}")
+                os.replace(tmp_path, dst_path)
+                renditions.append(
+                    RenditionInfo(
+                        format=ext,
+                        width=width,
+                        height=height,
+                        path=os.path.relpath(dst_path, start=UPLOAD_DIR),
+                        file_size=os.path.getsize(dst_path),
+                    )
+                )
+        placeholder = compute_placeholder(im)
+    return renditions, placeholder
+
+
+def store_renditions(
+    session: Session,
+    artwork_id: int,
+    renditions: Sequence[RenditionInfo],
+    placeholder: Placeholder,
+):
+    """replace renditions and placeholder of artwork, bump `updated_at` so cached pages
+    are refreshed
+    """
+    session.exec(  # type: ignore
+        delete(ArtworkRendition).where(col(ArtworkRendition.artwork_id) == artwork_id)
+    )
+    session.add_all(
+        ArtworkRendition(artwork_id=artwork_id, **rendition._asdict())
+        for rendition in renditions
+    )
+    session.exec(  # type: ignore
+        update(Artwork)
+        .where(col(Artwork.id) == artwork_id)
+        .values(
+            dominant_color=placeholder.color,
+            placeholder=placeholder.data_uri,
+            updated_at=_now(),
+        )
+    )
+    session.commit()
+
+
+def remove_renditions(artwork_id: int):
+    """remove rendition files of artwork, rows are deleted with the artwork"""
+    shutil.rmtree(os.path.join(RENDITIONS_DIR, str(artwork_id)), ignore_errors=True)
+
+
+def _remove_replaced_renditions(artwork_id: int, renditions: Sequence[RenditionInfo]):
+    """remove rendition files of artwork from previous generation"""
+    dst_dir = os.path.join(RENDITIONS_DIR, str(artwork_id))
+    current = {os.path.basename(rendition.path) for rendition in renditions}
+    for name in os.listdir(dst_dir):
+        if name not in current and not name.endswith(".tmp"):
+            os.remove(os.path.join(dst_dir, name))
+
+
+@job_handler("renditions")
+def process_renditions(artwork_id: int):
+    """job: generate and store renditions and placeholder of artwork"""
+    with Session(engine) as session:
+        artwork = session.get(Artwork, artwork_id)
+        if artwork is None:
+            # deleted before the job ran
+            return
+        src_path = os.path.join(UPLOAD_DIR, artwork.path)
+        # don't keep transaction open while generating
+        session.rollback()
+
+        renditions, placeholder = generate_renditions(src_path, artwork_id)
+        if session.get(Artwork, artwork_id) is None:
+            # deleted while generating, its renditions were removed before these were written
+            remove_renditions(artwork_id)
+            return
+        store_renditions(session, artwork_id, renditions, placeholder)
+        _remove_replaced_renditions(artwork_id, renditions)
+
+
+def schedule_renditions(session: Session, *artwork_ids: int | None):
+    """enqueue generating renditions of artworks, run by worker after caller commits"""
+    for artwork_id in artwork_ids:
+        assert artwork_id is not None
+        enqueue(session, "renditions", {"artwork_id": artwork_id})
+
+
+def srcset(renditions: Sequence[ArtworkRendition], format: str) -> str:
+    return ", ".join(
+        f"/uploads/{rendition.path} {rendition.width}w"
+        for rendition in sorted(renditions, key=lambda rendition: rendition.width)
+        if rendition.format == format
+    )
@@ -0,0 +1,321 @@
+"""Full-text search for artworks (gallery `query` parameter)
+
+Two backends, picked by database dialect (or `SEARCH_BACKEND` env: `postgres`, `memory`)
+- postgres: weighted `artwork.search_vector` (name > description) with GIN index,
+  plus trigram index on `name || ' ' || description` for partial-word matches.
+  both are created by migration, not by models (see `migrations/env.py`)
+- memory: in-process inverted index, built on first search and kept up to date
+  by `index_artwork` / `remove_artwork`. Used for SQLite and benchmarking,
+  NOTE: each process has it's own index, so it only sees changes made by that process
+"""
+
+import bisect
+import os
+import re
+import threading
+from typing import Mapping, NamedTuple, Protocol, Sequence
+
+from markupsafe import Markup, escape
+from sqlalchemy import Float, cast, func, literal_column
+from sqlalchemy.orm import joinedload, selectinload
+from sqlmodel import Session, col, select
+
+from app.models import Artwork, ArtworkListItem
+from libs.pagination import CursorPage, apply_keyset, decode_cursor, encode_cursor
+
+_token = re.compile(r"\w+")
+
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+# partial-word (prefix) match is worth less than whole word
+PREFIX_MATCH_FACTOR = 0.5
+SNIPPET_WORDS = 24
+
+
+class SearchPage(NamedTuple):
+    """Page of search results, sorted by relevance
+
+    - snippets: artwork ID -> HTML of description with matches wrapped in `<mark>`
+    """
+
+    items: Sequence[Artwork]
+    next_cursor: str | None
+    snippets: Mapping[int, str]
+
+
+class ArtworkSearchPage(CursorPage[ArtworkListItem]):
+    """Page of artworks, with highlighted snippets when searching"""
+
+    snippets: dict[int, str] = {}
+
+
+class SearchBackend(Protocol):
+    def search(
+        self, db: Session, query: str, *, cursor: str | None, limit: int
+    ) -> SearchPage: ...
+
+    def index_artwork(self, artwork: Artwork) -> None:
+        """called after artwork is created or its name / description is updated"""
+        ...
+
+    def remove_artwork(self, artwork_id: int) -> None: ...
+
+
+def _tokenize(text: str) -> list[str]:
+    return [token.lower() for token in _token.findall(text)]
+
+
+def _highlight(text: str, terms: set[str]) -> str:
+    """escape `text` and wrap words starting with any of `terms` in <mark>
+
+    long text is cut to window of `SNIPPET_WORDS` words around first match
+    """
+    words = list(_token.finditer(text))
+    first = next(
+        (
+            i
+            for i, word in enumerate(words)
+            if word.group().lower().startswith(tuple(terms))
+        ),
+        0,
+    )
+    start_word = max(0, first - SNIPPET_WORDS // 4)
+    end_word = min(len(words), start_word + SNIPPET_WORDS)
+    start = words[start_word].start() if start_word > 0 else 0
+    end = words[end_word].start() if end_word < len(words) else len(text)
+
+    parts: list[str] = ["…" if start > 0 else ""]
+    pos = start
+    for word in words[start_word:end_word]:
+        parts.append(escape(text[pos : word.start()]))
+        if word.group().lower().startswith(tuple(terms)):
+            parts.append(Markup("<mark>%s</mark>") % word.group())
+        else:
+            parts.append(escape(word.group()))
+        pos = word.end()
+    parts.append(escape(text[pos:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts)
+
+
+def _load_artworks(db: Session, ids: Sequence[int]) -> list[Artwork]:
+    """load artworks by ID, preserving order of `ids`"""
+    artworks = db.exec(
+        select(Artwork)
+        .where(col(Artwork.id).in_(ids))
+        .options(
+            joinedload(Artwork.author),  # type: ignore
+            selectinload(Artwork.renditions),  # type: ignore
+        )
+    ).all()
+    by_id = {artwork.id: artwork for artwork in artworks}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+class PostgresSearchBackend:
+    """Search using `artwork.search_vector` and trigram index, see migration 9b2e4d1a6c73"""
+
+    # must match index expressions exactly, so that the indexes are used
+    search_vector = literal_column("artwork.search_vector")
+    document = col(Artwork.name) + literal_column("' '") + col(Artwork.description)
+
+    def search(
+        self, db: Session, query: str, *, cursor: str | None, limit: int
+    ) -> SearchPage:
+        tsquery = func.websearch_to_tsquery("simple", query)
+        escaped = re.sub(r"([/%_])", r"/\1", query)
+        # both return `real`, compared as double precision with the cursor value
+        # would skip / repeat rows tied at page boundary
+        rank = cast(
+            func.ts_rank_cd(self.search_vector, tsquery)
+            + func.similarity(self.document, query),
+            Float,
+        )
+        statement = apply_keyset(
+            select(rank, col(Artwork.id)).where(
+                self.search_vector.op("@@")(tsquery)
+                | self.document.ilike(f"%{escaped}%", escape="/")
+            ),
+            keys=(rank, col(Artwork.id)),
+            cursor=cursor,
+            limit=limit,
+        )
+        rows = db.exec(statement).all()
+
+        page_rows = rows[:limit]
+        next_cursor = encode_cursor(*page_rows[-1]) if len(rows) > limit else None
+        ids = [id for _, id in page_rows]
+        return SearchPage(
+            items=_load_artworks(db, ids),
+            next_cursor=next_cursor,
+            snippets=self._snippets(db, ids, tsquery) if ids else {},
+        )
+
+    def _snippets(self, db: Session, ids: list[int], tsquery) -> dict[int, str]:
+        """headline for artworks in current page only, `ts_headline` is expensive"""
+        description = col(Artwork.description)
+        # escape before `ts_headline`, so only the <mark> it adds are HTML
+        for char, entity in (
+            ("&", "&amp;"),
+            ("<", "&lt;"),
+            (">", "&gt;"),
+            ('"', "&quot;"),
+        ):
+            description = func.replace(description, char, entity)
+        headline = func.ts_headline(
+            "simple",
+            description,
+            tsquery,
+            f"StartSel=<mark>, StopSel=</mark>, MaxWords={SNIPPET_WORDS}, MinWords=8",
+        )
+        rows = db.exec(
+            select(col(Artwork.id), headline).where(col(Artwork.id).in_(ids))
+        ).all()
+        return {id: snippet for id, snippet in rows}
+
+    def index_artwork(self, artwork: Artwork) -> None:
+        # `search_vector` is generated column, maintained by the database
+        pass
+
+    def remove_artwork(self, artwork_id: int) -> None:
+        pass
+
+
+class InMemorySearchBackend:
+    """In-process inverted index: term -> {artwork ID: weight}
+
+    query terms are AND-ed, each query term matches indexed terms with it as prefix.
+    score is sum of best weight of each query term, results sorted by (score, ID) desc
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = False
+        self._postings: dict[str, dict[int, float]] = {}
+        self._doc_terms: dict[int, set[str]] = {}
+        # sorted list of terms for prefix lookup, rebuilt lazily
+        self._sorted_terms: list[str] | None = None
+
+    def _build(self, db: Session):
+        # NOTE: query runs outside of `_lock`, async routes call `search` through
+        # `AsyncSession.run_sync` on the event loop, where holding a thread lock while
+        # waiting for the database would block every other request
+        rows = db.exec(
+            select(col(Artwork.id), col(Artwork.name), col(Artwork.description))
+        ).all()
+        with self._lock:
+            if self._built:
+                return
+            for id, name, description in rows:
+                self._add(id, name, description)
+            self._built = True
+
+    def _add(self, artwork_id: int, name: str, description: str):
+        weights: dict[str, float] = {}
+        for term in _tokenize(description):
+            weights[term] = weights.get(term, 0) + DESCRIPTION_WEIGHT
+        for term in _tokenize(name):
+            weights[term] = weights.get(term, 0) + NAME_WEIGHT
+
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._postings[term] = {}
+                self._sorted_terms = None
+            self._postings[term][artwork_id] = weight
+        self._doc_terms[artwork_id] = set(weights)
+
+    def _remove(self, artwork_id: int):
+        for term in self._doc_terms.pop(artwork_id, ()):
+            postings = self._postings[term]
+            postings.pop(artwork_id, None)
+            if not postings:
+                del self._postings[term]
+                self._sorted_terms = None
+
+    def _matching_terms(self, prefix: str) -> list[str]:
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = self._sorted_terms
+        start = bisect.bisect_left(terms, prefix)
+        end = bisect.bisect_left(terms, prefix + "\U0010ffff", lo=start)
+        return terms[start:end]
+
+    def _scores(self, query_terms: list[str]) -> dict[int, float]:
+        scores: dict[int, float] | None = None
+        for query_term in query_terms:
+            term_scores: dict[int, float] = {}
+            for term in self._matching_terms(query_term):
+                factor = 1.0 if term == query_term else PREFIX_MATCH_FACTOR
+                for id, weight in self._postings[term].items():
+                    term_scores[id] = max(term_scores.get(id, 0), weight * factor)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    id: score + term_scores[id]
+                    for id, score in scores.items()
+                    if id in term_scores
+                }
+            if not scores:
+                break
+        return scores or {}
+
+    def search(
+        self, db: Session, query: str, *, cursor: str | None, limit: int
+    ) -> SearchPage:
+        query_terms = list(dict.fromkeys(_tokenize(query)))
+        if not self._built:
+            self._build(db)
+        with self._lock:
+            scores = self._scores(query_terms)
+
+        ranked = sorted(
+            ((score, id) for id, score in scores.items()),
+            reverse=True,
+        )
+        if cursor:
+            after = tuple(decode_cursor(cursor, (float, int)))
+            # `ranked` is descending, so `item < after` is False for all items before the cursor
+            start = bisect.bisect_left(ranked, True, key=lambda item: item < after)
+            ranked = ranked[start:]
+
+        page = ranked[:limit]
+        next_cursor = encode_cursor(*page[-1]) if len(ranked) > limit else None
+        artworks = _load_artworks(db, [id for _, id in page])
+        terms = set(query_terms)
+        return SearchPage(
+            items=artworks,
+            next_cursor=next_cursor,
+            snippets={
+                artwork.id: _highlight(artwork.description, terms)
+                for artwork in artworks
+                if artwork.id is not None
+            },
+        )
+
+    def index_artwork(self, artwork: Artwork) -> None:
+        if artwork.id is None:
+            return
+        with self._lock:
+            if not self._built:
+                # will be picked up when index is built
+                return
+            self._remove(artwork.id)
+            self._add(artwork.id, artwork.name, artwork.description)
+
+    def remove_artwork(self, artwork_id: int) -> None:
+        with self._lock:
+            self._remove(artwork_id)
+
+
+_backends: dict[str, SearchBackend] = {
+    "postgres": PostgresSearchBackend(),
+    "memory": InMemorySearchBackend(),
+}
+
+
+def get_search_backend(db: Session) -> SearchBackend:
+    name = os.environ.get("SEARCH_BACKEND")
+    if not name:
+        name = "postgres" if db.get_bind().dialect.name == "postgresql" else "memory"
+    return _backends[name]
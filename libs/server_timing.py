@@ -0,0 +1,124 @@
+"""`Server-Timing` header with time spent in each phase of request, shown in devtools
+
+- db: time in database (from `libs.query_stats`)
+- auth: loading current user (includes its db time)
+- render: HTML rendering, see `timed("render")` in `libs.html` and cards
+- serialize: validating / dumping `response_model`
+- app: everything until response headers are sent
+
+phases of streamed bodies (see `ArtworkCardStream`) happen after headers are sent,
+set `SERVER_TIMING_LOG=1` to also log timings of every request when it completes
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import fastapi.routing
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from libs.query_stats import current_query_stats
+
+SERVER_TIMING_LOG = os.environ.get("SERVER_TIMING_LOG", "") not in ("", "0")
+
+logger = logging.getLogger(__name__)
+
+
+class _Timings:
+    def __init__(self):
+        # phase -> seconds
+        self.durations: dict[str, float] = {}
+        # phases being timed, nested timing of the same phase is not counted twice
+        self.active: set[str] = set()
+
+    def to_dict(self) -> dict[str, float]:
+        """durations in milliseconds, including `db`"""
+        durations = dict(self.durations)
+        query_stats = current_query_stats()
+        if query_stats is not None:
+            durations["db"] = query_stats.duration
+        return {name: round(duration * 1000, 1) for name, duration in durations.items()}
+
+
+_current: ContextVar[_Timings | None] = ContextVar("server_timing", default=None)
+
+
+@contextmanager
+def timed(phase: str):
+    """add time spent in the block to `phase` of current request (no-op outside of one)"""
+    timings = _current.get()
+    if timings is None or phase in timings.active:
+        yield
+        return
+
+    timings.active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(phase)
+        timings.durations[phase] = (
+            timings.durations.get(phase, 0) + time.perf_counter() - start
+        )
+
+
+def time_response_serialization():
+    """time `response_model` serialization of all routes as `serialize`
+
+    FastAPI has no hook around it, so the function its request handler calls is wrapped
+    """
+    serialize_response = fastapi.routing.serialize_response
+
+    async def timed_serialize_response(*args, **kwargs):
+        with timed("serialize"):
+            return await serialize_response(*args, **kwargs)
+
+    fastapi.routing.serialize_response = timed_serialize_response
+
+
+class ServerTimingMiddleware:
+    """must be inside `QueryStatsMiddleware`, to include db time"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = _Timings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_header(message: Message):
+            if message["type"] == "http.response.start":
+                timings.durations["app"] = time.perf_counter() - start
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    ", ".join(
+                        f"{name};dur={duration}"
+                        for name, duration in timings.to_dict().items()
+                    ),
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            if SERVER_TIMING_LOG:
+                logger.info(
+                    json.dumps(
+                        {
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "total": round((time.perf_counter() - start) * 1000, 1),
+                            **timings.to_dict(),
+                        }
+                    )
+                )
+            _current.reset(token)
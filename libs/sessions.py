@@ -0,0 +1,351 @@
+"""Server-side sessions, replacing starlette's signed cookie sessions
+
+cookie has only random session ID, data is in `browsersession` table, so sessions can
+be revoked (logout, `revoke_user_sessions`) and the cookie doesn't grow with data.
+`request.session` works as before.
+
+- sessions are cached per process (LRU of `SESSION_CACHE_SIZE`), entries are
+  re-read after `SESSION_CACHE_TTL` seconds, so revoking in another process takes
+  effect within that time
+- session expires `SESSION_MAX_AGE` after it was last seen. "last seen" isn't written
+  per request, it's collected and written in batches every `SESSION_TOUCH_INTERVAL`
+  seconds (lost on crash, which only makes sessions expire a bit earlier)
+- `Set-Cookie` is sent only when session is created, changed, cleared, or its cookie
+  is about to expire (`SESSION_COOKIE_REFRESH` after it was last sent)
+- session ID changes when logged in user changes, against session fixation
+"""
+
+import copy
+import datetime
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from pydantic import BaseModel
+from sqlalchemy import bindparam, delete, update
+from sqlmodel import Session, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.models import BrowserSession, _now
+from libs.db import async_engine
+from libs.server_timing import timed
+
+SESSION_COOKIE = "session"
+SESSION_MAX_AGE = int(os.environ.get("SESSION_MAX_AGE", 14 * 24 * 60 * 60))
+SESSION_COOKIE_REFRESH = int(os.environ.get("SESSION_COOKIE_REFRESH", 24 * 60 * 60))
+SESSION_TOUCH_INTERVAL = float(os.environ.get("SESSION_TOUCH_INTERVAL", 60))
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", 10_000))
+SESSION_CACHE_TTL = float(os.environ.get("SESSION_CACHE_TTL", 30))
+
+
+def _timestamp(value: datetime.datetime) -> float:
+    # columns are without time zone, and values are written in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.UTC)
+    return value.timestamp()
+
+
+def _datetime(timestamp: float) -> datetime.datetime:
+    # naive UTC, like `_now()`: asyncpg refuses aware values for these columns
+    return datetime.datetime.fromtimestamp(timestamp, datetime.UTC).replace(tzinfo=None)
+
+
+def _user_id(data: dict[str, Any]) -> int | None:
+    try:
+        return int(data["user_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+@dataclass
+class _Entry:
+    data: dict[str, Any]
+    user_id: int | None
+    # time.time() of last request, including ones not written yet
+    last_seen: float
+    cookie_sent: float
+    # time.monotonic() when read from database
+    cached_at: float
+
+
+class SessionStats(BaseModel):
+    entries: int
+    hits: int
+    misses: int
+    # sessions created / changed / deleted
+    writes: int
+    cookies_sent: int
+    # "last seen" updates waiting for next batch, and batches written
+    pending_touches: int
+    touch_batches: int
+
+
+class _Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # session ID -> entry, least recently used first
+        self.entries: OrderedDict[str, _Entry] = OrderedDict()
+        # session ID -> time.time() of last request, written by `flush_touches`
+        self.touches: dict[str, float] = {}
+        self.next_flush = time.monotonic() + SESSION_TOUCH_INTERVAL
+        self.flushing = False
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.cookies_sent = 0
+        self.touch_batches = 0
+
+    def get(self, session_id: str) -> _Entry | None:
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            if entry.cached_at + SESSION_CACHE_TTL < time.monotonic():
+                del self.entries[session_id]
+                return None
+            self.entries.move_to_end(session_id)
+            return entry
+
+    def put(self, session_id: str, entry: _Entry):
+        with self.lock:
+            self.entries[session_id] = entry
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > SESSION_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def remove(self, session_id: str):
+        with self.lock:
+            self.entries.pop(session_id, None)
+            self.touches.pop(session_id, None)
+
+
+_store = _Store()
+
+
+async def _load(db: AsyncSession, session_id: str) -> _Entry | None:
+    """session of ID from cookie, None if it doesn't exist or expired"""
+    entry = _store.get(session_id)
+    if entry is None:
+        _store.misses += 1
+        row = await db.get(BrowserSession, session_id)
+        if row is None:
+            return None
+        entry = _Entry(
+            data=row.data,
+            user_id=row.user_id,
+            last_seen=max(
+                _timestamp(row.last_seen_at), _store.touches.get(session_id, 0)
+            ),
+            cookie_sent=_timestamp(row.cookie_sent_at),
+            cached_at=time.monotonic(),
+        )
+        _store.put(session_id, entry)
+    else:
+        _store.hits += 1
+
+    if entry.last_seen + SESSION_MAX_AGE < time.time():
+        # deleted with other expired sessions by `flush_touches`
+        _store.remove(session_id)
+        return None
+    return entry
+
+
+async def _save(
+    db: AsyncSession,
+    session_id: str | None,
+    entry: _Entry | None,
+    data: dict[str, Any],
+) -> str | None:
+    """persist session after request, return new session ID to send in cookie,
+    "" to delete cookie or None to leave it as is
+    """
+    now = time.time()
+    if entry is None and not data:
+        return None
+    if entry is not None and session_id is not None and data == entry.data:
+        entry.last_seen = now
+        _store.touches[session_id] = now
+        if entry.cookie_sent + SESSION_COOKIE_REFRESH > now:
+            return None
+        # cookie would expire before the session, send it again
+        entry.cookie_sent = now
+        await db.exec(  # type: ignore
+            update(BrowserSession)
+            .where(col(BrowserSession.id) == session_id)
+            .values(cookie_sent_at=_now())
+        )
+        await db.commit()
+        return session_id
+
+    if session_id is not None:
+        _store.remove(session_id)
+    _store.writes += 1
+    user_id = _user_id(data)
+    if not data:
+        if session_id is not None:
+            await db.exec(  # type: ignore
+                delete(BrowserSession).where(col(BrowserSession.id) == session_id)
+            )
+            await db.commit()
+        return ""
+
+    if session_id is not None and entry is not None and user_id == entry.user_id:
+        await db.exec(  # type: ignore
+            update(BrowserSession)
+            .where(col(BrowserSession.id) == session_id)
+            .values(data=data, last_seen_at=_now(), cookie_sent_at=_now())
+        )
+    else:
+        # new session, or user logged in / out: issue new ID
+        if session_id is not None:
+            await db.exec(  # type: ignore
+                delete(BrowserSession).where(col(BrowserSession.id) == session_id)
+            )
+        session_id = secrets.token_urlsafe(32)
+        db.add(BrowserSession(id=session_id, user_id=user_id, data=data))
+    await db.commit()
+
+    _store.put(
+        session_id,
+        _Entry(
+            # snapshot, `data` is `request.session` of finished request
+            data=copy.deepcopy(data),
+            user_id=user_id,
+            last_seen=now,
+            cookie_sent=now,
+            cached_at=time.monotonic(),
+        ),
+    )
+    return session_id
+
+
+async def flush_touches():
+    """write collected "last seen" times in one batch, and delete expired sessions"""
+    with _store.lock:
+        touches = _store.touches
+        _store.touches = {}
+    table = BrowserSession.__table__  # type: ignore
+    async with async_engine.begin() as conn:
+        if touches:
+            # executemany of one statement. not ORM bulk UPDATE, that fails when a
+            # session was deleted (logout / revoke) since it was touched
+            await conn.execute(
+                update(table)
+                .where(table.c.id == bindparam("session_id"))
+                .values(last_seen_at=bindparam("last_seen")),
+                [
+                    {
+                        "session_id": session_id,
+                        "last_seen": _datetime(last_seen),
+                    }
+                    for session_id, last_seen in touches.items()
+                ],
+            )
+        await conn.execute(
+            delete(table).where(
+                table.c.last_seen_at
+                < _now() - datetime.timedelta(seconds=SESSION_MAX_AGE)
+            )
+        )
+    _store.touch_batches += 1
+
+
+def revoke_user_sessions(db: Session, user_id: int) -> int:
+    """log user out everywhere, return number of revoked sessions
+
+    NOTE: other processes may still use cached session for `SESSION_CACHE_TTL`
+    """
+    session_ids = db.exec(
+        select(BrowserSession.id).where(col(BrowserSession.user_id) == user_id)
+    ).all()
+    db.exec(  # type: ignore
+        delete(BrowserSession).where(col(BrowserSession.user_id) == user_id)
+    )
+    db.commit()
+    for session_id in session_ids:
+        _store.remove(session_id)
+    return len(session_ids)
+
+
+def session_stats() -> SessionStats:
+    with _store.lock:
+        return SessionStats(
+            entries=len(_store.entries),
+            hits=_store.hits,
+            misses=_store.misses,
+            writes=_store.writes,
+            cookies_sent=_store.cookies_sent,
+            pending_touches=len(_store.touches),
+            touch_batches=_store.touch_batches,
+        )
+
+
+class ServerSessionMiddleware:
+    """provides `request.session`, like starlette's `SessionMiddleware`"""
+
+    def __init__(self, app: ASGIApp, *, https_only: bool = False):
+        self.app = app
+        self.security_flags = "httponly; samesite=lax"
+        if https_only:
+            self.security_flags += "; secure"
+
+    def _cookie(self, session_id: str) -> str:
+        if not session_id:
+            return (
+                f"{SESSION_COOKIE}=null; path=/; "
+                f"expires=Thu, 01 Jan 1970 00:00:00 GMT; {self.security_flags}"
+            )
+        return (
+            f"{SESSION_COOKIE}={session_id}; path=/; "
+            f"Max-Age={SESSION_MAX_AGE}; {self.security_flags}"
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        session_id = HTTPConnection(scope).cookies.get(SESSION_COOKIE)
+        entry = None
+        if session_id:
+            # own DB sessions, so no connection is held while request is handled
+            with timed("auth"):
+                async with AsyncSession(async_engine) as db:
+                    entry = await _load(db, session_id)
+        # cookie of unknown, expired or revoked session (or from before server-side
+        # sessions) is deleted, so it isn't looked up again on every request
+        stale = entry is None and bool(session_id)
+        if entry is None:
+            session_id = None
+        # copy, so changes can be detected by comparing with entry
+        scope["session"] = copy.deepcopy(entry.data) if entry is not None else {}
+
+        async def send_with_cookie(message: Message):
+            if message["type"] == "http.response.start":
+                async with AsyncSession(async_engine) as db:
+                    cookie = await _save(db, session_id, entry, scope["session"])
+                if cookie is None and stale:
+                    cookie = ""
+                if cookie is not None:
+                    MutableHeaders(scope=message).append(
+                        "set-cookie", self._cookie(cookie)
+                    )
+                    _store.cookies_sent += 1
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+        if time.monotonic() >= _store.next_flush and not _store.flushing:
+            # after response is sent, so no request waits for it
+            _store.flushing = True
+            _store.next_flush = time.monotonic() + SESSION_TOUCH_INTERVAL
+            try:
+                await flush_touches()
+            finally:
+                _store.flushing = False
@@ -0,0 +1,96 @@
+"""Serving of uploaded files
+
+files that never change once written are cached forever by browsers and proxies:
+originals are content-addressed (blobs) or have timestamp + random ID in their name
+(legacy uploads), and renditions have hash of their content in their name. anything
+else (renditions generated before, seeded files) may be replaced under the same
+name, so it is revalidated
+"""
+
+import os
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from constants import UPLOAD_DIR
+from libs.blobs import BLOB_DIR, UPLOAD_TMP_DIR
+from libs.image_variants import VARIANTS_DIR
+from libs.renditions import RENDITIONS_DIR, is_versioned
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# cached, but checked with `ETag` / `Last-Modified` before each use
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# originals saved by upload before blobs, named `<timestamp>.<name>.<random ID><ext>`
+_LEGACY_UPLOAD_DIR = os.path.join(UPLOAD_DIR, "user-uploads")
+
+# directories in upload dir that must not be served, e.g. partially uploaded files.
+# variants may be evicted any time, they're served by `/img/{id}`
+_PRIVATE_DIRS = {
+    os.path.relpath(UPLOAD_TMP_DIR, UPLOAD_DIR),
+    os.path.relpath(VARIANTS_DIR, UPLOAD_DIR),
+}
+
+
+def _is_within(path: str, directory: str) -> bool:
+    return os.path.commonpath([path, directory]) == directory
+
+
+def _is_immutable(path: str) -> bool:
+    """whether file at `path` is never replaced by other content under the same name"""
+    if _is_within(path, BLOB_DIR) or _is_within(path, _LEGACY_UPLOAD_DIR):
+        return True
+    return _is_within(path, RENDITIONS_DIR) and is_versioned(path)
+
+
+class UploadFiles(StaticFiles):
+    """`StaticFiles` for upload dir, with long-lived caching
+
+    `FileResponse` already handles `Range` / `If-Range` (206), `Last-Modified`
+    and `ETag`, this adds `Cache-Control`, content-based ETag for blobs and
+    RFC 9110 precedence of `If-None-Match` over `If-Modified-Since`
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if path.split(os.sep, 1)[0] in _PRIVATE_DIRS:
+            raise HTTPException(status_code=404)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL
+            if _is_immutable(full_path)
+            else REVALIDATE_CACHE_CONTROL
+        }
+        if _is_within(full_path, BLOB_DIR):
+            # name of blob is hash of its content: same ETag on every server, even
+            # when mtime differs. FileResponse only sets ETag if not given
+            sha256, _ = os.path.splitext(os.path.basename(full_path))
+            headers["etag"] = f'"{sha256}"'
+
+        response = FileResponse(
+            full_path, status_code=status_code, headers=headers, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(
+        self, response_headers: Headers, request_headers: Headers
+    ) -> bool:
+        # `If-Modified-Since` must be ignored when `If-None-Match` is present
+        if "if-none-match" in request_headers:
+            etags = [
+                tag.strip().removeprefix("W/")
+                for tag in request_headers["if-none-match"].split(",")
+            ]
+            return "*" in etags or response_headers.get("etag") in etags
+        return super().is_not_modified(response_headers, request_headers)
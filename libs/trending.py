@@ -0,0 +1,139 @@
+"""Trending artworks: activity (favorites, comments) with exponential time decay
+
+score of artwork is sum of `weight * 2 ** (-age / TRENDING_HALF_LIFE)` of its events.
+all scores decay at the same rate, so instead of decaying them all the time, event
+at time `t` adds `weight * 2 ** ((t - _EPOCH) / TRENDING_HALF_LIFE)`: a later event
+counts more, and order of scores is the same as of their decayed values. that grows
+without bound, so `TrendingScore.score` stores its log, and adding is log-add-exp.
+rows are only written by events, and `jobs.compact_trending` deletes rows that
+decayed to nothing
+
+removing favorite / comment subtracts exactly what it added (from its timestamp),
+row is deleted when all its events are removed
+
+NOTE: SQLite needs to be built with math functions (`ln`, `exp`), default since 3.35
+"""
+
+import datetime
+import math
+import os
+from collections import defaultdict
+from typing import Iterable
+
+from sqlalchemy import bindparam, case, delete, func
+from sqlmodel import Session, col
+
+from app.models import TrendingScore, _now
+from libs.db import dialect_insert
+
+TRENDING_HALF_LIFE = float(os.environ.get("TRENDING_HALF_LIFE", 24 * 60 * 60))
+# decayed score below which artwork is dropped by compaction
+TRENDING_MIN_SCORE = float(os.environ.get("TRENDING_MIN_SCORE", 0.05))
+
+FAVORITE_WEIGHT = 1.0
+COMMENT_WEIGHT = 0.5
+
+_EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.UTC)
+_DECAY = math.log(2) / TRENDING_HALF_LIFE
+# below this `exp` underflows, postgres raises instead of returning 0
+_MIN_EXP = -700.0
+
+# artwork ID, time of event
+Event = tuple[int, datetime.datetime]
+
+
+def log_score(weight: float, at: datetime.datetime) -> float:
+    """log of what event of `weight` at `at` adds to score"""
+    if at.tzinfo is None:
+        # columns are without time zone, and values are written in UTC
+        at = at.replace(tzinfo=datetime.UTC)
+    return math.log(weight) + _DECAY * (at - _EPOCH).total_seconds()
+
+
+def min_log_score(now: datetime.datetime | None = None) -> float:
+    """log score that decayed to `TRENDING_MIN_SCORE` by now"""
+    return log_score(TRENDING_MIN_SCORE, now or _now())
+
+
+def log_add_exp(a: float, b: float) -> float:
+    """log(exp(a) + exp(b)), without overflow"""
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def _exp(value):
+    """`exp` in SQL that is 0 instead of underflow error"""
+    return case((value < _MIN_EXP, 0.0), else_=func.exp(value))
+
+
+def sum_events(events: Iterable[Event], weight: float) -> dict[int, float]:
+    """log score of each artwork in `events`"""
+    scores: dict[int, float] = defaultdict(lambda: -math.inf)
+    for artwork_id, at in events:
+        scores[artwork_id] = log_add_exp(scores[artwork_id], log_score(weight, at))
+    return scores
+
+
+def add_trending(session: Session, events: Iterable[Event], weight: float):
+    """add events to scores, in caller's transaction. one statement for any number
+    of artworks, for async session call with `run_sync`
+    """
+    scores = sum_events(events, weight)
+    if not scores:
+        return
+    insert = dialect_insert(session, TrendingScore)
+    current, added = col(TrendingScore.score), insert.excluded.score
+    # log-add-exp, computed from larger side so `exp` can't overflow
+    new_score = case(
+        (current >= added, current + func.ln(1 + _exp(added - current))),
+        else_=added + func.ln(1 + _exp(current - added)),
+    )
+    now = _now()
+    session.exec(  # type: ignore
+        insert.values(
+            [
+                {"artwork_id": artwork_id, "score": score, "updated_at": now}
+                for artwork_id, score in scores.items()
+            ]
+        ).on_conflict_do_update(
+            index_elements=[TrendingScore.artwork_id],
+            set_={"score": new_score, "updated_at": now},
+        )
+    )
+
+
+def remove_trending(session: Session, events: Iterable[Event], weight: float):
+    """subtract events added by `add_trending` (with the same times) from scores"""
+    scores = sum_events(events, weight)
+    if not scores:
+        return
+    table = TrendingScore.__table__  # type: ignore
+    removed = bindparam("removed")
+    # all events were removed when nothing (except rounding) is left
+    emptied = table.c.score - removed <= 1e-9
+    params = [
+        {"id": artwork_id, "removed": score} for artwork_id, score in scores.items()
+    ]
+    connection = session.connection()
+    connection.execute(
+        table.delete().where(table.c.artwork_id == bindparam("id"), emptied), params
+    )
+    # log-sub-exp
+    connection.execute(
+        table.update()
+        .where(table.c.artwork_id == bindparam("id"), ~emptied)
+        .values(
+            score=table.c.score + func.ln(1 - _exp(removed - table.c.score)),
+            updated_at=_now(),
+        ),
+        params,
+    )
+
+
+def compact_trending(session: Session) -> int:
+    """delete scores that decayed below `TRENDING_MIN_SCORE`, return number deleted"""
+    result = session.exec(  # type: ignore
+        delete(TrendingScore).where(col(TrendingScore.score) < min_log_score())
+    )
+    session.commit()
+    return result.rowcount
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import mimetypes
 import os
@@ -5,8 +6,24 @@ import re
 import shutil
 import time
 from base64 import b64encode
+from typing import NamedTuple
 
-from fastapi import UploadFile
+from fastapi import Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 64 * 1024 * 1024))
+# received body is parsed (and files written) in worker thread in chunks of this size,
+# so the event loop never waits for disk
+PARSE_CHUNK_SIZE = 1024 * 1024
+# limit size of non-file fields, they're kept in memory
+MAX_FIELD_SIZE = 64 * 1024
 
 
 class UploadError(Exception):
@@ -34,9 +51,8 @@ def _get_clean_file_name(name: str) -> str:
     return re.sub(_non_word, "_", namepart).strip("_")
 
 
-def save_file(file: UploadFile, dst_dir: str) -> str:
-    """save file, ensure the file is named with timestamp and cleaned and with proper extension"""
-    mime_type = file.content_type
+def _make_file_name(filename: str | None, mime_type: str | None) -> str:
+    """name file with timestamp, cleaned name, random ID and proper extension"""
     if not mime_type:
         raise UploadError("Missing content-type")
     ext = mimetypes.guess_extension(mime_type)
@@ -45,11 +61,187 @@ def save_file(file: UploadFile, dst_dir: str) -> str:
 
     ts = int(time.time())
     random_id = _random_id()
-    clean_name = _get_clean_file_name(file.filename or "unnamed")
+    clean_name = _get_clean_file_name(filename or "unnamed")
+
+    return f"{ts}.{clean_name}.{random_id}{ext}"
 
-    name = f"{ts}.{clean_name}.{random_id}{ext}"
+
+def save_file(file: UploadFile, dst_dir: str) -> str:
+    """save file, ensure the file is named with timestamp and cleaned and with proper extension"""
+    name = _make_file_name(file.filename, file.content_type)
     dst_path = os.path.join(dst_dir, name)
     logging.info(f"-- copying {file.file.name} to {dst_path}")
     with open(dst_path, "wb") as fdst:
         shutil.copyfileobj(file.file, fdst)
     return dst_path
+
+
+class StreamedFile(NamedTuple):
+    """File part of multipart request, written directly to `path`"""
+
+    path: str
+    filename: str | None
+    content_type: str
+    # counted while streaming, don't trust client-supplied size
+    size: int
+    sha256: str
+
+
+class StreamedForm(NamedTuple):
+    fields: dict[str, str]
+    files: dict[str, StreamedFile]
+
+
+class _StreamingMultipartHandler:
+    """python-multipart callbacks, write file parts to `dst_dir` as they arrive"""
+
+    def __init__(self, dst_dir: str, max_file_size: int):
+        self.dst_dir = dst_dir
+        self.max_file_size = max_file_size
+        self.fields: dict[str, str] = {}
+        self.files: dict[str, StreamedFile] = {}
+        # paths to remove if upload fails
+        self.written_paths: list[str] = []
+
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: dict[bytes, bytes] = {}
+        self._name = ""
+        self._filename: str | None = None
+        self._content_type: str | None = None
+        self._data = bytearray()
+        self._file = None
+        self._file_path = ""
+        self._hash = hashlib.sha256()
+        self._size = 0
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._data = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(
+            self._headers.get(b"content-disposition", b"")
+        )
+        if b"name" not in options:
+            raise UploadError("Missing name of form field")
+        self._name = options[b"name"].decode()
+        if self._name in self.files:
+            raise UploadError(f"Duplicate file field '{self._name}'")
+        self._filename = (
+            options[b"filename"].decode() if b"filename" in options else None
+        )
+        if self._filename is None:
+            return
+
+        content_type = self._headers.get(b"content-type", b"").decode() or None
+        self._content_type = content_type
+        name = _make_file_name(self._filename, content_type)
+        self._file_path = os.path.join(self.dst_dir, name)
+        # write under temporary name in the same directory, so it can be renamed
+        # when complete, no partial file is ever visible under the final name
+        tmp_path = os.path.join(self.dst_dir, f".{name}.part")
+        self.written_paths.append(tmp_path)
+        self._file = open(tmp_path, "wb")
+        self._hash = hashlib.sha256()
+        self._size = 0
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._file is None:
+            if len(self._data) + len(chunk) > MAX_FIELD_SIZE:
+                raise UploadError(f"Field '{self._name}' is too large")
+            self._data += chunk
+            return
+
+        self._size += len(chunk)
+        if self._size > self.max_file_size:
+            raise UploadError(f"File is larger than {self.max_file_size} bytes")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def on_part_end(self):
+        if self._file is None:
+            self.fields[self._name] = self._data.decode()
+            return
+
+        tmp_path = self._file.name
+        self._file.close()
+        self._file = None
+        os.rename(tmp_path, self._file_path)
+        self.written_paths.append(self._file_path)
+        self.files[self._name] = StreamedFile(
+            path=self._file_path,
+            filename=self._filename,
+            content_type=self._content_type or "",
+            size=self._size,
+            sha256=self._hash.hexdigest(),
+        )
+
+    def finish(self):
+        if self._file is not None:
+            raise UploadError("Incomplete upload")
+
+    def cleanup(self):
+        if self._file is not None:
+            self._file.close()
+        for path in self.written_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def stream_multipart_upload(
+    request: Request, dst_dir: str, *, max_file_size: int = MAX_UPLOAD_SIZE
+) -> StreamedForm:
+    """Parse multipart request body as it's received, write files directly into `dst_dir`
+
+    unlike `UploadFile` + `save_file`, file is not spooled to temporary file first and
+    copied afterwards, it's written once, in chunks of `PARSE_CHUNK_SIZE` in worker
+    thread. Files are named like `save_file`, caller must remove them when done
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected multipart/form-data")
+
+    handler = _StreamingMultipartHandler(dst_dir, max_file_size)
+    parser = MultipartParser(params[b"boundary"], handler.callbacks())  # type: ignore
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= PARSE_CHUNK_SIZE:
+                await run_in_threadpool(parser.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(parser.write, bytes(buffer))
+        parser.finalize()
+        handler.finish()
+    except MultipartParseError as e:
+        handler.cleanup()
+        raise UploadError(f"Malformed multipart body: {e}")
+    except BaseException:
+        # including client disconnect / cancellation
+        handler.cleanup()
+        raise
+    return StreamedForm(fields=handler.fields, files=handler.files)
@@ -0,0 +1,67 @@
+"""Per-process cache of logged in users, so `CurrentUser` doesn't query DB on every request
+
+entries expire after `USER_CACHE_TTL` seconds, least recently used are evicted past
+`USER_CACHE_SIZE`. Code that updates / deletes users must call `invalidate_user`,
+NOTE: that only reaches the current process, others see the change after TTL
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from app.models import User
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+
+
+class UserSnapshot(NamedTuple):
+    """Fields of current user needed by most requests, fetch `User` for the rest"""
+
+    id: int
+    username: str
+    email_confirmed: bool
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        assert user.id is not None
+        return cls(
+            id=user.id, username=user.username, email_confirmed=user.email_confirmed
+        )
+
+
+_lock = threading.Lock()
+# user ID -> (snapshot, expire at), in least -> most recently used order
+_entries: OrderedDict[int, tuple[UserSnapshot, float]] = OrderedDict()
+
+
+def get_cached_user(user_id: int) -> UserSnapshot | None:
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is None:
+            return None
+        user, expire_at = entry
+        if expire_at < time.monotonic():
+            del _entries[user_id]
+            return None
+        _entries.move_to_end(user_id)
+        return user
+
+
+def cache_user(user: UserSnapshot):
+    with _lock:
+        _entries[user.id] = (user, time.monotonic() + USER_CACHE_TTL)
+        _entries.move_to_end(user.id)
+        while len(_entries) > USER_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate_user(user_id: int | None = None):
+    """remove user from cache, or all users if `user_id` is None"""
+    with _lock:
+        if user_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(user_id, None)
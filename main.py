@@ -8,22 +8,29 @@ import htpy as h
 from fastapi import FastAPI
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
-from starlette.middleware.sessions import SessionMiddleware
 
 from libs.dependencies import CurrentUserOrNone
 from libs.html import page_layout
-from routes import artworks, dev, user
+from libs.query_stats import QueryStatsMiddleware
+from libs.server_timing import ServerTimingMiddleware, time_response_serialization
+from libs.sessions import ServerSessionMiddleware
+from libs.static import UploadFiles
+from routes import artworks, dev, images, user
 
 app = FastAPI()
 
-session_secret = "very-secret-string"
-app.add_middleware(SessionMiddleware, secret_key=session_secret)
+app.add_middleware(ServerSessionMiddleware)
+app.add_middleware(ServerTimingMiddleware)
+time_response_serialization()
+# outermost, so queries of all middlewares and routes are counted
+app.add_middleware(QueryStatsMiddleware)
 app.include_router(user.router, prefix="/user", tags=["user"])
 # /user/login
 app.include_router(dev.router, prefix="/_dev", tags=["dev"])
 app.include_router(artworks.router, prefix="/artworks", tags=["artworks"])
+app.include_router(images.router, prefix="/img", tags=["images"])
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/uploads", UploadFiles(directory="uploads"), name="uploads")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
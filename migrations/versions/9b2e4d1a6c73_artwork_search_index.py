@@ -0,0 +1,53 @@
+"""artwork search index
+
+Revision ID: 9b2e4d1a6c73
+Revises: 3f1c9a7b52de
+Create Date: 2024-11-03 10:42:17.604528
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "9b2e4d1a6c73"
+down_revision: Union[str, None] = "3f1c9a7b52de"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# NOTE: these are not in the models, see `include_object` in env.py
+# expressions must match the ones in `libs/search.py` for the indexes to be used
+
+
+def upgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        # other databases use in-memory search backend
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        """
+        ALTER TABLE artwork ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+        ) STORED
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_artwork_search_vector ON artwork USING gin (search_vector)"
+    )
+    op.execute(
+        "CREATE INDEX ix_artwork_search_trgm ON artwork "
+        "USING gin ((name || ' ' || description) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name != "postgresql":
+        return
+
+    op.execute("DROP INDEX ix_artwork_search_trgm")
+    op.execute("DROP INDEX ix_artwork_search_vector")
+    op.drop_column("artwork", "search_vector")
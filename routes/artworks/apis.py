@@ -1,47 +1,209 @@
-from typing import Annotated, Any, Sequence
+import datetime
+from typing import Annotated, Any, Collection
 
 import htpy as h
 import sqlalchemy
 import sqlalchemy.exc
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import HTMLResponse
-from sqlalchemy.orm import joinedload
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
+from sqlalchemy import update
+from sqlalchemy.orm import joinedload, selectinload
 from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.models import (
     Artwork,
     ArtworkDetailed,
+    ArtworkListItem,
     ArtworkPublic,
     ArtworkUpdate,
     Comment,
     CommentCreate,
     CommentPublic,
+    FavoriteBatch,
+    FavoriteStatus,
     User,
     UserFavoriteArtwork,
     UserFavoriteArtworkPublic,
+    _now,
 )
+from libs.blobs import delete_unreferenced_blob, release_blob
 from libs.common import ErrorDetail, MessageResponse
-from libs.db import SessionDep
+from libs.conditional import artwork_version, check_etag
+from libs.db import AsyncSessionDep, SessionDep
 from libs.dependencies import CurrentUser, CurrentUserOrNone
-from libs.html import page_layout
+from libs.favorites import favorite_statement, unfavorite_statement, with_favorited
+from libs.html import page_layout, stream_page_layout
+from libs.pagination import (
+    DEFAULT_PAGE_SIZE,
+    CursorPage,
+    Page,
+    PageSize,
+    apply_keyset,
+    make_page,
+)
+from libs.renditions import remove_renditions
+from libs.search import get_search_backend
+from libs.trending import (
+    COMMENT_WEIGHT,
+    FAVORITE_WEIGHT,
+    add_trending,
+    remove_trending,
+)
+from libs.user_cache import UserSnapshot
+
+from .view import (
+    ArtworkCardStream,
+    _render_artwork_image,
+    _render_artworks_next_page,
+    _render_streamed_artworks,
+)
+
+COMMENT_PAGE_SIZE = 20
+
+
+def _update_artwork_counters(artwork_id: int | Collection[int], **deltas: int):
+    """`UPDATE` adding `deltas` to counter columns of artwork (or each of artworks),
+    e.g. `favorite_count=1`
+
+    counters are updated in SQL (not read-modify-write), so concurrent updates don't race
+    """
+    artwork_ids = [artwork_id] if isinstance(artwork_id, int) else artwork_id
+    return (
+        update(Artwork)
+        .where(col(Artwork.id).in_(artwork_ids))
+        .values(
+            {name: getattr(Artwork, name) + delta for name, delta in deltas.items()}
+        )
+    )
+
+
+async def _change_favorited(
+    db: AsyncSession, user_id: int, artwork_ids: Collection[int], *, favorited: bool
+) -> list[tuple[int, datetime.datetime]]:
+    """(un)favorite artworks and commit, return (artwork ID, favorited at) of those
+    whose state changed
+    """
+    statement = (
+        favorite_statement(db, user_id, artwork_ids)
+        if favorited
+        else unfavorite_statement(user_id, artwork_ids)
+    )
+    changed = (await db.exec(statement)).all()  # type: ignore
+    if changed:
+        await db.exec(  # type: ignore
+            _update_artwork_counters(
+                [artwork_id for artwork_id, _ in changed],
+                favorite_count=1 if favorited else -1,
+            )
+        )
+        update_trending = add_trending if favorited else remove_trending
+        await db.run_sync(
+            lambda session: update_trending(session, changed, FAVORITE_WEIGHT)
+        )
+    await db.commit()
+    return changed
+
+
+async def _set_favorited(
+    db: AsyncSession, user_id: int, artwork_ids: Collection[int], *, favorited: bool
+) -> list[FavoriteStatus]:
+    """(un)favorite artworks and commit, return status of each existing artwork"""
+    await _change_favorited(db, user_id, artwork_ids, favorited=favorited)
+    counts = (
+        await db.exec(
+            select(Artwork.id, Artwork.favorite_count).where(
+                col(Artwork.id).in_(artwork_ids)
+            )
+        )
+    ).all()
+    return [
+        FavoriteStatus(artwork_id=id, favorited=favorited, favorite_count=count)
+        for id, count in counts
+    ]
+
+
+def _user_artworks_page(statement, user_id: int, *, cursor: str | None, limit: int):
+    """keyset page of `statement` (selecting from artwork) for artworks by user,
+    newest first (my artworks, user profile)
+    """
+    return apply_keyset(
+        statement.where(col(Artwork.author_id) == user_id),
+        keys=(col(Artwork.created_at), col(Artwork.id)),
+        cursor=cursor,
+        limit=limit,
+    )
+
 
-from .view import _render_artworks
+def _user_artworks_statement(user_id: int, *, cursor: str | None, limit: int):
+    return _user_artworks_page(
+        select(Artwork).options(
+            joinedload(Artwork.author),  # type: ignore
+            selectinload(Artwork.renditions),  # type: ignore
+        ),
+        user_id,
+        cursor=cursor,
+        limit=limit,
+    )
 
 
 def mount_apis(router: APIRouter):
-    @router.get("/favorites", response_model=list[ArtworkPublic])
-    def list_favorite_artworks(user: CurrentUser, db: SessionDep):
+    @router.put(
+        "/favorites",
+        response_model=list[FavoriteStatus],
+        responses={400: {"model": ErrorDetail}},
+    )
+    async def set_favorited_artworks(
+        batch: FavoriteBatch, user: CurrentUser, db: AsyncSessionDep
+    ):
+        """Favorite (or unfavorite) many artworks at once
+
+        artworks already in requested state are left as they are, artworks that
+        don't exist are left out of result
+        """
+        return await _set_favorited(
+            db, user.id, set(batch.artwork_ids), favorited=batch.favorited
+        )
+
+    @router.get("/favorites", response_model=CursorPage[ArtworkListItem])
+    async def list_favorite_artworks(
+        user: CurrentUser,
+        db: AsyncSessionDep,
+        cursor: str | None = None,
+        limit: PageSize = DEFAULT_PAGE_SIZE,
+    ):
         """List favorited artworks, ordered by time"""
-        favorites = db.exec(
-            select(UserFavoriteArtwork)
-            .options(
-                joinedload(UserFavoriteArtwork.artwork).joinedload(Artwork.author),
+        favorites = (
+            await db.exec(
+                apply_keyset(
+                    select(UserFavoriteArtwork)
+                    .options(
+                        joinedload(UserFavoriteArtwork.artwork).joinedload(
+                            Artwork.author
+                        ),
+                        joinedload(UserFavoriteArtwork.artwork).selectinload(
+                            Artwork.renditions
+                        ),
+                    )
+                    .where(UserFavoriteArtwork.user_id == user.id),
+                    keys=(
+                        col(UserFavoriteArtwork.favorited_at),
+                        col(UserFavoriteArtwork.artwork_id),
+                    ),
+                    cursor=cursor,
+                    limit=limit,
+                )
             )
-            .where(UserFavoriteArtwork.user_id == user.id)
-            .order_by(col(UserFavoriteArtwork.favorited_at).desc())
+        ).all()
+        page = make_page(
+            favorites,
+            limit=limit,
+            key_of=lambda favorite: (favorite.favorited_at, favorite.artwork_id),
+        )
+        artworks = [favorite.artwork for favorite in page.items]
+        return page._replace(
+            items=with_favorited(artworks, [artwork.id for artwork in artworks])
         )
-        favorited_artworks = [favorite.artwork for favorite in favorites]
-        return favorited_artworks
 
     @router.put(
         "/{artwork_id}",
@@ -56,7 +218,7 @@ def mount_apis(router: APIRouter):
     ):
         """Update specified artwork owned by current user"""
         try:
-            artwork = db.exec(select(Artwork).where(Artwork.id == id)).one()
+            artwork = db.exec(select(Artwork).where(Artwork.id == artwork_id)).one()
         except sqlalchemy.exc.NoResultFound:
             raise HTTPException(status_code=404, detail="Artwork not found")
 
@@ -64,8 +226,11 @@ def mount_apis(router: APIRouter):
             raise HTTPException(status_code=403, detail="Artwork not owned")
 
         artwork.sqlmodel_update(update.model_dump(exclude_unset=True))
+        # invalidates cached card, see `_render_artwork`
+        artwork.updated_at = _now()
         db.add(artwork)
         db.commit()
+        get_search_backend(db).index_artwork(artwork)
 
         return artwork
 
@@ -81,67 +246,137 @@ def mount_apis(router: APIRouter):
     ) -> MessageResponse:
         """Delete specified artwork owned by current user"""
         try:
-            artwork = db.exec(select(Artwork).where(Artwork.id == id)).one()
+            artwork = db.exec(select(Artwork).where(Artwork.id == artwork_id)).one()
         except sqlalchemy.exc.NoResultFound:
             raise HTTPException(status_code=404, detail="Artwork not found")
 
         if artwork.author_id != user.id:
             raise HTTPException(status_code=403, detail="Artwork not owned")
 
+        blob_sha256 = artwork.blob_sha256
         db.delete(artwork)
+        unreferenced = blob_sha256 is not None and release_blob(db, blob_sha256)
         db.commit()
+        # files are removed only once deletion is committed
+        if unreferenced:
+            delete_unreferenced_blob(db, blob_sha256)  # type: ignore
+        get_search_backend(db).remove_artwork(artwork_id)
+        remove_renditions(artwork_id)
 
         return MessageResponse(message="Deleted Artwork")
 
-    def _get_user_artworks(db: SessionDep, user: CurrentUser) -> Sequence[Artwork]:
+    def _get_user_artworks(
+        db: SessionDep,
+        user: CurrentUser,
+        cursor: str | None = None,
+        limit: PageSize = DEFAULT_PAGE_SIZE,
+    ) -> Page[Artwork]:
         artworks = db.exec(
-            select(Artwork)
-            .where(Artwork.author_id == user.id)
-            .options(joinedload(Artwork.author))
-            .order_by(col(Artwork.created_at).desc())
+            _user_artworks_statement(user.id, cursor=cursor, limit=limit)
         ).all()
-        return artworks
+        return make_page(
+            artworks,
+            limit=limit,
+            key_of=lambda artwork: (artwork.created_at, artwork.id),
+        )
 
-    @router.get("/mine", response_model=list[ArtworkPublic])
+    def _my_artworks_next_url(next_cursor: str | None) -> str | None:
+        return next_cursor and f"/artworks/mine.phtml?cursor={next_cursor}"
+
+    @router.get("/mine", response_model=CursorPage[ArtworkPublic])
     def list_my_artworks(artworks: Annotated[Any, Depends(_get_user_artworks)]):
         """List all artworks by current user"""
         return artworks
 
     @router.get("/mine.html", response_class=HTMLResponse, include_in_schema=False)
-    def list_my_artworks_html(
-        artworks: Annotated[Any, Depends(_get_user_artworks)], user: CurrentUser
-    ):
-        """Display all artworks by current user"""
-        return HTMLResponse(
-            page_layout(
-                user=user,
+    async def list_my_artworks_html(user: CurrentUser):
+        """Display all artworks by current user, streamed (see `ArtworkCardStream`)"""
+        stream = ArtworkCardStream(
+            _user_artworks_statement(user.id, cursor=None, limit=DEFAULT_PAGE_SIZE),
+            limit=DEFAULT_PAGE_SIZE,
+            key_of=lambda artwork: (artwork.created_at, artwork.id),
+            next_url=_my_artworks_next_url,  # type: ignore
+        )
+        return StreamingResponse(
+            stream_page_layout(
+                user,
                 body=h.div(style="padding: 16px 24px")[
-                    _render_artworks(
-                        artworks,
-                        title=f"{user.username}: My Artworks",
-                        show_upload=True,
+                    _render_streamed_artworks(
+                        title=f"{user.username}: My Artworks", show_upload=True
                     )
                 ],
+                streams=[stream.cards(), stream.loader()],
+            ),
+            media_type="text/html",
+        )
+
+    @router.get("/mine.phtml", response_class=HTMLResponse, include_in_schema=False)
+    def list_my_artworks_partial_html(
+        artworks: Annotated[Page[Artwork], Depends(_get_user_artworks)],
+    ):
+        """Next page of artworks by current user, for infinite scroll"""
+        return HTMLResponse(
+            h.render_node(
+                _render_artworks_next_page(
+                    artworks.items, next_url=_my_artworks_next_url(artworks.next_cursor)
+                )
             )
         )
 
-    def _detailed_artwork_base(artwork_id: int, db: SessionDep):
-        try:
-            artwork = (
-                db.exec(
-                    select(Artwork)
-                    .options(joinedload(Artwork.author), joinedload(Artwork.comments))
-                    .where(Artwork.id == artwork_id)
-                    # .options(joinedload(Artwork.comments))
-                ).unique()  # must call unique when join with many-to-one
-            ).one()
-            print("-- result", artwork)
-        except sqlalchemy.exc.NoResultFound:
+    def _artwork_statement(artwork_id: int):
+        # lazy load isn't possible in async, load everything rendered
+        return (
+            select(Artwork)
+            .options(joinedload(Artwork.author), selectinload(Artwork.renditions))
+            .where(Artwork.id == artwork_id)
+        )
+
+    async def _artwork_base(artwork_id: int, db: AsyncSessionDep) -> Artwork:
+        """Artwork without comments, those are paginated separately"""
+        artwork = (await db.exec(_artwork_statement(artwork_id))).one_or_none()
+        if artwork is None:
             raise HTTPException(status_code=404, detail="Artwork not found")
+        return artwork
 
+    async def _detailed_artwork_base(artwork_id: int, db: AsyncSessionDep) -> Artwork:
+        """Artwork with all comments, for `ArtworkDetailed`"""
+        artwork = (
+            await db.exec(
+                _artwork_statement(artwork_id).options(
+                    selectinload(Artwork.comments).joinedload(Comment.author)
+                )
+            )
+        ).one_or_none()
+        if artwork is None:
+            raise HTTPException(status_code=404, detail="Artwork not found")
         return artwork
 
-    def _render_comment(comment: Comment, *, user: User | None):
+    async def _artwork_comments_base(
+        artwork_id: int,
+        db: AsyncSessionDep,
+        cursor: str | None = None,
+        limit: PageSize = COMMENT_PAGE_SIZE,
+    ) -> Page[Comment]:
+        """Comments of artwork, newest first. covered by `ix_comment_artwork_id_created_at_id`"""
+        comments = (
+            await db.exec(
+                apply_keyset(
+                    select(Comment)
+                    .where(Comment.artwork_id == artwork_id)
+                    .options(joinedload(Comment.author)),
+                    keys=(col(Comment.created_at), col(Comment.id)),
+                    cursor=cursor,
+                    limit=limit,
+                )
+            )
+        ).all()
+        return make_page(
+            comments,
+            limit=limit,
+            key_of=lambda comment: (comment.created_at, comment.id),
+        )
+
+    def _render_comment(comment: Comment, *, user: UserSnapshot | None):
         """Render HTML for single comment
 
         - user: used to determine whether comment is delete-able
@@ -167,11 +402,26 @@ def mount_apis(router: APIRouter):
             )["delete"],
         ]
 
+    def _render_comments(
+        comments: Page[Comment], *, artwork_id: int, user: UserSnapshot | None
+    ):
+        """Render page of comments, followed by button that replaces itself with next page"""
+        return [
+            [_render_comment(comment, user=user) for comment in comments.items],
+            comments.next_cursor
+            and h.button(
+                hx_get=f"/artworks/{artwork_id}/comments.phtml?cursor={comments.next_cursor}",
+                hx_swap="outerHTML",
+                hx_disabled_elt="this",
+            )["Load more comments"],
+        ]
+
     @router.get(
         "/{artwork_id}.html", response_class=HTMLResponse, include_in_schema=False
     )
-    def detailed_artwork_page(
-        detailed_artwork: Annotated[Artwork, Depends(_detailed_artwork_base)],
+    async def detailed_artwork_page(
+        detailed_artwork: Annotated[Artwork, Depends(_artwork_base)],
+        comments: Annotated[Page[Comment], Depends(_artwork_comments_base)],
         artwork_id: int,
         user: CurrentUserOrNone,
     ):
@@ -185,9 +435,12 @@ def mount_apis(router: APIRouter):
                         h.h1[
                             f"Viewing Artwork {detailed_artwork.name} #{detailed_artwork.id}"
                         ],
-                        h.img(
-                            src="/uploads/" + detailed_artwork.path,
-                            style="width: 100%; max-width: 768px; aspect-ratio: 16/9; object-fit: cover;",
+                        _render_artwork_image(
+                            detailed_artwork,
+                            sizes="(max-width: 816px) 100vw, 768px",
+                            style="width: 100%; height: auto; max-width: 768px; aspect-ratio: 16/9; object-fit: cover;",
+                            # main image is in first screen, don't delay it
+                            lazy=False,
                         ),
                         h.h2[detailed_artwork.name],
                         h.p(style="font-weight: bold")[
@@ -216,20 +469,23 @@ def mount_apis(router: APIRouter):
                                 h.button(type="submit")["Comment"],
                             ],
                         ],
-                        [
-                            _render_comment(comment, user=user)
-                            for comment in sorted(
-                                detailed_artwork.comments,
-                                key=lambda comment: -comment.created_at.timestamp(),
-                            )
-                        ],
+                        _render_comments(comments, artwork_id=artwork_id, user=user),
                     ]
                 ],
             )
         )
 
+    async def _artwork_etag(
+        request: Request, response: Response, artwork_id: int, db: AsyncSessionDep
+    ):
+        """304 if artwork and its comments didn't change (see `libs.conditional`)"""
+        version = (await db.exec(artwork_version(artwork_id))).one_or_none()
+        if version is not None:
+            check_etag(request, response, version)
+
     @router.get("/{artwork_id}", response_model=ArtworkDetailed)
-    def get_detailed_artwork(
+    async def get_detailed_artwork(
+        _: Annotated[None, Depends(_artwork_etag)],
         detailed_artwork: Annotated[Artwork, Depends(_detailed_artwork_base)],
     ):
         return detailed_artwork
@@ -241,9 +497,8 @@ def mount_apis(router: APIRouter):
         db: SessionDep,
     ) -> Comment:
         """Create comment on artwork, returnin created comment"""
-        try:
-            db.exec(select(Artwork).where(Artwork.id == artwork_id))
-        except sqlalchemy.exc.NoResultFound:
+        result = db.exec(_update_artwork_counters(artwork_id, comment_count=1))  # type: ignore
+        if result.rowcount == 0:
             raise HTTPException(status_code=404, detail="Artwork not found")
 
         created_comment = Comment(
@@ -252,6 +507,7 @@ def mount_apis(router: APIRouter):
             text=comment_details.text,
         )
         db.add(created_comment)
+        add_trending(db, [(artwork_id, created_comment.created_at)], COMMENT_WEIGHT)
         db.commit()
         return created_comment
 
@@ -274,8 +530,25 @@ def mount_apis(router: APIRouter):
         """Create comment on artwork"""
         return HTMLResponse(_render_comment(created_comment, user=user))
 
+    @router.get(
+        "/{artwork_id}/comments.phtml",
+        response_class=HTMLResponse,
+        include_in_schema=False,
+    )
+    async def list_artwork_comments_partial_html(
+        comments: Annotated[Page[Comment], Depends(_artwork_comments_base)],
+        artwork_id: int,
+        user: CurrentUserOrNone,
+    ):
+        """Next page of comments, for "load more" button"""
+        return HTMLResponse(
+            h.render_node(_render_comments(comments, artwork_id=artwork_id, user=user))
+        )
+
     @router.get("/{artwork_id}/comments", response_model=list[CommentPublic])
-    def list_artwork_comments(artwork_id: int, db: SessionDep):
+    def list_artwork_comments(
+        _: Annotated[None, Depends(_artwork_etag)], artwork_id: int, db: SessionDep
+    ):
         """list comments on artwork"""
         comments = db.exec(
             select(Comment)
@@ -302,55 +575,72 @@ def mount_apis(router: APIRouter):
             raise HTTPException(status_code=403, detail="Comment not owned by you")
 
         db.delete(comment)
+        if comment.artwork_id is not None:
+            db.exec(_update_artwork_counters(comment.artwork_id, comment_count=-1))  # type: ignore
+            remove_trending(
+                db, [(comment.artwork_id, comment.created_at)], COMMENT_WEIGHT
+            )
         db.commit()
 
         return MessageResponse(message="Deleted comment")
 
-    @router.post("/{artwork_id}/favorite", response_model=UserFavoriteArtworkPublic)
-    def favorite_artwork(user: CurrentUser, artwork_id: int, db: SessionDep):
-        """Favorite specified artwork"""
-        artwork_exist = db.query(
-            select(Artwork).where(Artwork.id == artwork_id).exists()
-        ).scalar()
-        if not artwork_exist:
-            raise HTTPException(
-                status_code=404, detail=f"Artwork {artwork_id} does not exist"
+    async def _load_favorite(
+        db: AsyncSessionDep, user_id: int, artwork_id: int
+    ) -> UserFavoriteArtwork | None:
+        """favorite with everything in `UserFavoriteArtworkPublic` loaded"""
+        return (
+            await db.exec(
+                select(UserFavoriteArtwork)
+                .where(
+                    UserFavoriteArtwork.artwork_id == artwork_id,
+                    UserFavoriteArtwork.user_id == user_id,
+                )
+                .options(
+                    joinedload(UserFavoriteArtwork.user),
+                    joinedload(UserFavoriteArtwork.artwork).joinedload(Artwork.author),
+                )
             )
+        ).one_or_none()
 
-        favorite = UserFavoriteArtwork(user_id=user.id, artwork_id=artwork_id)  # type: ignore
-        try:
-            db.add(favorite)
-            db.commit()
-        except sqlalchemy.exc.IntegrityError:
+    @router.post(
+        "/{artwork_id}/favorite",
+        response_model=UserFavoriteArtworkPublic,
+        responses={404: {"model": ErrorDetail}},
+    )
+    async def favorite_artwork(user: CurrentUser, artwork_id: int, db: AsyncSessionDep):
+        """Favorite specified artwork, favoriting it again does nothing"""
+        await _set_favorited(db, user.id, [artwork_id], favorited=True)
+        favorite = await _load_favorite(db, user.id, artwork_id)
+        if favorite is None:
             raise HTTPException(
-                status_code=409, detail=f"Artwork {artwork_id} already favorited"
+                status_code=404, detail=f"Artwork {artwork_id} does not exist"
             )
         return favorite
 
-    @router.delete("/{artwork_id}/favorite", response_model=UserFavoriteArtworkPublic)
-    def unfavorite_artwork(user: CurrentUser, artwork_id: int, db: SessionDep):
-        """Unfavorite specified artwork"""
-        try:
-            favorite = db.exec(
-                select(UserFavoriteArtwork).where(
-                    UserFavoriteArtwork.artwork_id == artwork_id,
-                    UserFavoriteArtwork.user_id == user.id,
-                )
-            ).one()
-        except sqlalchemy.exc.NoResultFound:
+    @router.delete(
+        "/{artwork_id}/favorite",
+        response_model=UserFavoriteArtworkPublic,
+        responses={404: {"model": ErrorDetail}},
+    )
+    async def unfavorite_artwork(
+        user: CurrentUser, artwork_id: int, db: AsyncSessionDep
+    ):
+        """Unfavorite specified artwork, return removed favorite"""
+        changed = await _change_favorited(db, user.id, [artwork_id], favorited=False)
+        if not changed:
             raise HTTPException(
                 status_code=404,
                 detail=f"Artwork {artwork_id} is not favorited or does not exist",
             )
-
-        delete_count = (
-            db.query(UserFavoriteArtwork)
-            .where(
-                col(UserFavoriteArtwork.artwork_id) == artwork_id,
-                col(UserFavoriteArtwork.user_id) == user.id,
-            )
-            .delete()
+        [(_, favorited_at)] = changed
+        artwork = await db.get(
+            Artwork, artwork_id, options=[joinedload(Artwork.author)]
+        )
+        return UserFavoriteArtworkPublic.model_validate(
+            {
+                "user": await db.get(User, user.id),
+                "artwork": artwork,
+                "favorited_at": favorited_at,
+            },
+            from_attributes=True,
         )
-        assert delete_count == 1
-
-        return favorite
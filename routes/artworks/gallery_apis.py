@@ -1,43 +1,145 @@
-from typing import Annotated, Sequence
+from typing import Annotated, Literal
+from urllib.parse import urlencode
 
 import htpy as h
-from fastapi import APIRouter, Depends
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 from markupsafe import Markup
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
 from sqlmodel import col, select
 
-from app.models import (
-    Artwork,
-    ArtworkPublic,
-)
-from libs.db import SessionDep
+from app.models import Artwork, TrendingScore
+from libs.conditional import artwork_version_columns, artworks_version, check_etag
+from libs.db import AsyncSessionDep
 from libs.dependencies import CurrentUserOrNone
-from libs.html import page_layout
+from libs.favorites import load_favorited, with_favorited
+from libs.html import page_layout, stream_page_layout
+from libs.pagination import DEFAULT_PAGE_SIZE, PageSize, apply_keyset, make_page
+from libs.search import ArtworkSearchPage, SearchPage, get_search_backend
+
+from .view import (
+    ArtworkCardStream,
+    _render_artworks,
+    _render_artworks_next_page,
+    _render_streamed_artworks,
+)
+
+
+ArtworkSort = Literal["newest", "popular", "trending"]
+
+# keyset of each sort, must be unique together and covered by an index
+_sort_keys = {
+    "newest": (col(Artwork.created_at), col(Artwork.id)),
+    "popular": (col(Artwork.favorite_count), col(Artwork.id)),
+    # on `trendingscore` (see `libs/trending.py`), artworks without one are left out
+    "trending": (col(TrendingScore.score), col(TrendingScore.artwork_id)),
+}
+
 
-from .view import _render_artworks
+def _sorted_artworks(statement, sort: ArtworkSort, *, cursor: str | None, limit: int):
+    """keyset page of `statement` (selecting from artwork) in order of `sort`"""
+    if sort == "trending":
+        statement = statement.join(Artwork.trending)  # type: ignore
+    return apply_keyset(
+        statement,
+        keys=_sort_keys[sort],
+        cursor=cursor,
+        limit=limit,
+    )
+
+
+def _artworks_statement(sort: ArtworkSort, *, cursor: str | None, limit: int):
+    statement = select(Artwork).options(
+        joinedload(Artwork.author),  # type: ignore
+        selectinload(Artwork.renditions),  # type: ignore
+    )
+    if sort == "trending":
+        statement = statement.options(contains_eager(Artwork.trending))  # type: ignore
+    return _sorted_artworks(statement, sort, cursor=cursor, limit=limit)
+
+
+def _artwork_key(sort: ArtworkSort):
+    if sort == "trending":
+        return lambda artwork: (artwork.trending.score, artwork.id)
+    return lambda artwork: tuple(getattr(artwork, key.key) for key in _sort_keys[sort])
 
 
 def mount_apis(router: APIRouter):
-    def _list_artworks_base(db: SessionDep, query: str = "") -> Sequence[Artwork]:
-        images = db.exec(
-            select(Artwork)
-            .where(
-                col(Artwork.name).icontains(query)
-                | col(Artwork.description).icontains(query)
+    async def _list_artworks_base(
+        db: AsyncSessionDep,
+        query: str = "",
+        sort: ArtworkSort = "newest",
+        cursor: str | None = None,
+        limit: PageSize = DEFAULT_PAGE_SIZE,
+    ) -> SearchPage:
+        """List artworks by `sort` (newest first, most favorited first or trending,
+        see `libs/trending.py`), or by relevance when `query` is given
+        """
+        if query:
+            # search backends are sync, `run_sync` runs them with async connection
+            return await db.run_sync(
+                lambda session: get_search_backend(session).search(
+                    session, query, cursor=cursor, limit=limit
+                )
             )
-            .options(joinedload(Artwork.author))  # type: ignore
-            .order_by(col(Artwork.created_at).desc())
-        ).all()
 
-        return images
+        statement = _artworks_statement(sort, cursor=cursor, limit=limit)
+        images = (await db.exec(statement)).all()
+
+        page = make_page(images, limit=limit, key_of=_artwork_key(sort))
+        return SearchPage(items=page.items, next_cursor=page.next_cursor, snippets={})
+
+    def _next_page_url(
+        query: str, sort: ArtworkSort, next_cursor: str | None
+    ) -> str | None:
+        if not next_cursor:
+            return None
+        params = {"query": query} if query else {"sort": sort}
+        return f"/artworks/gallery.phtml?{urlencode({**params, 'cursor': next_cursor})}"
 
-    @router.get("/gallery", response_model=list[ArtworkPublic])
-    def list_artworks(
-        artworks: Annotated[Sequence[Artwork], Depends(_list_artworks_base)],
+    async def _gallery_etag(
+        request: Request,
+        response: Response,
+        db: AsyncSessionDep,
+        user: CurrentUserOrNone,
+        query: str = "",
+        sort: ArtworkSort = "newest",
+        cursor: str | None = None,
+        limit: PageSize = DEFAULT_PAGE_SIZE,
+    ):
+        """304 if gallery page didn't change (see `libs.conditional`). trending is
+        sorted by score in another table, its `updated_at` is bumped by each event.
+        (un)favoriting changes `favorite_count`, so only viewer has to be added for
+        `favorited_by_me`
+
+        search results aren't conditional, they depend on every artwork
+        """
+        if query:
+            return
+        changed_at = TrendingScore.updated_at if sort == "trending" else None
+        page = _sorted_artworks(
+            select(*artwork_version_columns(changed_at)),
+            sort,
+            cursor=cursor,
+            limit=limit,
+        )
+        version = (await db.exec(artworks_version(page))).one()
+        check_etag(request, response, (*version, user and user.id))
+
+    @router.get("/gallery", response_model=ArtworkSearchPage)
+    async def list_artworks(
+        _: Annotated[None, Depends(_gallery_etag)],
+        artworks: Annotated[SearchPage, Depends(_list_artworks_base)],
+        db: AsyncSessionDep,
+        user: CurrentUserOrNone,
     ):
-        """List all artworks"""
-        return artworks
+        """List all artworks, newest first. Pass `next_cursor` as `cursor` to get next page
+
+        when `query` is given, artworks are sorted by relevance, with highlighted
+        description in `snippets`
+        """
+        favorited = await load_favorited(db, user and user.id, artworks.items)
+        return artworks._replace(items=with_favorited(artworks.items, favorited))
 
     def _make_result_title(query: str, *, is_for_swap: bool = False):
         return (
@@ -54,18 +156,40 @@ def mount_apis(router: APIRouter):
             ],
         )
 
-    @router.get("/gallery.phtml")
-    def artworks_gallery_partial_page(
-        artworks: Annotated[Sequence[Artwork], Depends(_list_artworks_base)],
+    @router.get("/gallery.phtml", response_class=HTMLResponse)
+    async def artworks_gallery_partial_page(
+        _: Annotated[None, Depends(_gallery_etag)],
+        artworks: Annotated[SearchPage, Depends(_list_artworks_base)],
         query: str = "",
+        sort: ArtworkSort = "newest",
+        cursor: str | None = None,
     ):
-        """Return rendered HTML for search result, this is similar to below but without site structure"""
-        return HTMLResponse(
+        """Return rendered HTML for search result, this is similar to below but without site structure
+
+        when `cursor` is given, return next page of infinite scroll instead
+        """
+        next_url = _next_page_url(query, sort, artworks.next_cursor)
+        if cursor:
+            return str(
+                h.render_node(
+                    _render_artworks_next_page(
+                        artworks.items,
+                        next_url=next_url,
+                        snippets=artworks.snippets,
+                    )
+                )
+            )
+
+        return str(
             h.render_node(
                 [
                     (
-                        _render_artworks(artworks)
-                        if artworks
+                        _render_artworks(
+                            artworks.items,
+                            next_url=next_url,
+                            snippets=artworks.snippets,
+                        )
+                        if artworks.items
                         else h.p(style="text-align: center; padding: 16px 24px;")[
                             "No result found for ",
                             h.span(style="font-weight: bold")[query],
@@ -76,67 +200,104 @@ def mount_apis(router: APIRouter):
             )
         )
 
+    def _render_gallery_body(query: str, sort: ArtworkSort, results):
+        return h.div(style="padding: 16px 24px")[
+            h.h1["Artworks"],
+            h.style[
+                Markup(
+                    """
+            .artworks-filter-row {
+                display: flex;
+                align-items: center;
+                gap: 0px 8px;
+                flex-wrap: wrap;
+            }
+
+            """
+                )
+            ],
+            h.div(class_="artworks-filter-row")[
+                _make_result_title(query),
+                h.div(style="flex: 1"),
+                h.form(
+                    # -- normal form
+                    # method="GET",
+                    # -- htmx form
+                    hx_get="/artworks/gallery.phtml",
+                    hx_swap="innerhtml",
+                    hx_target="#artworks-result",
+                    hx_on_htmx_after_request="console.log(event); if (event.detail.successful) history.pushState('', '', event.detail.pathInfo.responsePath.replace('.phtml', '.html'))",
+                )[
+                    h.input(
+                        value=query,
+                        name="query",
+                        placeholder="Search in name, description",
+                        style="margin: 8px; min-width: 200px; max-width: 400px; width: 33vw;",
+                    ),
+                    h.select(name="sort", style="margin: 8px")[
+                        h.option(value="newest", selected=sort == "newest")["Newest"],
+                        h.option(value="popular", selected=sort == "popular")[
+                            "Most favorited"
+                        ],
+                        h.option(value="trending", selected=sort == "trending")[
+                            "Trending"
+                        ],
+                    ],
+                    h.button(style="margin: 8px")["Search"],
+                ],
+            ],
+            h.div("#artworks-result")[results],
+        ]
+
     @router.get("/gallery.html", response_class=HTMLResponse, include_in_schema=False)
-    def artworks_gallery_page(
-        artworks: Annotated[Sequence[Artwork], Depends(_list_artworks_base)],
+    async def artworks_gallery_page(
+        db: AsyncSessionDep,
         user: CurrentUserOrNone,
         query: str = "",
+        sort: ArtworkSort = "newest",
     ):
-        """List artwork HTML page"""
+        """List artwork HTML page
+
+        listing is streamed: page head is sent right away, and cards are sent as
+        they're fetched from DB. search results are rendered at once
+        """
+        if not query:
+            stream = ArtworkCardStream(
+                _artworks_statement(sort, cursor=None, limit=DEFAULT_PAGE_SIZE),
+                limit=DEFAULT_PAGE_SIZE,
+                key_of=_artwork_key(sort),
+                next_url=lambda cursor: _next_page_url(query, sort, cursor),  # type: ignore
+            )
+            return StreamingResponse(
+                stream_page_layout(
+                    user,
+                    body=_render_gallery_body(query, sort, _render_streamed_artworks()),
+                    streams=[stream.cards(), stream.loader()],
+                ),
+                media_type="text/html",
+            )
 
+        artworks = await _list_artworks_base(
+            db, query=query, sort=sort, cursor=None, limit=DEFAULT_PAGE_SIZE
+        )
         return HTMLResponse(
             page_layout(
                 user=user,
-                body=h.div(style="padding: 16px 24px")[
-                    h.h1["Artworks"],
-                    h.style[
-                        Markup(
-                            """
-                    .artworks-filter-row {
-                        display: flex;
-                        align-items: center;
-                        gap: 0px 8px;
-                        flex-wrap: wrap;
-                    }
-
-                    """
-                        )
-                    ],
-                    h.div(class_="artworks-filter-row")[
-                        _make_result_title(query),
-                        h.div(style="flex: 1"),
-                        h.form(
-                            # -- normal form
-                            # method="GET",
-                            # -- htmx form
-                            hx_get="/artworks/gallery.phtml",
-                            hx_swap="innerhtml",
-                            hx_target="#artworks-result",
-                            hx_on_htmx_after_request="console.log(event); if (event.detail.successful) history.pushState('', '', event.detail.pathInfo.responsePath.replace('.phtml', '.html'))",
-                        )[
-                            h.input(
-                                value=query,
-                                name="query",
-                                placeholder="Search in name, description",
-                                style="margin: 8px; min-width: 200px; max-width: 400px; width: 33vw;",
-                            ),
-                            h.button(style="margin: 8px")["Search"],
-                        ],
-                    ],
+                body=_render_gallery_body(
+                    query,
+                    sort,
                     (
-                        h.div("#artworks-result")[
-                            (
-                                _render_artworks(artworks)
-                                if artworks
-                                else h.p(
-                                    style="text-align: center; padding: 16px 24px;"
-                                )[
-                                    "No result found for ",
-                                    h.span(style="font-weight: bold")[query],
-                                ]
-                            )
+                        _render_artworks(
+                            artworks.items,
+                            next_url=_next_page_url(query, sort, artworks.next_cursor),
+                            snippets=artworks.snippets,
+                        )
+                        if artworks.items
+                        else h.p(style="text-align: center; padding: 16px 24px;")[
+                            "No result found for ",
+                            h.span(style="font-weight: bold")[query],
                         ]
                     ),
-                ],
+                ),
             )
         )
@@ -1,75 +1,134 @@
 import os
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import HTMLResponse
-from PIL import Image
-from pydantic import BaseModel
+from PIL import Image, UnidentifiedImageError
+from pydantic import BaseModel, ValidationError
 
 from app.models import (
     Artwork,
     ArtworkPublic,
 )
 from constants import UPLOAD_DIR
+from libs.blobs import UPLOAD_TMP_DIR, store_blob
 from libs.db import SessionDep
 from libs.dependencies import CurrentUser
-from libs.upload import save_file
+from libs.renditions import schedule_renditions
+from libs.search import get_search_backend
+from libs.upload import StreamedFile, UploadError, stream_multipart_upload
 
 from .view import _render_artwork
 
 
 class UploadArtworkForm(BaseModel):
+    """non-file fields of upload form, `image` file is streamed separately"""
+
     name: str
     description: str
-    image: UploadFile
+
+
+# body is parsed manually (streamed), so FastAPI can't generate the schema
+_upload_openapi_extra = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["name", "description", "image"],
+                    "properties": {
+                        "name": {"type": "string"},
+                        "description": {"type": "string"},
+                        "image": {"type": "string", "format": "binary"},
+                    },
+                }
+            }
+        },
+    }
+}
 
 
 def mount_apis(router: APIRouter):
-    def _upload_artwork_base(
-        form: Annotated[UploadArtworkForm, Form(media_type="multipart/form-data")],
-        user: CurrentUser,
-        db: SessionDep,
+    def _create_artwork(
+        form: UploadArtworkForm, image: StreamedFile, user_id: int, db: SessionDep
     ) -> Artwork:
-        """Upload a new artwork, return created artwork"""
-        content_type = form.image.content_type
-        if not content_type or not content_type.startswith("image"):
+        """blocking part of upload: read image size, store file and insert artwork"""
+        try:
+            with Image.open(image.path) as im:
+                width = im.width
+                height = im.height
+        except UnidentifiedImageError:
             raise HTTPException(status_code=400, detail="Expected image")
 
-        file_size = form.image.size
-        if not file_size:
-            raise HTTPException(status_code=400, detail="Cannot determine size of file")
-
-        user_uploads_folder = os.path.join(UPLOAD_DIR, "user-uploads")
-        os.makedirs(user_uploads_folder, exist_ok=True)
-
-        save_path = save_file(form.image, user_uploads_folder)
-        relpath = os.path.relpath(save_path, start=UPLOAD_DIR)
-        if not save_path.startswith(UPLOAD_DIR):
-            raise AssertionError(
-                f"File saved in '{save_path}' ({relpath}) which is outside upload dir '{UPLOAD_DIR}'"
-            )
-
-        with Image.open(save_path) as im:
-            width = im.width
-            height = im.height
-
+        blob, is_new_blob = store_blob(db, image)
         artwork = Artwork(
             name=form.name,
             description=form.description,
-            path=relpath,
-            author=user,
+            path=blob.path,
+            blob_sha256=blob.sha256,
+            author_id=user_id,
             width=width,
             height=height,
-            file_size=form.image.size or -1,
+            file_size=image.size,
         )
 
-        db.add(artwork)
-        db.commit()
+        try:
+            db.add(artwork)
+            db.flush()
+            # committed together with artwork, so it's never lost or run too early
+            schedule_renditions(db, artwork.id)
+            db.commit()
+        except Exception:
+            if is_new_blob:
+                os.remove(os.path.join(UPLOAD_DIR, blob.path))
+            raise
         db.refresh(artwork)
+        get_search_backend(db).index_artwork(artwork)
 
         return artwork
 
-    @router.post("/upload", response_model=ArtworkPublic)
+    async def _upload_artwork_base(
+        request: Request,
+        user: CurrentUser,
+        db: SessionDep,
+    ) -> Artwork:
+        """Upload a new artwork, return created artwork
+
+        request body is streamed directly to upload folder (see `stream_multipart_upload`),
+        then moved into content-addressed storage (see `store_blob`)
+        """
+        os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+        try:
+            streamed = await stream_multipart_upload(request, UPLOAD_TMP_DIR)
+        except UploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        image = streamed.files.get("image")
+        try:
+            try:
+                form = UploadArtworkForm.model_validate(streamed.fields)
+            except ValidationError as e:
+                raise RequestValidationError(e.errors(include_url=False))
+            if not image or not image.content_type.startswith("image"):
+                raise HTTPException(status_code=400, detail="Expected image")
+            if not image.size:
+                raise HTTPException(status_code=400, detail="Empty file")
+
+            return await run_in_threadpool(_create_artwork, form, image, user.id, db)
+        finally:
+            # image is moved into the store (or removed) by `store_blob`, anything
+            # else, or the image after a failure, is left in the temporary dir
+            for file in streamed.files.values():
+                if os.path.exists(file.path):
+                    os.remove(file.path)
+
+    @router.post(
+        "/upload", response_model=ArtworkPublic, openapi_extra=_upload_openapi_extra
+    )
     def upload_artwork(
         created_artwork: Annotated[Artwork, Depends(_upload_artwork_base)],
     ):
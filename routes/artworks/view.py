@@ -1,22 +1,88 @@
-from typing import Sequence
+import os
+from typing import Any, AsyncIterator, Callable, Mapping, Sequence
 
 import htpy as h
+from markupsafe import Markup
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.models import (
     Artwork,
 )
+from libs.db import async_engine
+from libs.fragment_cache import FragmentCache
+from libs.html import STREAM_SLOT
+from libs.pagination import encode_cursor
+from libs.renditions import RENDITION_FORMATS, srcset
+from libs.server_timing import timed
 
+GRID_IMAGE_SIZES = "(max-width: 640px) 100vw, 400px"
 
-def _render_artwork(artwork: Artwork, *, extra_classes: list[str] | None = None):
-    class_ = " ".join(["artwork"] + (extra_classes or []))
-    return h.div(class_=class_)[
+# rendered artwork cards (without counters), see `_render_artwork`
+card_cache = FragmentCache(
+    max_size=int(os.environ.get("CARD_CACHE_MAX_SIZE", 16 * 1024 * 1024))
+)
+
+
+def _render_artwork_image(
+    artwork: Artwork, *, sizes: str, style: str, lazy: bool = True
+):
+    """Render artwork image, using renditions (if generated) with `srcset`
+
+    the last format of `RENDITION_FORMATS` is used for <img>, as fallback.
+    placeholder is painted as background until image loads (see `libs/placeholders.py`)
+    """
+    renditions = artwork.renditions
+    placeholder_attrs = {}
+    if artwork.dominant_color and artwork.placeholder:
+        style = f"{style} background: {artwork.dominant_color} url({artwork.placeholder}) center / cover no-repeat;"
+        # removed after load, so it doesn't show through transparent images
+        placeholder_attrs["onload"] = "this.style.removeProperty('background')"
+    img_attrs = {
+        "style": style,
+        "alt": artwork.name,
+        "width": artwork.width,
+        "height": artwork.height,
+        "decoding": "async",
+        "loading": "lazy" if lazy else False,
+        **placeholder_attrs,
+    }
+    if not renditions:
+        return h.img(src=f"/uploads/{artwork.path}", **img_attrs)
+
+    *source_formats, (_, fallback_format, _) = RENDITION_FORMATS
+    fallback = max(
+        (r for r in renditions if r.format == fallback_format),
+        key=lambda rendition: rendition.width,
+        default=None,
+    )
+    # renditions may be partly generated, <img> must always have a source
+    if fallback is None:
+        return h.img(src=f"/uploads/{artwork.path}", **img_attrs)
+
+    return h.picture[
+        (
+            h.source(type=f"image/{ext}", srcset=srcset(renditions, ext), sizes=sizes)
+            for _, ext, _ in source_formats
+        ),
+        h.img(
+            src=f"/uploads/{fallback.path}",
+            srcset=srcset(renditions, fallback_format),
+            sizes=sizes,
+            **img_attrs,
+        ),
+    ]
+
+
+def _render_artwork_content(artwork: Artwork, *, snippet: str | None = None):
+    return [
         h.a(
             href=f"/artworks/{artwork.id}.html",
             style="color: unset",
         )[
-            h.img(
-                src=f"/uploads/{artwork.path}",
-                style="width: 100%; aspect-ratio: 16/9; object-fit: cover; padding: 2px; border: 2px solid red;",
+            _render_artwork_image(
+                artwork,
+                sizes=GRID_IMAGE_SIZES,
+                style="width: 100%; height: auto; aspect-ratio: 16/9; object-fit: cover; padding: 2px; border: 2px solid red;",
             ),
         ],
         h.p(style="padding-bottom: 8px; font-weight: bold;")[
@@ -25,9 +91,9 @@ def _render_artwork(artwork: Artwork, *, extra_classes: list[str] | None = None)
                 style="color: unset;",
             )[f"{artwork.name} - #{artwork.id}"]
         ],
-        h.p[artwork.description],
+        h.p[Markup(snippet) if snippet else artwork.description],
         h.p(style="opacity: 0.75")[
-            f"{artwork.created_at.strftime("%b %d, %Y")}",
+            artwork.created_at.strftime("%b %d, %Y"),
             artwork.author
             and [
                 h.span[" - "],
@@ -40,9 +106,107 @@ def _render_artwork(artwork: Artwork, *, extra_classes: list[str] | None = None)
     ]
 
 
+@timed("render")
+def _render_artwork(
+    artwork: Artwork,
+    *,
+    extra_classes: list[str] | None = None,
+    snippet: str | None = None,
+) -> Markup:
+    """Render artwork card
+
+    content is cached in `card_cache` by (ID, `updated_at`, author's username), so
+    anything rendered there must bump `updated_at` when changed. counters change
+    too often for that, they are rendered on every call
+
+    - snippet: HTML of highlighted description from search, shown instead of description
+    """
+    if snippet:
+        # depends on search query, not worth caching
+        content = Markup(
+            h.render_node(_render_artwork_content(artwork, snippet=snippet))
+        )
+    else:
+        content = card_cache.get_or_render(
+            (
+                artwork.id,
+                artwork.updated_at,
+                artwork.author and artwork.author.username,
+            ),
+            lambda: h.render_node(_render_artwork_content(artwork)),
+        )
+    counters = h.p(style="opacity: 0.75; font-size: 0.875em;")[
+        f"♥ {artwork.favorite_count} favorites · {artwork.comment_count} comments"
+    ]
+    class_ = " ".join(["artwork"] + (extra_classes or []))
+    return Markup('<div class="%s">%s%s</div>') % (class_, content, Markup(counters))
+
+
+def _render_next_page_loader(next_url: str | None):
+    """Invisible element that loads next page (from `.phtml` partial) when scrolled into view
+
+    it's shifted up by one viewport, so next page is prefetched before user reaches the end
+    """
+    return next_url and h.div(
+        class_="artworks-next-page",
+        hx_get=next_url,
+        hx_trigger="intersect once",
+        hx_swap="outerHTML",
+        style="position: relative; top: -100vh; height: 1px;",
+    )
+
+
+def _render_artworks_next_page(
+    artworks: Sequence[Artwork],
+    *,
+    next_url: str | None,
+    snippets: Mapping[int, str] | None = None,
+):
+    """Render continuation of `_render_artworks`, cards are appended to the grid (OOB swap)
+    and the loader that requested this page is replaced with loader of next page
+    """
+    snippets = snippets or {}
+    return [
+        h.div(hx_swap_oob="beforeend:#artwork-grid")[
+            (
+                _render_artwork(artwork, snippet=snippets.get(artwork.id))
+                for artwork in artworks
+            )
+        ],
+        _render_next_page_loader(next_url),
+    ]
+
+
 def _render_artworks(
-    artworks: Sequence[Artwork], *, title: str | None = None, show_upload: bool = False
+    artworks: Sequence[Artwork],
+    *,
+    title: str | None = None,
+    show_upload: bool = False,
+    next_url: str | None = None,
+    snippets: Mapping[int, str] | None = None,
 ):
+    snippets = snippets or {}
+    return _render_artworks_grid(
+        (
+            _render_artwork(artwork, snippet=snippets.get(artwork.id))
+            for artwork in artworks
+        ),
+        _render_next_page_loader(next_url),
+        title=title,
+        show_upload=show_upload,
+    )
+
+
+def _render_streamed_artworks(*, title: str | None = None, show_upload: bool = False):
+    """Like `_render_artworks`, but cards and loader are left as `STREAM_SLOT`s,
+    to be filled by `ArtworkCardStream.cards` and `ArtworkCardStream.loader`
+    """
+    return _render_artworks_grid(
+        STREAM_SLOT, STREAM_SLOT, title=title, show_upload=show_upload
+    )
+
+
+def _render_artworks_grid(cards, loader, *, title: str | None, show_upload: bool):
     return h.div(".container")[
         title and h.h1[title],
         show_upload
@@ -77,5 +241,63 @@ def _render_artworks(
         h.div(
             style="display: grid; grid-template-columns: repeat(auto-fill, minmax(300px, 1fr))",
             id="artwork-grid",
-        )[(_render_artwork(artwork) for artwork in artworks)],
+        )[cards],
+        loader,
     ]
+
+
+# rows fetched from DB at once when streaming cards
+STREAM_BATCH_SIZE = 10
+
+
+class ArtworkCardStream:
+    """Render artwork cards while they're being fetched (server-side cursor), for
+    `stream_page_layout` with body from `_render_streamed_artworks`
+
+    - statement: from `apply_keyset`, with relationships rendered in card eager loaded
+    - key_of: keyset values of row, like in `make_page`
+    - next_url: URL of next page, from next cursor
+    - artwork_of: artwork of row, when statement doesn't select `Artwork`
+    """
+
+    def __init__(
+        self,
+        statement,
+        *,
+        limit: int,
+        key_of: Callable[[Any], tuple[Any, ...]],
+        next_url: Callable[[str], str],
+        artwork_of: Callable[[Any], Artwork] = lambda row: row,
+    ):
+        self.statement = statement
+        self.limit = limit
+        self.key_of = key_of
+        self.next_url = next_url
+        self.artwork_of = artwork_of
+        self.next_cursor: str | None = None
+
+    async def cards(self) -> AsyncIterator[str]:
+        # own session, because dependencies are closed before response body is sent
+        async with AsyncSession(async_engine) as db:
+            result = await db.stream_scalars(
+                self.statement.execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            count = 0
+            last = None
+            async for rows in result.partitions():
+                cards = []
+                for row in rows:
+                    count += 1
+                    if count > self.limit:
+                        # extra row from `apply_keyset`: there is next page
+                        self.next_cursor = encode_cursor(*self.key_of(last))
+                        break
+                    last = row
+                    cards.append(_render_artwork(self.artwork_of(row)))
+                if cards:
+                    yield "".join(cards)
+
+    async def loader(self) -> AsyncIterator[str]:
+        """loader of next page, must be consumed after `cards`"""
+        if self.next_cursor:
+            yield str(_render_next_page_loader(self.next_url(self.next_cursor)))
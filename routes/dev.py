@@ -8,8 +8,16 @@ from sqlmodel import SQLModel, col, select
 
 from app.models import User
 from constants import UPLOAD_DIR
+from libs.blobs import StorageReport, storage_report
 from libs.db import SessionDep, create_db_and_tables
+from libs.fragment_cache import FragmentCacheStats
+from libs.image_variants import ImageCacheStats, variant_cache
+from libs.jobs import JobStats, job_stats
+from libs.password import PasswordPoolStats, password_pool_stats
+from libs.sessions import SessionStats, revoke_user_sessions, session_stats
 from libs.upload import save_file
+from libs.user_cache import invalidate_user
+from routes.artworks.view import card_cache
 
 router = APIRouter()
 
@@ -18,6 +26,7 @@ router = APIRouter()
 def dev_drop_table(session: SessionDep):
     SQLModel.metadata.drop_all(session.connection())
     create_db_and_tables()
+    invalidate_user()
     return {"details": "Dropped and re-created all tables"}
 
 
@@ -25,6 +34,7 @@ def dev_drop_table(session: SessionDep):
 def dev_drop_table_only(session: SessionDep):
     SQLModel.metadata.drop_all(session.connection())
     # create_db_and_tables()
+    invalidate_user()
     return {"details": "Dropped tables"}
 
 
@@ -45,9 +55,53 @@ def dev_delete_user(id: int, session: SessionDep):
         .delete()
     )
     session.commit()
+    invalidate_user(id)
+    revoke_user_sessions(session, id)
     return {"delete_count": delete_count}
 
 
+@router.post("/revoke-sessions/{user_id}")
+def dev_revoke_sessions(user_id: int, session: SessionDep):
+    """Log user out of all browsers"""
+    return {"revoke_count": revoke_user_sessions(session, user_id)}
+
+
+@router.get("/sessions", response_model=SessionStats)
+def dev_session_stats():
+    """Session cache hit / miss, and how many writes / cookies were avoided"""
+    return session_stats()
+
+
+@router.get("/storage-report", response_model=StorageReport)
+def dev_storage_report(session: SessionDep):
+    """How much space is saved by content-addressed storage (deduplication)"""
+    return storage_report(session)
+
+
+@router.get("/card-cache", response_model=FragmentCacheStats)
+def dev_card_cache_stats():
+    """Hit / miss of rendered artwork card cache"""
+    return card_cache.stats()
+
+
+@router.get("/image-cache", response_model=ImageCacheStats)
+def dev_image_cache_stats():
+    """Hit / miss and size of disk cache of resized images (`/img/{id}`)"""
+    return variant_cache.stats()
+
+
+@router.get("/password-pool", response_model=PasswordPoolStats)
+def dev_password_pool_stats():
+    """Hash latency and queue wait of password hashing process pool"""
+    return password_pool_stats()
+
+
+@router.get("/jobs", response_model=JobStats)
+def dev_job_stats(session: SessionDep):
+    """Background job queue, `due` growing means workers can't keep up"""
+    return job_stats(session)
+
+
 class TagsQuery(BaseModel):
     # http://localhost:8000/_dev/test-get/doge?tags=foo&tags=bat&category_ids=1&category_ids=2'
     tags: list[str]
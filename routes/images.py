@@ -0,0 +1,65 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+from sqlmodel import col, select
+
+from app.models import Artwork
+from libs.common import ErrorDetail
+from libs.db import AsyncSessionDep
+from libs.image_variants import (
+    MAX_DIMENSION,
+    Fit,
+    media_type,
+    negotiate_format,
+    variant_box,
+    variant_cache,
+)
+from libs.static import IMMUTABLE_CACHE_CONTROL
+
+router = APIRouter()
+
+Dimension = Annotated[int | None, Query(ge=1, le=MAX_DIMENSION)]
+
+
+@router.get(
+    "/{artwork_id}",
+    response_class=FileResponse,
+    responses={404: {"model": ErrorDetail}},
+)
+async def get_artwork_image(
+    artwork_id: int,
+    db: AsyncSessionDep,
+    w: Dimension = None,
+    h: Dimension = None,
+    fit: Fit = "contain",
+    accept: Annotated[str | None, Header()] = None,
+):
+    """Artwork image resized to fit `w` x `h` (never upscaled), in best format
+    accepted by client (AVIF, WebP or JPEG). `cover` needs both `w` and `h`
+    """
+    row = (
+        await db.exec(
+            select(Artwork.path, Artwork.width, Artwork.height).where(
+                col(Artwork.id) == artwork_id
+            )
+        )
+    ).one_or_none()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Artwork not found")
+    # don't hold connection while rendering
+    await db.close()
+
+    path, width, height = row
+    ext = negotiate_format(accept)
+    box_w, box_h, fit = variant_box(width, height, w, h, fit)
+    try:
+        file_path = await variant_cache.get_or_render(path, (box_w, box_h), fit, ext)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Artwork image not found")
+
+    return FileResponse(
+        file_path,
+        media_type=media_type(ext),
+        headers={"cache-control": IMMUTABLE_CACHE_CONTROL, "vary": "Accept"},
+    )
@@ -1,11 +1,11 @@
 import json
 import random
-from typing import Annotated, Any, Sequence
+from typing import Annotated, Any
 
 import htpy as h
 import sqlalchemy.exc
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import HTMLResponse, StreamingResponse
 from markupsafe import Markup
 from pydantic import BaseModel
 from sqlalchemy.orm import joinedload
@@ -13,31 +13,62 @@ from sqlmodel import col, select
 
 from app.models import (
     Artwork,
-    ArtworkPublic,
+    ArtworkListItem,
     User,
     UserCreate,
     UserFavoriteArtwork,
     UserPublic,
 )
 from libs.common import ErrorDetail, MessageResponse
-from libs.db import SessionDep
+from libs.conditional import artwork_version_columns, artworks_version, check_etag
+from libs.db import AsyncSessionDep, SessionDep
 from libs.dependencies import CurrentUser, CurrentUserOrNone
-from libs.html import make_redirect_response, page_layout
-from libs.password import PasswordValidationError, hash_password, verify_password
-from routes.artworks.view import _render_artworks
+from libs.favorites import load_favorited_sync, with_favorited
+from libs.html import make_redirect_response, page_layout, stream_page_layout
+from libs.pagination import (
+    DEFAULT_PAGE_SIZE,
+    CursorPage,
+    Page,
+    PageSize,
+    apply_keyset,
+    make_page,
+)
+from libs.password import (
+    PasswordPoolBusy,
+    PasswordValidationError,
+    hash_password_async,
+    verify_password_async,
+)
+from libs.user_cache import invalidate_user
+from routes.artworks.apis import _user_artworks_page, _user_artworks_statement
+from routes.artworks.view import (
+    ArtworkCardStream,
+    _render_artworks,
+    _render_artworks_next_page,
+    _render_streamed_artworks,
+)
 
 router = APIRouter()
 
 
-def _register_base(user: UserCreate, session: SessionDep) -> User:
-    existing_user = session.exec(
-        select(User).where(User.username == user.username)
+def _password_pool_busy():
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please try again later",
+        headers={"Retry-After": "1"},
+    )
+
+
+async def _register_base(user: UserCreate, session: AsyncSessionDep) -> User:
+    existing_user = (
+        await session.exec(select(User).where(User.username == user.username))
     ).first()
 
     if existing_user:
         if not existing_user.email_confirmed:
-            session.delete(existing_user)
-            session.flush()  # need to flush
+            await session.delete(existing_user)
+            await session.flush()  # need to flush
+            invalidate_user(existing_user.id)
             print(f">> deleted unconfirmed user of {user.username}")
         else:
             # very raw
@@ -52,7 +83,10 @@ def _register_base(user: UserCreate, session: SessionDep) -> User:
     email_token = str(random.randint(100_000, 999_999))
     print(f">> use this code {email_token} to confirm email for {user.username}")
 
-    user.password = hash_password(user.password)
+    try:
+        user.password = await hash_password_async(user.password)
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
     db_user = User(
         username=user.username,
         password=user.password,
@@ -61,7 +95,7 @@ def _register_base(user: UserCreate, session: SessionDep) -> User:
     )
 
     session.add(db_user)
-    session.commit()
+    await session.commit()
 
     return db_user
 
@@ -156,6 +190,7 @@ def user_email_confirmation(token: str, session: SessionDep):
     user.email_confirmed = True
     session.add(user)
     session.commit()
+    invalidate_user(user.id)
 
     print("almost return")
     return user
@@ -166,20 +201,26 @@ class LoginDto(BaseModel):
     password: str
 
 
-def _login_user(login: LoginDto, session: SessionDep, request: Request) -> User:
+async def _login_user(
+    login: LoginDto, session: AsyncSessionDep, request: Request
+) -> User:
     try:
-        user = session.exec(select(User).where(User.username == login.username)).one()
-        request.session["user_id"] = user.id
-        request.session["user_username"] = user.username
+        user = (
+            await session.exec(select(User).where(User.username == login.username))
+        ).one()
     except sqlalchemy.exc.NoResultFound:
         print(">> invalid username")
         raise HTTPException(status_code=401, detail="Invalid username or password")
     try:
-        verify_password(login.password, user.password)
+        await verify_password_async(login.password, user.password)
     except PasswordValidationError:
         print(">> invalid password")
         raise HTTPException(status_code=401, detail="Invalid username or password")
+    except PasswordPoolBusy:
+        raise _password_pool_busy()
 
+    request.session["user_id"] = user.id
+    request.session["user_username"] = user.username
     return user
 
 
@@ -188,7 +229,7 @@ def _login_user(login: LoginDto, session: SessionDep, request: Request) -> User:
 )
 def login_user(logged_in_user: Annotated[Any, Depends(_login_user)]):
     """Login, return logged in user"""
-    return login_user
+    return logged_in_user
 
 
 @router.post(
@@ -279,45 +320,63 @@ def logout_user_html(logout_result: Annotated[MessageResponse, Depends(_logout_b
 
 
 @router.post("/me", response_model=UserPublic)
-def get_current_user(user: CurrentUser):
-    return user
+async def get_current_user(user: CurrentUser, db: AsyncSessionDep, request: Request):
+    # `CurrentUser` is a cached snapshot, get all fields for response
+    db_user = await db.get(User, user.id)
+    if db_user is None:
+        # deleted since it was cached, same as `libs.dependencies.get_current_user`
+        invalidate_user(user.id)
+        request.session.clear()
+        raise HTTPException(status_code=401, detail="User is deleted")
+    return db_user
 
 
-def _get_user_by_id_base(user_id: int, db: SessionDep):
+async def _get_user_by_id_base(user_id: int, db: AsyncSessionDep):
     """return user by ID"""
     try:
-        user = db.exec(select(User).where(User.id == user_id)).one()
+        user = (await db.exec(select(User).where(User.id == user_id))).one()
         return user
     except sqlalchemy.exc.NoResultFound:
         raise HTTPException(status_code=404, detail="User not found")
 
 
 @router.get("/{user_id}.html", response_class=HTMLResponse, include_in_schema=False)
-def user_profile_page(
+async def user_profile_page(
     *,
     user: Annotated[User, Depends(_get_user_by_id_base)],
     current_user: CurrentUserOrNone,
     user_id: int,
     tab: str = "artworks",
-    db: SessionDep,
 ):
+    """User profile with artworks / favorites tab, streamed (see `ArtworkCardStream`)"""
     sub_page = None
+    streams = []
     if tab == "artworks":
-        sub_page = h.render_node(
-            [
-                _render_artworks(_list_user_artworks_base(user_id=user_id, db=db)),
-            ]
+        stream = ArtworkCardStream(
+            _user_artworks_statement(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE),
+            limit=DEFAULT_PAGE_SIZE,
+            key_of=lambda artwork: (artwork.created_at, artwork.id),
+            next_url=lambda cursor: _user_artworks_next_url(user_id, cursor),  # type: ignore
         )
+        sub_page = _render_streamed_artworks()
+        streams = [stream.cards(), stream.loader()]
     elif tab == "favorites":
-        sub_page = _render_artworks(
-            _list_user_favorite_artworks_base(user_id=user_id, db=db)
+        stream = ArtworkCardStream(
+            _user_favorites_statement(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE),
+            limit=DEFAULT_PAGE_SIZE,
+            key_of=lambda favorite: (favorite.favorited_at, favorite.artwork_id),
+            next_url=lambda cursor: _user_favorite_artworks_next_url(user_id, cursor),  # type: ignore
+            artwork_of=lambda favorite: favorite.artwork,
         )
+        sub_page = _render_streamed_artworks()
+        streams = [stream.cards(), stream.loader()]
 
     initial_state = json.dumps({"tab": tab})
 
-    return HTMLResponse(
-        page_layout(
-            user=current_user,
+    return StreamingResponse(
+        stream_page_layout(
+            current_user,
+            streams=streams,
             body=h.div(
                 style="padding: 16px 24px", id="profile-app", x_data=initial_state
             )[
@@ -372,71 +431,148 @@ def user_profile_page(
                     id="artworks-list",
                 )[sub_page],
             ],
-        )
+        ),
+        media_type="text/html",
     )
 
 
 @router.get("/{user_id}", response_model=UserPublic)
-def get_user_by_id(user: Annotated[User, Depends(_get_user_by_id_base)]):
+async def get_user_by_id(user: Annotated[User, Depends(_get_user_by_id_base)]):
     """return user by ID"""
     return user
 
 
-def _list_user_artworks_base(user_id: int, db: SessionDep) -> Sequence[Artwork]:
+def _list_user_artworks_base(
+    user_id: int,
+    db: SessionDep,
+    cursor: str | None = None,
+    limit: PageSize = DEFAULT_PAGE_SIZE,
+) -> Page[Artwork]:
     """list user artworks"""
     user_artworks = db.exec(
-        select(Artwork)
-        .options(
-            joinedload(Artwork.author),
-        )
-        .where(
-            Artwork.author_id == user_id,
-        )
-        .order_by(col(Artwork.created_at).desc())
+        _user_artworks_statement(user_id, cursor=cursor, limit=limit)
     ).all()
-    return user_artworks
+    return make_page(
+        user_artworks,
+        limit=limit,
+        key_of=lambda artwork: (artwork.created_at, artwork.id),
+    )
+
 
+def _user_artworks_next_url(user_id: int, next_cursor: str | None) -> str | None:
+    return next_cursor and f"/user/{user_id}/artworks.phtml?cursor={next_cursor}"
+
+
+async def _user_artworks_etag(
+    request: Request,
+    response: Response,
+    user_id: int,
+    db: AsyncSessionDep,
+    current_user: CurrentUserOrNone,
+    cursor: str | None = None,
+    limit: PageSize = DEFAULT_PAGE_SIZE,
+):
+    """304 if page of user's artworks didn't change (see `libs.conditional`), per
+    viewer because of `favorited_by_me`
+    """
+    page = _user_artworks_page(
+        select(*artwork_version_columns()), user_id, cursor=cursor, limit=limit
+    )
+    version = (await db.exec(artworks_version(page))).one()
+    check_etag(request, response, (*version, current_user and current_user.id))
 
-@router.get("/{user_id}/artworks", response_model=list[ArtworkPublic])
+
+def _with_favorited(
+    page: Page[Artwork], db: SessionDep, current_user: CurrentUserOrNone
+) -> Page[ArtworkListItem]:
+    """page with `favorited_by_me` of current user, one query for whole page"""
+    favorited = load_favorited_sync(db, current_user and current_user.id, page.items)
+    return page._replace(items=with_favorited(page.items, favorited))
+
+
+@router.get("/{user_id}/artworks", response_model=CursorPage[ArtworkListItem])
 def list_user_artworks(
-    user_artworks: Annotated[Sequence[Artwork], Depends(_list_user_artworks_base)],
+    _: Annotated[None, Depends(_user_artworks_etag)],
+    user_artworks: Annotated[Page[Artwork], Depends(_list_user_artworks_base)],
+    db: SessionDep,
+    current_user: CurrentUserOrNone,
 ):
     """list user artworks"""
-    return user_artworks
+    return _with_favorited(user_artworks, db, current_user)
 
 
 @router.get(
     "/{user_id}/artworks.phtml", response_class=HTMLResponse, include_in_schema=False
 )
 def list_user_artworks_partial_html(
-    user_artworks: Annotated[Sequence[Artwork], Depends(_list_user_artworks_base)],
+    user_artworks: Annotated[Page[Artwork], Depends(_list_user_artworks_base)],
+    user_id: int,
+    cursor: str | None = None,
 ):
-    """partial HTML response for listing artworks"""
-    return HTMLResponse(_render_artworks(user_artworks))
+    """partial HTML response for listing artworks, or next page of it when `cursor` is given"""
+    next_url = _user_artworks_next_url(user_id, user_artworks.next_cursor)
+    if cursor:
+        return HTMLResponse(
+            h.render_node(
+                _render_artworks_next_page(user_artworks.items, next_url=next_url)
+            )
+        )
+    return HTMLResponse(_render_artworks(user_artworks.items, next_url=next_url))
 
 
-def _list_user_favorite_artworks_base(user_id: int, db: SessionDep) -> list[Artwork]:
-    """return list of artworks favorited by user"""
-    favorites = db.exec(
+def _user_favorites_statement(user_id: int, *, cursor: str | None, limit: int):
+    return apply_keyset(
         select(UserFavoriteArtwork)
         .options(
             joinedload(UserFavoriteArtwork.artwork).joinedload(Artwork.author),
+            joinedload(UserFavoriteArtwork.artwork).selectinload(Artwork.renditions),
         )
-        .where(UserFavoriteArtwork.user_id == user_id)
-        .order_by(col(UserFavoriteArtwork.favorited_at).desc())
+        .where(UserFavoriteArtwork.user_id == user_id),
+        keys=(
+            col(UserFavoriteArtwork.favorited_at),
+            col(UserFavoriteArtwork.artwork_id),
+        ),
+        cursor=cursor,
+        limit=limit,
     )
-    favorited_artworks = [favorite.artwork for favorite in favorites]
-    return favorited_artworks
 
 
-@router.get("/{user_id}/favorite-artworks", response_model=list[ArtworkPublic])
+def _list_user_favorite_artworks_base(
+    user_id: int,
+    db: SessionDep,
+    cursor: str | None = None,
+    limit: PageSize = DEFAULT_PAGE_SIZE,
+) -> Page[Artwork]:
+    """return list of artworks favorited by user"""
+    favorites = db.exec(
+        _user_favorites_statement(user_id, cursor=cursor, limit=limit)
+    ).all()
+    page = make_page(
+        favorites,
+        limit=limit,
+        key_of=lambda favorite: (favorite.favorited_at, favorite.artwork_id),
+    )
+    return page._replace(items=[favorite.artwork for favorite in page.items])
+
+
+def _user_favorite_artworks_next_url(
+    user_id: int, next_cursor: str | None
+) -> str | None:
+    return next_cursor and (
+        f"/user/{user_id}/favorite-artworks.phtml?cursor={next_cursor}"
+    )
+
+
+@router.get("/{user_id}/favorite-artworks", response_model=CursorPage[ArtworkListItem])
 def list_user_favorite_artworks(
     user_favorite_artworks: Annotated[
-        list[Artwork], Depends(_list_user_favorite_artworks_base)
+        Page[Artwork], Depends(_list_user_favorite_artworks_base)
     ],
+    db: SessionDep,
+    current_user: CurrentUserOrNone,
 ):
     """List artworks favorited by user"""
-    return user_favorite_artworks
+    return _with_favorited(user_favorite_artworks, db, current_user)
 
 
 @router.get(
@@ -446,7 +582,22 @@ def list_user_favorite_artworks(
 )
 def list_user_favorite_artworks_partial_html(
     user_favorite_artworks: Annotated[
-        list[Artwork], Depends(_list_user_favorite_artworks_base)
+        Page[Artwork], Depends(_list_user_favorite_artworks_base)
     ],
+    user_id: int,
+    cursor: str | None = None,
 ):
-    return HTMLResponse(_render_artworks(user_favorite_artworks))
+    next_url = _user_favorite_artworks_next_url(
+        user_id, user_favorite_artworks.next_cursor
+    )
+    if cursor:
+        return HTMLResponse(
+            h.render_node(
+                _render_artworks_next_page(
+                    user_favorite_artworks.items, next_url=next_url
+                )
+            )
+        )
+    return HTMLResponse(
+        _render_artworks(user_favorite_artworks.items, next_url=next_url)
+    )